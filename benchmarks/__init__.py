@@ -0,0 +1 @@
+""" Benchmarks of the repositories, search and serializers """
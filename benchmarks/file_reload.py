@@ -0,0 +1,97 @@
+"""
+Benchmark for the FileRepository startup
+
+Compares the streaming, lazy reload against the previous eager one, which
+loaded the whole file with json.load and built every instance. Run it
+from the project root with:
+
+    python -m benchmarks.file_reload
+"""
+
+from datetime import datetime
+import json
+import os
+import tempfile
+from time import perf_counter
+import tracemalloc
+import uuid
+
+from src.models.review import Review
+from src.persistence.file import FileRepository
+
+SIZES = [10_000, 100_000, 500_000]
+
+
+def write_file(size: int) -> str:
+    """Writes a data.json with `size` reviews and returns one of the ids"""
+    now = datetime.now().isoformat()
+    reviews = [
+        {
+            "id": str(uuid.uuid4()), "place_id": "place", "user_id": "user",
+            "comment": f"Review number {i}", "rating": 4.5,
+            "created_at": now, "updated_at": now,
+        }
+        for i in range(size)
+    ]
+
+    with open("data.json", "w") as file:
+        json.dump({"country": [], "review": reviews}, file)
+
+    return reviews[-1]["id"]
+
+
+def eager_reload() -> list:
+    """The reload FileRepository used to do"""
+    with open("data.json") as file:
+        file_data = json.load(file)
+
+    instances = []
+    for item in file_data["review"]:
+        instance = Review(**item)
+        instance.created_at = datetime.fromisoformat(item["created_at"])
+        instance.updated_at = datetime.fromisoformat(item["updated_at"])
+        instances.append(instance)
+
+    return instances
+
+
+def measure(function) -> tuple[float, float]:
+    """Returns the seconds and peak MiB a function takes"""
+    tracemalloc.start()
+    start = perf_counter()
+    function()
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak / (1 << 20)
+
+
+def main() -> None:
+    """Runs the benchmark for every size and prints a table"""
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+
+        print(f"{'rows':>8} {'eager (s)':>10} {'eager (MiB)':>12} "
+              f"{'lazy (s)':>9} {'lazy (MiB)':>11} {'1st get (ms)':>13}")
+
+        for size in SIZES:
+            obj_id = write_file(size)
+            eager = measure(eager_reload)
+            repo = FileRepository()
+            lazy = measure(repo.reload)
+
+            start = perf_counter()
+            repo.get("review", obj_id)
+            first_get = (perf_counter() - start) * 1000
+
+            print(f"{size:>8} {eager[0]:>10.2f} {eager[1]:>12.1f} "
+                  f"{lazy[0]:>9.2f} {lazy[1]:>11.1f} {first_get:>13.3f}")
+
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark for the MemoryRepository lookups
+
+Measures the average latency of get, update and delete while the amount
+of stored reviews grows. Run it from the project root with:
+
+    python -m benchmarks.memory_repository
+"""
+
+from timeit import timeit
+import uuid
+
+from src.models.review import Review
+from src.persistence.memory import MemoryRepository
+
+SIZES = [10, 1_000, 100_000, 1_000_000]
+OPERATIONS = 10_000
+
+
+def fill(repo: MemoryRepository, size: int) -> list[str]:
+    """Saves `size` reviews in the repository and returns their ids"""
+    ids = []
+
+    for i in range(size):
+        review = Review(
+            place_id="place", user_id="user", comment=f"#{i}", rating=5.0,
+            id=str(uuid.uuid4()),
+        )
+        repo.save(review)
+        ids.append(review.id)
+
+    return ids
+
+
+def measure(repo: MemoryRepository, ids: list[str]) -> dict[str, float]:
+    """Returns the average latency in microseconds of each operation"""
+    # Always hit the last inserted objects, the worst case for a scan
+    targets = ids[-OPERATIONS:]
+    objects = [repo.get("review", obj_id) for obj_id in targets]
+
+    get = timeit(
+        lambda: [repo.get("review", obj_id) for obj_id in targets], number=1
+    )
+    update = timeit(lambda: [repo.update(obj) for obj in objects], number=1)
+    delete = timeit(lambda: [repo.delete(obj) for obj in objects], number=1)
+
+    return {
+        "get": get / len(targets) * 1e6,
+        "update": update / len(targets) * 1e6,
+        "delete": delete / len(targets) * 1e6,
+    }
+
+
+def main() -> None:
+    """Runs the benchmark for every size and prints a table"""
+    repo = MemoryRepository()
+
+    print(f"{'rows':>10} {'get (us)':>10} {'update (us)':>12} "
+          f"{'delete (us)':>12}")
+
+    for size in SIZES:
+        ids = fill(repo, size)
+        result = measure(repo, ids)
+
+        print(f"{size:>10} {result['get']:>10.3f} {result['update']:>12.3f} "
+              f"{result['delete']:>12.3f}")
+
+        for obj in repo.get_all("review"):
+            repo.delete(obj)
+
+
+if __name__ == "__main__":
+    main()
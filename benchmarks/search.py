@@ -0,0 +1,113 @@
+"""
+Benchmark for the full-text search of places
+
+Compares the FTS5 index with the `LIKE '%q%'` scan it replaces, and with
+the inverted index of the in-memory repositories, for a few queries over
+places with random descriptions. Every path returns the first 50
+matches, but the scan stops as soon as it found them, unranked, while
+the indexes rank every match: the scan is only competitive for terms
+most places have. Run it from the project root with:
+
+    python -m benchmarks.search
+"""
+
+import random
+from timeit import timeit
+
+from src import create_app, db
+from src.models import search
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.user import User
+from src.persistence.indexes import TEXT_INDEXES, TextIndex
+from utils.text import parse_query
+
+SIZES = [1_000, 10_000, 50_000]
+REPEAT = 20
+WORDS = [f"word{i}" for i in range(2_000)] + [
+    "wifi", "pool", "garden", "beach", "quiet", "central", "parking",
+]
+QUERIES = ["wifi", "wifi pool", "garden beach quiet", "word19*"]
+
+
+def fill(size: int, start: int) -> None:
+    """Creates `size` more places with random descriptions"""
+    city = City.query.first()
+    user = User.query.first()
+    rng = random.Random(start)
+
+    Place.create_many([
+        {"name": f"Place {i}", "address": f"Street {i}",
+         "description": " ".join(rng.choices(WORDS, k=20)),
+         "city_id": city.id, "host_id": user.id}
+        for i in range(start, start + size)
+    ])
+
+
+def like(query: str) -> list[Place]:
+    """The scan: every term in some text field"""
+    conditions = [
+        db.or_(*(
+            getattr(Place, field).like(f"%{term}%")
+            for field in Place.text_fields
+        ))
+        for term, _ in parse_query(query)
+    ]
+
+    return Place.query.filter(*conditions).limit(50).all()
+
+
+def measure(index: TextIndex) -> dict[str, dict[str, float]]:
+    """Returns the average time in milliseconds of each query, by path"""
+    paths = {
+        "like": lambda query: like(query),
+        "fts5": lambda query: search.search(query, ["place"], 50),
+        "memory": lambda query: index.search("place", parse_query(query)),
+    }
+
+    return {
+        name: {
+            query: timeit(lambda: path(query), number=REPEAT) / REPEAT * 1e3
+            for query in QUERIES
+        }
+        for name, path in paths.items()
+    }
+
+
+def main() -> None:
+    """Runs the benchmark for every size and prints a table"""
+    app = create_app("src.config.TestingConfig")
+
+    with app.app_context():
+        db.create_all()
+        Country.create("Uruguay", "UY")
+        City.create({"name": "Montevideo", "country_code": "UY"})
+        db.session.add(User(
+            email="host@example.com", first_name="Host", last_name="User",
+            username="host", password_hash="x",
+        ))
+        db.session.commit()
+
+        count = 0
+        print(f"{'rows':>8} {'path':>7} " + " ".join(
+            f"{query:>20}" for query in QUERIES
+        ))
+
+        for size in SIZES:
+            fill(size - count, count)
+            count = size
+
+            index = TextIndex(TEXT_INDEXES)
+            for place in Place.query.yield_per(1_000):
+                index.add("place", place.id, place)
+            db.session.expunge_all()
+
+            for name, times in measure(index).items():
+                print(f"{size:>8} {name:>7} " + " ".join(
+                    f"{times[query]:>18.3f}ms" for query in QUERIES
+                ))
+
+
+if __name__ == "__main__":
+    main()
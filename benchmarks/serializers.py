@@ -0,0 +1,111 @@
+"""
+Benchmark for the serialization of a list of places
+
+Compares the hand-written `to_dict` the models used to have, encoded with
+the json module like Flask's default provider, with the compiled
+serializers and the orjson provider. Run it from the project root with:
+
+    python -m benchmarks.serializers
+"""
+
+import json
+from timeit import timeit
+
+from src import create_app, db
+from src.json_provider import orjson
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.serializers import serializer
+from src.models.user import User
+
+SIZES = [100, 1_000, 10_000]
+REPEAT = 5
+
+
+def legacy_to_dict(place: Place) -> dict:
+    """The hand-written to_dict of Place"""
+    return {
+        "id": place.id,
+        "name": place.name,
+        "description": place.description,
+        "address": place.address,
+        "latitude": place.latitude,
+        "longitude": place.longitude,
+        "city_id": place.city_id,
+        "host_id": place.host_id,
+        "price_per_night": place.price_per_night,
+        "number_of_rooms": place.number_of_rooms,
+        "number_of_bathrooms": place.number_of_bathrooms,
+        "max_guests": place.max_guests,
+        "created_at": place.created_at.isoformat(),
+        "updated_at": place.updated_at.isoformat(),
+    }
+
+
+def fill(size: int) -> list[Place]:
+    """Creates `size` places and returns them loaded"""
+    city = City.query.first()
+    user = User.query.first()
+
+    Place.create_many([
+        {"name": f"Place {i}", "description": "A place", "address": "Here",
+         "latitude": -34.9, "longitude": -56.1, "city_id": city.id,
+         "host_id": user.id, "price_per_night": i, "max_guests": 2}
+        for i in range(size)
+    ])
+
+    return Place.query.all()
+
+
+def measure(places: list[Place]) -> dict[str, float]:
+    """Returns the average time in microseconds per place of each path"""
+    compiled = serializer(Place)
+    paths = {
+        "to_dict": lambda: [legacy_to_dict(place) for place in places],
+        "compiled": lambda: [compiled(place) for place in places],
+        "to_dict+json": lambda: json.dumps(
+            [legacy_to_dict(place) for place in places], sort_keys=True,
+            separators=(",", ":"),
+        ),
+    }
+
+    if orjson is not None:
+        paths["compiled+orjson"] = lambda: orjson.dumps(
+            [compiled(place) for place in places],
+            option=orjson.OPT_SORT_KEYS,
+        )
+
+    return {
+        name: timeit(path, number=REPEAT) / REPEAT / len(places) * 1e6
+        for name, path in paths.items()
+    }
+
+
+def main() -> None:
+    """Runs the benchmark for every size and prints a table"""
+    app = create_app("src.config.TestingConfig")
+
+    with app.app_context():
+        db.create_all()
+        Country.create("Uruguay", "UY")
+        City.create({"name": "Montevideo", "country_code": "UY"})
+        db.session.add(User(
+            email="host@example.com", first_name="Host", last_name="User",
+            username="host", password_hash="x",
+        ))
+        db.session.commit()
+
+        for size in SIZES:
+            result = measure(fill(size))
+
+            print(f"{size:>8} rows " + " ".join(
+                f"{name}: {value:.3f}us" for name, value in result.items()
+            ))
+
+            Place.query.delete()
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,16 @@
 
 from flask.cli import FlaskGroup
 from src import create_app
+from src.commands import (
+    import_command,
+    rebuild_search_command,
+    repair_ratings_command,
+)
 
 cli = FlaskGroup(create_app=create_app)
+cli.add_command(import_command)
+cli.add_command(repair_ratings_command)
+cli.add_command(rebuild_search_command)
 
 
 if __name__ == "__main__":
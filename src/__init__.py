@@ -5,7 +5,7 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
-from src import Config
+from src.json_provider import json_provider
 
 cors = CORS()
 bcrypt = Bcrypt()
@@ -20,9 +20,9 @@ def create_app(config_class="src.config.DevelopmentConfig") -> Flask:
     """
     app = Flask(__name__)
     app.url_map.strict_slashes = False
+    app.json = json_provider(app)
 
-    app.config.from_object(Config)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.db'
+    app.config.from_object(config_class)
 
     register_extensions(app)
     register_routes(app)
@@ -38,25 +38,38 @@ def register_extensions(app: Flask) -> None:
     jwt.init_app(app)
     bcrypt.init_app(app)
 
+    # Imported here to avoid circular imports
+    from src.models import cache
+
+    cache.configure(app.config.get("CACHE_MODELS", {}))
+
 
 def register_routes(app: Flask) -> None:
     """Import and register the routes for the Flask app"""
 
     # Import the routes here to avoid circular imports
-    from src.routes.users import users_bp
+    from src.routes.users import auth_bp, users_bp
     from src.routes.countries import countries_bp
     from src.routes.cities import cities_bp
     from src.routes.places import places_bp
-    from src.routes.amenities import amenities_bp
+    from src.routes.amenities import amenities_bp, place_amenities_bp
     from src.routes.reviews import reviews_bp
+    from src.routes.batch import batch_bp
+    from src.routes.imports import imports_bp
+    from src.routes.search import search_bp
 
     # Register the blueprints in the app
+    app.register_blueprint(auth_bp)
     app.register_blueprint(users_bp)
     app.register_blueprint(countries_bp)
     app.register_blueprint(cities_bp)
     app.register_blueprint(places_bp)
     app.register_blueprint(reviews_bp)
     app.register_blueprint(amenities_bp)
+    app.register_blueprint(place_amenities_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(imports_bp)
+    app.register_blueprint(search_bp)
 
 
 def register_handlers(app: Flask) -> None:
@@ -70,3 +83,9 @@ def register_handlers(app: Flask) -> None:
             {"error": "Bad request", "message": str(e)}, 400
         )
     )
+
+    # Imported here to avoid circular imports
+    from src import compression
+
+    compression.configure(app.config.get("COMPRESSION_CACHE_SIZE", 256))
+    app.after_request(compression.compress)
@@ -0,0 +1,104 @@
+"""
+Commands of the flask CLI, registered in manage.py
+"""
+
+import os
+import click
+from flask.cli import with_appcontext
+from src.models.importer import (
+    CHUNK_SIZE,
+    FORMATS,
+    IMPORTABLE,
+    ImportFailed,
+    import_records,
+    read,
+)
+from src.models import search
+from src.models.place import Place
+
+
+@click.command("import")
+@with_appcontext
+@click.argument("model", type=click.Choice(sorted(IMPORTABLE)))
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format", "format", type=click.Choice(FORMATS), default=None,
+    help="Format of the file, by default its extension (NDJSON otherwise).",
+)
+@click.option(
+    "--chunk-size", type=click.IntRange(min=1), default=CHUNK_SIZE,
+    show_default=True, help="Records inserted per transaction.",
+)
+@click.option(
+    "--checkpoint", type=click.Path(dir_okay=False), default=None,
+    help="File keeping how many records were committed, to resume the "
+    "import from there. Defaults to FILE.checkpoint.",
+)
+def import_command(
+    model: str, file: str, format: str | None, chunk_size: int,
+    checkpoint: str | None,
+) -> None:
+    """Imports the records of an NDJSON or CSV FILE into MODEL."""
+    if format is None:
+        format = "csv" if file.lower().endswith(".csv") else "ndjson"
+    checkpoint = checkpoint or f"{file}.checkpoint"
+
+    skip = 0
+    if os.path.exists(checkpoint):
+        with open(checkpoint, encoding="utf-8") as f:
+            skip = int(f.read().strip() or 0)
+        click.echo(f"Resuming after {skip} records")
+
+    def report(progress: dict) -> None:
+        """Saves the checkpoint and prints the progress of a chunk"""
+        with open(checkpoint, "w", encoding="utf-8") as f:
+            f.write(str(progress["committed"]))
+
+        click.echo(
+            f"{progress['committed']} records committed "
+            f"({progress['records_per_second']} records/s)"
+        )
+
+    with open(file, encoding="utf-8", newline="") as f:
+        try:
+            progress = import_records(
+                IMPORTABLE[model], read(IMPORTABLE[model], f, format),
+                chunk_size, skip, report,
+            )
+        except ImportFailed as e:
+            raise click.ClickException(
+                f"{e}\n{e.committed} records committed, run the command "
+                "again to resume after them"
+            ) from None
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    click.echo(
+        f"Imported {progress['imported']} {model} in "
+        f"{progress['seconds']}s ({progress['records_per_second']} "
+        "records/s)"
+    )
+
+
+@click.command("repair-ratings")
+@with_appcontext
+def repair_ratings_command() -> None:
+    """Recomputes the rating aggregates of the places that drifted from
+    their reviews."""
+    click.echo(f"Repaired {Place.repair_ratings()} places")
+
+
+@click.command("rebuild-search")
+@with_appcontext
+def rebuild_search_command() -> None:
+    """Creates the full-text search index if needed and indexes every
+    place and review again."""
+    try:
+        counts = search.rebuild()
+    except ValueError as e:
+        raise click.ClickException(str(e)) from None
+
+    click.echo(
+        f"Indexed {counts['place']} places and {counts['review']} reviews"
+    )
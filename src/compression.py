@@ -0,0 +1,235 @@
+"""
+Compression of the responses of the Flask app
+
+Text responses (JSON, NDJSON, ...) are compressed with the best encoding
+the client accepts (`Accept-Encoding`) among the available ones: zstd and
+brotli when their packages (zstandard, brotli) are installed, and gzip
+and deflate from the standard library. Bodies smaller than
+`COMPRESSION_MIN_SIZE` bytes are sent as they are, since compressing
+them saves less than it costs. Streamed responses are compressed chunk
+by chunk as they are generated, each chunk flushed so the client can
+decode it right away.
+
+The representation depends on `Accept-Encoding`, so those responses
+carry `Vary: Accept-Encoding`, whether they are compressed or not, and
+the ETag of a compressed body is made weak: its bytes differ from the
+uncompressed ones but not its content. If-None-Match compares ETags
+weakly (see conditional.py), so clients revalidate either version
+alike, and a 304 carries the ETag of the version the client has.
+
+Compressing the same body again on every request would cost more than
+building it from the read cache: the compressed bodies of the responses
+with an ETag are kept in an LRUCache, by ETag, encoding and checksum of
+the body.
+"""
+
+import zlib
+from typing import Iterable
+from flask import Response, current_app, request
+from src.models.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # optional, not offered when it isn't installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, not offered when it isn't installed
+    zstandard = None
+
+# Levels trading ratio for speed, since every response is compressed live
+ZLIB_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Media types worth compressing, besides text/*
+COMPRESSIBLE = {"application/json", "application/x-ndjson"}
+
+# Compressed bodies by (ETag, encoding, size, checksum)
+bodies = LRUCache(max_size=256, ttl=3600)
+
+
+class ZlibEncoder:
+    """Incremental gzip or deflate (zlib format) compressor"""
+
+    def __init__(self, wbits: int) -> None:
+        """Starts a stream with the format of the window bits"""
+        self.compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes, flush: bool = True) -> bytes:
+        """Compresses data, and flushes it so it can be decoded"""
+        output = self.compressor.compress(data)
+
+        if flush:
+            output += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        return output
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    """Incremental brotli compressor"""
+
+    def __init__(self) -> None:
+        """Starts a stream"""
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes, flush: bool = True) -> bytes:
+        """Compresses data, and flushes it so it can be decoded"""
+        output = self.compressor.process(data)
+
+        if flush:
+            output += self.compressor.flush()
+
+        return output
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    """Incremental zstd compressor"""
+
+    def __init__(self) -> None:
+        """Starts a stream"""
+        self.compressor = zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL
+        ).compressobj()
+
+    def compress(self, data: bytes, flush: bool = True) -> bytes:
+        """Compresses data, and flushes it so it can be decoded"""
+        output = self.compressor.compress(data)
+
+        if flush:
+            output += self.compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+
+        return output
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self.compressor.flush()
+
+
+# Encoder of every available encoding, the preferred ones first
+ENCODERS: dict = {}
+
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+
+ENCODERS["gzip"] = lambda: ZlibEncoder(16 + zlib.MAX_WBITS)
+ENCODERS["deflate"] = lambda: ZlibEncoder(zlib.MAX_WBITS)
+
+
+def configure(max_size: int) -> None:
+    """Sets the amount of compressed bodies kept, and empties them"""
+    bodies.max_size = max_size
+    bodies.invalidate()
+
+
+def negotiate() -> str | None:
+    """The encoding of the response to the request, None for none"""
+    return request.accept_encodings.best_match(list(ENCODERS))
+
+
+def compressible(response: Response) -> bool:
+    """Whether the response is text that may be compressed"""
+    mimetype = response.mimetype or ""
+
+    return (
+        mimetype.startswith("text/")
+        or mimetype.endswith("+json")
+        or mimetype in COMPRESSIBLE
+    )
+
+
+def encode(body: bytes, encoding: str, etag: str | None) -> bytes:
+    """Compresses a whole body, or gets it from the cache when it has an
+    ETag"""
+    if etag is None:
+        encoder = ENCODERS[encoding]()
+        return encoder.compress(body, flush=False) + encoder.finish()
+
+    key = (etag, encoding, len(body), zlib.crc32(body))
+    compressed = bodies.get(key)
+
+    if compressed is None:
+        compressed = encode(body, encoding, None)
+        bodies.set(key, compressed)
+
+    return compressed
+
+
+def encode_stream(chunks: Iterable[bytes], encoding: str) -> Iterable[bytes]:
+    """Compresses the chunks of a streamed body as they come"""
+    encoder = ENCODERS[encoding]()
+
+    for chunk in chunks:
+        output = encoder.compress(chunk)
+
+        if output:
+            yield output
+
+    yield encoder.finish()
+
+
+def compress(response: Response) -> Response:
+    """Compresses the response when the client accepts it (registered
+    with after_request)"""
+    # A 304 stands for the response the client has, and has its headers
+    if response.status_code != 304 and (
+        response.status_code < 200
+        or not compressible(response)
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or "no-transform" in response.cache_control
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+
+    if response.status_code == 304:
+        # The client named the weak ETag of the compressed version
+        if etag and request.if_none_match.is_weak(etag):
+            response.set_etag(etag, weak=True)
+
+        return response
+
+    encoding = negotiate()
+
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # The original iterable may hold resources (e.g. the context of
+        # stream_with_context) until it is closed
+        if hasattr(response.response, "close"):
+            response.call_on_close(response.response.close)
+
+        response.response = encode_stream(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+
+        if len(body) < current_app.config.get("COMPRESSION_MIN_SIZE", 1024):
+            return response
+
+        response.set_data(encode(
+            body, encoding, etag and ("W/" if weak else "") + etag
+        ))
+
+    if etag:
+        response.set_etag(etag, weak=True)
+
+    response.headers["Content-Encoding"] = encoding
+
+    return response
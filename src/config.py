@@ -24,6 +24,49 @@ class Config(ABC):
     SQLALCHEMY_DATABASE_URI = os.environ.get('db_url', 'sqlite:///db.db')
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'secret_passkey')
 
+    # Page size of the collection endpoints, and the most a client can ask
+    PAGINATION_DEFAULT_LIMIT = int(
+        os.getenv("PAGINATION_DEFAULT_LIMIT", "50")
+    )
+    PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "500"))
+
+    # When the file and pickle repositories write to disk:
+    # "sync", "batched" or "on-shutdown" (see src/persistence/flusher.py)
+    REPOSITORY_FLUSH_POLICY = os.getenv("REPOSITORY_FLUSH_POLICY", "sync")
+    REPOSITORY_FLUSH_INTERVAL_MS = int(
+        os.getenv("REPOSITORY_FLUSH_INTERVAL_MS", "500")
+    )
+    REPOSITORY_FLUSH_MAX_PENDING = int(
+        os.getenv("REPOSITORY_FLUSH_MAX_PENDING", "100")
+    )
+    # Load the pickle shards of every model in parallel on startup
+    PICKLE_PARALLEL_LOAD = os.getenv("PICKLE_PARALLEL_LOAD") == "true"
+    # Let several processes (e.g. gunicorn workers) use the same files of
+    # the file and pickle repositories (see src/persistence/shared.py)
+    REPOSITORY_SHARED = os.getenv("REPOSITORY_SHARED") == "true"
+
+    # Most operations a POST /batch can run
+    BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "1000"))
+    # Records a POST /import inserts per transaction
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+    # Responses smaller than this (in bytes) aren't compressed, and how
+    # many compressed bodies are kept (see src/compression.py)
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    COMPRESSION_CACHE_SIZE = int(os.getenv("COMPRESSION_CACHE_SIZE", "256"))
+
+    # Models whose reads are cached in the process, by class name, with
+    # the size and TTL in seconds of their cache (see src/models/cache.py)
+    # e.g. CACHE_MODELS=Country,Amenity,Place
+    CACHE_MODELS = {
+        name: {
+            "max_size": int(os.getenv("CACHE_MAX_SIZE", "1024")),
+            "ttl": float(os.getenv("CACHE_TTL_SECONDS", "60")),
+        }
+        for name in os.getenv("CACHE_MODELS", "").split(",")
+        if name
+    }
+
 
 class DevelopmentConfig(Config):
     """
@@ -3,14 +3,23 @@ Amenity controller module
 """
 
 from flask import abort, request
-from src.models.amenity import Amenity
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.pagination import paginate
+from src.models.amenity import Amenity, PlaceAmenity
+from src.models.place import Place
 
 
 def get_amenities():
-    """Returns all amenities"""
-    amenities: list[Amenity] = Amenity.get_all()
+    """Returns a page of amenities"""
+    query, serialize = sparse(Amenity)
 
-    return [amenity.to_dict() for amenity in amenities]
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Amenity.paginate(limit, after, query), serialize
+    ))
 
 
 def create_amenity():
@@ -34,7 +43,7 @@ def get_amenity_by_id(amenity_id: str):
     if not amenity:
         abort(404, f"Amenity with ID {amenity_id} not found")
 
-    return amenity.to_dict()
+    return entity_response(amenity, fields_serializer(Amenity))
 
 
 def update_amenity(amenity_id: str):
@@ -55,3 +64,91 @@ def delete_amenity(amenity_id: str):
         abort(404, f"Amenity with ID {amenity_id} not found")
 
     return "", 204
+
+
+def get_place(place_id: str) -> Place:
+    """Returns a place by ID, aborts if it doesn't exist"""
+    place: Place | None = Place.get(place_id)
+
+    if not place:
+        abort(404, f"Place with ID {place_id} not found")
+
+    return place
+
+
+def get_place_amenities(place_id: str):
+    """Returns a page of the amenities of a place"""
+    get_place(place_id)
+    query, serialize = sparse(Amenity, Amenity.of_place(place_id))
+
+    # Adding or removing an amenity doesn't change the amenities
+    # themselves, so the ETag hashes the page
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Amenity.paginate(limit, after, query), serialize
+    ), hashed=True)
+
+
+def add_place_amenity(place_id: str):
+    """Adds an amenity to a place"""
+    get_place(place_id)
+    data = request.get_json()
+
+    try:
+        amenity_id = data["amenity_id"]
+    except (KeyError, TypeError):
+        abort(400, "Missing field: 'amenity_id'")
+
+    amenity: Amenity | None = Amenity.get(amenity_id)
+
+    if not amenity:
+        abort(404, f"Amenity with ID {amenity_id} not found")
+
+    try:
+        PlaceAmenity.create({"place_id": place_id, "amenity_id": amenity_id})
+    except ValueError as e:
+        abort(400, str(e))
+
+    return amenity.to_dict(), 201
+
+
+def replace_place_amenities(place_id: str):
+    """Replaces the amenities of a place with the given ones"""
+    get_place(place_id)
+    data = request.get_json()
+    amenity_ids = data.get("amenity_ids") if isinstance(data, dict) else None
+
+    if not isinstance(amenity_ids, list) or not all(
+        isinstance(amenity_id, str) for amenity_id in amenity_ids
+    ):
+        abort(400, "amenity_ids must be a list of amenity IDs")
+
+    try:
+        PlaceAmenity.replace(place_id, amenity_ids)
+    except ValueError as e:
+        abort(404, str(e))
+
+    return {"items": [
+        amenity.to_dict() for amenity in Amenity.of_place(place_id)
+    ]}, 200
+
+
+def get_place_amenity(place_id: str, amenity_id: str):
+    """Returns an amenity of a place"""
+    get_place(place_id)
+
+    if not PlaceAmenity.get(place_id, amenity_id):
+        abort(404, f"Place {place_id} doesn't have amenity {amenity_id}")
+
+    return entity_response(
+        Amenity.get(amenity_id), fields_serializer(Amenity)
+    )
+
+
+def delete_place_amenity(place_id: str, amenity_id: str):
+    """Removes an amenity from a place"""
+    get_place(place_id)
+
+    if not PlaceAmenity.delete(place_id, amenity_id):
+        abort(404, f"Place {place_id} doesn't have amenity {amenity_id}")
+
+    return "", 204
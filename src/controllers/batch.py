@@ -0,0 +1,146 @@
+"""
+Batch controller module
+
+`POST /batch` takes a list of operations, `{"method", "path", "body"}`,
+and runs each of them like a request of its own (with the hooks of the
+app and its error handlers), in a single HTTP request and a single
+database transaction. The response holds the status and body of every
+operation, in order.
+
+Every operation runs inside a savepoint of the transaction, with a
+session of its own: the commits of the controllers only flush, and an
+operation that doesn't succeed (any status but 2xx) rolls back its own
+changes only, even those its controller committed before it failed. The
+transaction is committed once at the end. With `?atomic=true` the first
+failure stops the batch and rolls back every operation instead.
+"""
+
+from flask import abort, current_app, request
+from sqlalchemy.orm import Session
+from src import db
+from src.models import cache
+
+
+def run_operation(operation) -> tuple[int, object]:
+    """Runs an operation through the controller of its route, returns
+    its status and body"""
+    if not isinstance(operation, dict):
+        return 400, {"error": "Bad request", "message": "Not an object"}
+
+    method = str(operation.get("method", "GET")).upper()
+    path = operation.get("path")
+
+    if not isinstance(path, str) or not path.startswith("/"):
+        return 400, {"error": "Bad request", "message": "Invalid path"}
+
+    headers = {}
+    if "Authorization" in request.headers:
+        headers["Authorization"] = request.headers["Authorization"]
+    batch_endpoint = request.endpoint
+
+    with current_app.test_request_context(
+        path, method=method, json=operation.get("body"), headers=headers
+    ) as context:
+        try:
+            if context.request.endpoint == batch_endpoint:
+                abort(400, "Batches can't be nested")
+
+            # Runs the before and after request hooks too, and turns the
+            # errors the app handles (aborts, JWT errors, ...) into
+            # responses
+            response = current_app.full_dispatch_request()
+        except Exception as e:
+            try:
+                response = current_app.finalize_request(
+                    current_app.handle_user_exception(e)
+                )
+            except Exception:
+                current_app.logger.exception("Batch operation failed")
+                return 500, {"error": "Internal server error"}
+
+        return response.status_code, response.get_json(silent=True)
+
+
+def run_savepoint(connection, operation) -> tuple[int, object]:
+    """Runs an operation inside a savepoint of the transaction of the
+    connection, which is rolled back unless the operation succeeds"""
+    savepoint = connection.begin_nested()
+
+    # Flask-SQLAlchemy's sessions always pick the engine themselves. The
+    # session joins the savepoint: the commits of the controller don't
+    # release it, their rollbacks roll it back. Nothing else writes in
+    # the transaction, so what the operation wrote needn't be read again
+    # after its commits
+    session = Session(
+        bind=connection,
+        join_transaction_mode="rollback_only",
+        expire_on_commit=False,
+        info={"read_cache": False},
+    )
+    db.session.registry.set(session)
+
+    try:
+        status, body = run_operation(operation)
+        succeeded = 200 <= status < 300
+
+        # Unless the controller already did it
+        if succeeded and session.in_transaction():
+            session.commit()
+    finally:
+        session.close()
+
+    # Unless the controller rolled it back already
+    if savepoint.is_active:
+        if succeeded:
+            savepoint.commit()
+        else:
+            savepoint.rollback()
+
+    return status, body
+
+
+def run_batch():
+    """Runs the operations of the body in one transaction"""
+    operations = request.get_json(silent=True)
+    atomic = request.args.get("atomic") == "true"
+    maximum = current_app.config.get("BATCH_MAX_OPERATIONS", 1000)
+
+    if not isinstance(operations, list):
+        abort(400, "The body must be a list of operations")
+    if len(operations) > maximum:
+        abort(400, f"A batch can't have more than {maximum} operations")
+
+    # The sessions of the operations join a transaction of their own
+    db.session.remove()
+    results = []
+    committed = True
+
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+
+        # pysqlite only begins a transaction before the first write, and
+        # releasing the outermost savepoint would then commit it
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("BEGIN")
+
+        try:
+            for operation in operations:
+                status, body = run_savepoint(connection, operation)
+                results.append({"status": status, "body": body})
+
+                if atomic and not 200 <= status < 300:
+                    committed = False
+                    break
+
+            if committed:
+                transaction.commit()
+            else:
+                transaction.rollback()
+        finally:
+            db.session.remove()
+
+            # Other requests may have cached rows the transaction changed
+            # since it flushed them
+            cache.invalidate(*cache.caches)
+
+    return {"committed": committed, "results": results}, 200
@@ -3,14 +3,24 @@ Cities controller module
 """
 
 from flask import request, abort
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.includes import get_included, include
+from src.controllers.pagination import paginate
 from src.models.city import City
 
 
 def get_cities():
-    """Returns all cities"""
-    cities: list[City] = City.get_all()
+    """Returns a page of cities"""
+    query, serialize = sparse(City)
+    query, serialize, included = include(City, query, serialize)
 
-    return [city.to_dict() for city in cities]
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: City.paginate(limit, after, query), serialize
+    ), hashed=included)
 
 
 def create_city():
@@ -29,12 +39,14 @@ def create_city():
 
 def get_city_by_id(city_id: str):
     """Returns a city by ID"""
-    city: City | None = City.get(city_id)
+    city, serialize, included = get_included(
+        City, city_id, fields_serializer(City)
+    )
 
     if not city:
         abort(404, f"City with ID {city_id} not found")
 
-    return city.to_dict()
+    return entity_response(city, serialize, hashed=included)
 
 
 def update_city(city_id: str):
@@ -0,0 +1,123 @@
+"""
+Conditional GET helpers shared by the controllers
+
+Single objects get a strong ETag derived from their id and `updated_at`,
+and `updated_at` as Last-Modified. Collections get a weak ETag derived
+from the amount of rows and the latest `updated_at` of the query, which
+one aggregate query computes. When the client already has the current
+version the response is a 304, and nothing is serialized.
+
+Collections don't send Last-Modified: deleting a row doesn't move the
+latest `updated_at`, so If-Modified-Since alone would miss it.
+
+Responses whose version can't be known before building them (embedding
+related objects, see includes.py) get an ETag hashing their body
+instead: it still saves sending the body again, not building it.
+"""
+
+from datetime import datetime, timezone
+import hashlib
+from typing import Any, Callable
+from flask import Response, make_response, request
+from src import db
+from src.models.cache import cached_query
+
+
+def make_etag(*parts: Any) -> str:
+    """Hashes the parts of a version, along with the request URL and the
+    Accept header since they change the representation"""
+    text = "|".join(str(part) for part in (
+        request.full_path, request.headers.get("Accept", ""), *parts
+    ))
+
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def http_date(value: datetime) -> datetime:
+    """Converts a naive UTC timestamp to what HTTP dates can represent"""
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def not_modified(etag: str, last_modified: datetime | None) -> bool:
+    """Whether the client already has this version. If-None-Match takes
+    precedence over If-Modified-Since, and compares ETags weakly: the
+    compressed responses have the weak version of the ETag"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified:
+        return http_date(last_modified) <= request.if_modified_since
+
+    return False
+
+
+def conditional_response(
+    build: Callable[[], Any],
+    etag: str,
+    last_modified: datetime | None = None,
+    weak: bool = False,
+) -> Response:
+    """Returns a 304 when the client has this version, and otherwise the
+    response `build` returns, with the validators set"""
+    if not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+
+    response.set_etag(etag, weak=weak)
+
+    if last_modified:
+        response.last_modified = http_date(last_modified)
+
+    return response
+
+
+def hashed_response(build: Callable[[], Any]) -> Response:
+    """Conditional response whose ETag hashes its body. Streamed
+    responses don't get one"""
+    response = make_response(build())
+
+    if not response.is_streamed:
+        response.add_etag()
+        response.make_conditional(request)
+
+    return response
+
+
+def entity_response(
+    obj, serialize: Callable[[Any], Any] | None = None, hashed: bool = False
+) -> Response:
+    """Conditional response of a single object"""
+    updated_at = getattr(obj, "updated_at", None)
+    serialize = serialize or (lambda obj: obj.to_dict())
+
+    if hashed:
+        return hashed_response(lambda: serialize(obj))
+
+    return conditional_response(
+        lambda: serialize(obj), make_etag(obj.id, updated_at), updated_at
+    )
+
+
+def collection_response(
+    query, build: Callable[[], Any], hashed: bool = False
+) -> Response:
+    """Conditional response of a collection, `build` returns the body
+    when the client doesn't have the current version"""
+    if hashed:
+        return hashed_response(build)
+
+    model = query.column_descriptions[0]["entity"]
+    # Countries never change, new ones get a higher id
+    version = (
+        model.updated_at if hasattr(model, "updated_at") else model.id
+    )
+
+    count, latest = cached_query(
+        model, query, ("version",),
+        lambda: tuple(query.order_by(None).with_entities(
+            db.func.count(), db.func.max(version)
+        ).one()),
+    )
+
+    return conditional_response(build, make_etag(count, latest), weak=True)
@@ -3,15 +3,24 @@ Countries controller module
 """
 
 from flask import abort
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.includes import include
+from src.controllers.pagination import paginate
 from src.models.city import City
 from src.models.country import Country
 
 
 def get_countries():
-    """Returns all countries"""
-    countries: list[Country] = Country.get_all()
+    """Returns a page of countries"""
+    query, serialize = sparse(Country)
 
-    return [country.to_dict() for country in countries]
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Country.paginate(limit, after, query), serialize
+    ))
 
 
 def get_country_by_code(code: str):
@@ -21,20 +30,21 @@ def get_country_by_code(code: str):
     if not country:
         abort(404, f"Country with ID {code} not found")
 
-    return country.to_dict()
+    return entity_response(country, fields_serializer(Country))
 
 
 def get_country_cities(code: str):
-    """Returns all cities for a specific country by code"""
+    """Returns a page of the cities of a specific country by code"""
     country: Country | None = Country.get(code)
 
     if not country:
         abort(404, f"Country with ID {code} not found")
 
-    cities: list[City] = City.get_all()
+    query, serialize = sparse(
+        City, City.query.filter_by(country_code=country.code)
+    )
+    query, serialize, included = include(City, query, serialize)
 
-    country_cities = [
-        city.to_dict() for city in cities if city.country_code == country.code
-    ]
-
-    return country_cities
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: City.paginate(limit, after, query), serialize
+    ), hashed=included)
@@ -0,0 +1,56 @@
+"""
+Sparse fieldsets shared by the controllers
+
+Every GET takes `?fields=id,name,...` to return only some fields of the
+objects. Collections also load only those columns from the database (the
+primary key and the sort keys are always loaded), so the rows, the
+queries and the JSON all get narrower. Unknown fields are a bad request.
+"""
+
+from typing import Callable
+from flask import abort, request
+from sqlalchemy.orm import load_only
+from src.models.serializers import fields_of, serializer
+
+
+def get_fields(model) -> tuple[str, ...] | None:
+    """Reads the fields of the model the request asks for, None for
+    every field"""
+    if "fields" not in request.args:
+        return None
+
+    fields = tuple(dict.fromkeys(
+        name.strip() for name in request.args["fields"].split(",")
+        if name.strip()
+    ))
+
+    if not fields:
+        abort(400, "fields can't be empty")
+
+    known = fields_of(model)
+    unknown = [name for name in fields if name not in known]
+
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+
+    # In the order of the columns, the same for every order they come in
+    return tuple(name for name in known if name in fields)
+
+
+def fields_serializer(model) -> Callable[[object], dict]:
+    """Returns the serializer of the fields the request asks for"""
+    return serializer(model, get_fields(model))
+
+
+def sparse(model, query=None) -> tuple:
+    """Returns the query (every object of the model by default) loading
+    only the fields the request asks for, and their serializer"""
+    fields = get_fields(model)
+    query = model.query if query is None else query
+
+    if fields is not None:
+        query = query.options(
+            load_only(*(getattr(model, name) for name in fields))
+        )
+
+    return query, serializer(model, fields)
@@ -0,0 +1,55 @@
+"""
+Imports controller module
+
+`POST /import/<model>` imports the records of the body, NDJSON by
+default or CSV with `Content-Type: text/csv`, like the `flask import`
+command. The body is read while it is imported, never whole. `?skip=`
+resumes an import after the records it committed.
+"""
+
+import codecs
+from flask import abort, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt
+from src.models.importer import (
+    IMPORTABLE,
+    ImportFailed,
+    import_records,
+    read,
+)
+
+
+@jwt_required()
+def import_collection(model_name: str):
+    """Imports the records of the body into a collection"""
+    claims = get_jwt()
+    if not claims.get('is_admin'):
+        return jsonify({"msg": "Administration rights required"}), 403
+
+    if model_name not in IMPORTABLE:
+        abort(404, f"Can't import {model_name}")
+
+    model = IMPORTABLE[model_name]
+    format = "csv" if request.mimetype == "text/csv" else "ndjson"
+
+    try:
+        skip = int(request.args.get("skip", 0))
+        chunk_size = int(request.args.get(
+            "chunk_size", current_app.config.get("IMPORT_CHUNK_SIZE", 1000)
+        ))
+    except ValueError:
+        abort(400, "skip and chunk_size must be integers")
+
+    if skip < 0 or chunk_size < 1:
+        abort(400, "skip can't be negative and chunk_size must be positive")
+
+    lines = codecs.iterdecode(request.stream, "utf-8")
+
+    try:
+        return import_records(model, read(model, lines, format), chunk_size,
+                              skip), 200
+    except ImportFailed as e:
+        return {
+            "error": "Bad request",
+            "message": str(e),
+            "committed": e.committed,
+        }, 400
@@ -0,0 +1,128 @@
+"""
+Embedded relations shared by the controllers
+
+GETs take `?include=host,city,reviews,reviews.user` to embed related
+objects in the response, among the `includes` of each model, nested with
+dots. The whole graph is loaded up front in a fixed number of queries:
+many-to-one relations are joined to the query of their parent, and each
+collection is read with one more query for every parent of the page
+(`joinedload` and `selectinload`), instead of one query per object.
+
+Embedded objects change without the version of their parent changing,
+so the ETag of these responses hashes the body (see conditional.py).
+"""
+
+from typing import Callable
+from flask import abort, request
+from sqlalchemy.orm import joinedload, selectinload
+from src import db
+from src.models.serializers import serializer
+
+
+def get_includes(model) -> dict:
+    """Reads the relations the request includes, as a tree of relation
+    names: "reviews.user" is {"reviews": {"user": {}}}"""
+    tree = {}
+
+    for path in request.args.get("include", "").split(","):
+        if not path.strip():
+            continue
+
+        node = tree
+        current = model
+
+        for name in path.strip().split("."):
+            if name not in getattr(current, "includes", ()):
+                abort(400, f"Unknown include: {path.strip()}")
+
+            node = node.setdefault(name, {})
+            current = relation(current, name).mapper.class_
+
+    return tree
+
+
+def relation(model, name: str):
+    """Returns the relationship of a model with the given name"""
+    return db.inspect(model).relationships[name]
+
+
+def loader_options(model, tree: dict, parent=None) -> list:
+    """Returns the loader options of a tree of relations"""
+    options = []
+
+    for name, subtree in tree.items():
+        prop = relation(model, name)
+        attribute = getattr(model, name)
+
+        if parent is None:
+            option = (selectinload if prop.uselist else joinedload)(attribute)
+        elif prop.uselist:
+            option = parent.selectinload(attribute)
+        else:
+            option = parent.joinedload(attribute)
+
+        options.append(option)
+        options.extend(loader_options(prop.mapper.class_, subtree, option))
+
+    return options
+
+
+def embedder(
+    model, tree: dict, serialize: Callable[[object], dict] | None = None
+) -> Callable[[object], dict]:
+    """Returns a serializer of the objects of a model that embeds the
+    relations of the tree"""
+    serialize = serialize or serializer(model)
+    children = {
+        name: (
+            relation(model, name).uselist,
+            embedder(relation(model, name).mapper.class_, subtree),
+        )
+        for name, subtree in tree.items()
+    }
+
+    if not children:
+        return serialize
+
+    def embed(obj) -> dict:
+        """Serializes an object with its relations"""
+        data = serialize(obj)
+
+        for name, (uselist, child) in children.items():
+            value = getattr(obj, name)
+
+            if uselist:
+                data[name] = [child(item) for item in value]
+            else:
+                data[name] = None if value is None else child(value)
+
+        return data
+
+    return embed
+
+
+def include(model, query, serialize: Callable[[object], dict]) -> tuple:
+    """Returns the query loading the relations the request includes, the
+    serializer embedding them, and whether there are any"""
+    tree = get_includes(model)
+
+    if not tree:
+        return query, serialize, False
+
+    # The read cache only keeps columns, not the relations loaded
+    query = query.options(*loader_options(model, tree)).execution_options(
+        read_cache=False
+    )
+
+    return query, embedder(model, tree, serialize), True
+
+
+def get_included(model, obj_id: str, serialize: Callable[[object], dict]):
+    """Returns an object of a model by id with the relations the request
+    includes, the serializer embedding them, and whether there are any"""
+    query, serialize, included = include(model, model.query, serialize)
+
+    if not included:
+        return model.get(obj_id), serialize, False
+
+    return query.filter(model.id == obj_id).one_or_none(), serialize, True
@@ -0,0 +1,142 @@
+"""
+Pagination helpers shared by the controllers of every collection
+
+Collections are paginated with `?limit=&cursor=`. The cursor is opaque to
+clients: it encodes the sort key of the last object of the previous page,
+and the next one is returned as `next_cursor` (null on the last page).
+
+A collection can also be streamed whole, from the cursor on: with
+`?stream=true` as the same JSON object, or as one JSON object per line
+with `Accept: application/x-ndjson`. The rows are fetched and serialized
+a chunk at a time while the response is sent, so the memory a request
+uses doesn't grow with the size of the collection.
+"""
+
+import base64
+import binascii
+from itertools import islice
+import json
+from typing import Callable, Iterable
+from flask import (
+    Response,
+    abort,
+    current_app,
+    request,
+    stream_with_context,
+)
+from src.models.base import YIELD_PER
+
+NDJSON = "application/x-ndjson"
+
+
+def encode_cursor(key: list) -> str:
+    """Encodes the sort key of an object as a cursor"""
+    text = json.dumps(key, separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decodes a cursor back into a sort key"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(text)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor") from None
+
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+
+    return key
+
+
+def get_limit() -> int:
+    """Reads the page size of the request, capped by the configuration"""
+    default = current_app.config.get("PAGINATION_DEFAULT_LIMIT", 50)
+    maximum = current_app.config.get("PAGINATION_MAX_LIMIT", 500)
+
+    try:
+        limit = int(request.args.get("limit", default))
+    except ValueError:
+        abort(400, "limit must be an integer")
+
+    if limit < 1:
+        abort(400, "limit must be positive")
+
+    return min(limit, maximum)
+
+
+def streaming() -> str | None:
+    """The format the request asks the collection to be streamed in:
+    "ndjson", "json", or None to get a page"""
+    accepted = request.accept_mimetypes.best_match(
+        ["application/json", NDJSON]
+    )
+
+    if accepted == NDJSON:
+        return "ndjson"
+    if request.args.get("stream") == "true":
+        return "json"
+
+    return None
+
+
+def stream(
+    objects: Iterable, serialize: Callable, ndjson: bool = False
+) -> Response:
+    """Streams objects as the items of a last page, or as NDJSON,
+    serializing YIELD_PER objects at a time"""
+
+    def generate():
+        """Yields the chunks of the body"""
+        objects_left = iter(objects)
+        separator = "\n" if ndjson else ","
+        first = True
+
+        if not ndjson:
+            yield '{"items":['
+
+        while chunk := list(islice(objects_left, YIELD_PER)):
+            text = separator.join(
+                current_app.json.dumps(serialize(obj)) for obj in chunk
+            )
+            if ndjson:
+                yield text + "\n"
+            else:
+                yield text if first else separator + text
+            first = False
+
+        if not ndjson:
+            yield '],"next_cursor":null}'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON if ndjson else "application/json",
+    )
+
+
+def paginate(
+    get_page: Callable, serialize: Callable | None = None
+) -> dict | Response:
+    """Builds the response of a paginated collection. `get_page` receives
+    the page size and the key to start after, like Base.paginate, and a
+    page size of None when the collection is streamed"""
+    mode = streaming()
+    limit = None if mode else get_limit()
+    cursor = request.args.get("cursor")
+
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        objects, key = get_page(limit, after)
+    except ValueError as e:
+        abort(400, str(e))
+
+    serialize = serialize or (lambda obj: obj.to_dict())
+
+    if mode:
+        return stream(objects, serialize, mode == "ndjson")
+
+    return {
+        "items": [serialize(obj) for obj in objects],
+        "next_cursor": encode_cursor(key) if key is not None else None,
+    }
@@ -3,14 +3,98 @@ Places controller module
 """
 
 from flask import abort, request
-from src.models.place import Place
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.includes import get_included, include
+from src.controllers.pagination import get_limit, paginate
+from src.models.place import FILTERS, Place
 
 
 def get_places():
-    """Returns all places"""
-    places: list[Place] = Place.get_all()
+    """Returns a page of the places matching the filters of the query
+    string, sorted by the `sort` key"""
+    filters = {
+        name: request.args[name] for name in FILTERS if name in request.args
+    }
+    sort = request.args.get("sort", "created_at")
+
+    try:
+        query, serialize = sparse(Place, Place.search(**filters))
+    except ValueError as e:
+        abort(400, str(e))
+
+    query, serialize, included = include(Place, query, serialize)
+    # The version of the places doesn't change with their amenities
+    hashed = included or "amenities" in filters
+
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Place.paginate(limit, after, query, sort),
+        serialize,
+    ), hashed=hashed)
+
+
+def get_float(name: str, minimum: float, maximum: float) -> float:
+    """Reads a required number of the query string within bounds"""
+    try:
+        value = float(request.args[name])
+    except KeyError:
+        abort(400, f"Missing parameter: {name}")
+    except ValueError:
+        abort(400, f"{name} must be a number")
+
+    if not minimum <= value <= maximum:
+        abort(400, f"{name} must be between {minimum} and {maximum}")
+
+    return value
 
-    return [place.to_dict() for place in places], 200
+
+def with_distances(pairs: list[tuple[Place, float]]) -> dict:
+    """Builds the response of a geospatial search"""
+    serialize = fields_serializer(Place)
+
+    return {
+        "items": [
+            serialize(place) | {"distance_km": round(distance, 3)}
+            for place, distance in pairs
+        ]
+    }
+
+
+def get_places_nearby():
+    """Returns the places within `radius_km` of `lat`,`lon`, closest
+    first"""
+    latitude = get_float("lat", -90, 90)
+    longitude = get_float("lon", -180, 180)
+    radius_km = get_float("radius_km", 0, 20000)
+
+    return with_distances(
+        Place.nearby(latitude, longitude, radius_km, get_limit())
+    ), 200
+
+
+def get_places_within():
+    """Returns the places inside `bbox` (min_lon,min_lat,max_lon,max_lat),
+    closest to its center first"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (
+            float(value) for value in request.args["bbox"].split(",")
+        )
+    except KeyError:
+        abort(400, "Missing parameter: bbox")
+    except ValueError:
+        abort(400, "bbox must be min_lon,min_lat,max_lon,max_lat")
+
+    if not (
+        -180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90
+    ):
+        abort(400, "bbox must be min_lon,min_lat,max_lon,max_lat")
+
+    return with_distances(
+        Place.within(min_lat, min_lon, max_lat, max_lon, get_limit())
+    ), 200
 
 
 def create_place():
@@ -29,12 +113,14 @@ def create_place():
 
 def get_place_by_id(place_id: str):
     """Returns a place by ID"""
-    place: Place | None = Place.get(place_id)
+    place, serialize, included = get_included(
+        Place, place_id, fields_serializer(Place)
+    )
 
     if not place:
         abort(404, f"Place with ID {place_id} not found")
 
-    return place.to_dict(), 200
+    return entity_response(place, serialize, hashed=included)
 
 
 def update_place(place_id: str):
@@ -3,14 +3,24 @@ Reviews controller module
 """
 
 from flask import abort, request
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.includes import get_included, include
+from src.controllers.pagination import paginate
 from src.models.review import Review
 
 
 def get_reviews():
-    """Returns all reviews"""
-    reviews = Review.get_all()
+    """Returns a page of reviews"""
+    query, serialize = sparse(Review)
+    query, serialize, included = include(Review, query, serialize)
 
-    return [review.to_dict() for review in reviews], 200
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Review.paginate(limit, after, query), serialize
+    ), hashed=included)
 
 
 def create_review(place_id: str):
@@ -31,31 +41,39 @@ def create_review(place_id: str):
 
 
 def get_reviews_from_place(place_id: str):
-    """Returns all reviews from a specific place"""
-    reviews = Review.get_all()
+    """Returns a page of the reviews from a specific place"""
+    query, serialize = sparse(
+        Review, Review.query.filter_by(place_id=place_id)
+    )
+    query, serialize, included = include(Review, query, serialize)
 
-    return [
-        review.to_dict() for review in reviews if review.place_id == place_id
-    ], 200
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Review.paginate(limit, after, query), serialize
+    ), hashed=included)
 
 
 def get_reviews_from_user(user_id: str):
-    """Returns all reviews from a specific user"""
-    reviews = Review.get_all()
+    """Returns a page of the reviews from a specific user"""
+    query, serialize = sparse(
+        Review, Review.query.filter_by(user_id=user_id)
+    )
+    query, serialize, included = include(Review, query, serialize)
 
-    return [
-        review.to_dict() for review in reviews if review.user_id == user_id
-    ], 200
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: Review.paginate(limit, after, query), serialize
+    ), hashed=included)
 
 
 def get_review_by_id(review_id: str):
     """Returns a review by ID"""
-    review: Review | None = Review.get(review_id)
+    review, serialize, included = get_included(
+        Review, review_id, fields_serializer(Review)
+    )
 
     if not review:
         abort(404, f"Review with ID {review_id} not found")
 
-    return review.to_dict(), 200
+    return entity_response(review, serialize, hashed=included)
 
 
 def update_review(review_id: str):
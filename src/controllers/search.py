@@ -0,0 +1,37 @@
+"""
+Search controller module
+
+`GET /search?q=` searches the text of the places and reviews (see
+src/models/search.py), best match first, in pages like the collections.
+`?type=place` or `?type=review` only returns one of them. Terms ending
+with `*` match the words they start.
+"""
+
+from flask import abort, request
+from src.controllers.conditional import hashed_response
+from src.controllers.pagination import paginate
+from src.models import search as full_text
+
+
+def serialize(result: dict) -> dict:
+    """Serializes a result of a search"""
+    return result | {"object": result["object"].to_dict()}
+
+
+def search():
+    """Returns a page of the places and reviews matching the query"""
+    query = request.args.get("q", "")
+    kinds = [
+        kind.strip() for kind in request.args.get("type", "").split(",")
+        if kind.strip()
+    ]
+
+    if not query.strip():
+        abort(400, "Missing parameter: q")
+
+    def get_page(limit: int | None, after: list | None) -> tuple:
+        """Returns a page of the results"""
+        return full_text.search(query, kinds, limit, after)
+
+    # The results depend on every place and review, the ETag hashes them
+    return hashed_response(lambda: paginate(get_page, serialize))
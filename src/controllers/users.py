@@ -4,18 +4,28 @@ Users controller module
 
 from flask import abort, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt
+from src.controllers.conditional import (
+    collection_response,
+    entity_response,
+)
+from src.controllers.fields import fields_serializer, sparse
+from src.controllers.pagination import paginate
 from src.models.user import User
 
+
 @jwt_required()
 def get_users():
-    """Returns all users"""
+    """Returns a page of users"""
     claims = get_jwt()
     if not claims.get('is_admin'):
         return jsonify({"msg": "Administration rights required"}), 403
 
-    users: list[User] = User.get_all()
+    query, serialize = sparse(User)
+
+    return collection_response(query, lambda: paginate(
+        lambda limit, after: User.paginate(limit, after, query), serialize
+    ))
 
-    return [user.to_dict() for user in users]
 
 @jwt_required()
 def create_user():
@@ -38,6 +48,7 @@ def create_user():
 
     return user.to_dict(), 201
 
+
 @jwt_required()
 def get_user_by_id(user_id: str):
     """Returns a user by ID"""
@@ -50,7 +61,8 @@ def get_user_by_id(user_id: str):
     if not user:
         abort(404, f"User with ID {user_id} not found")
 
-    return user.to_dict(), 200
+    return entity_response(user, fields_serializer(User))
+
 
 @jwt_required()
 def update_user(user_id: str):
@@ -71,6 +83,7 @@ def update_user(user_id: str):
 
     return user.to_dict(), 200
 
+
 @jwt_required()
 def delete_user(user_id: str):
     """Deletes a user by ID"""
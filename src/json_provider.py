@@ -0,0 +1,71 @@
+"""
+JSON provider of the Flask app
+
+OrjsonProvider encodes and decodes with orjson, several times faster
+than the json module of the standard library, and writes the bytes of
+the responses directly. It behaves like Flask's default provider: keys
+are sorted, dates, UUIDs and dataclasses go through the same `default`,
+and the output is indented in debug mode. Non ASCII characters are
+written as UTF-8 rather than escaped. When orjson isn't installed the
+default provider is used.
+"""
+
+from typing import Any
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library is used instead
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask's default JSON provider, on top of orjson"""
+
+    def _options(self, **kwargs) -> int:
+        """Helper method to get the orjson options matching the options
+        of the default provider"""
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+        if kwargs.get("sort_keys", self.sort_keys):
+            options |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            options |= orjson.OPT_INDENT_2
+
+        return options
+
+    def dumps_bytes(self, obj: Any, **kwargs) -> bytes:
+        """Serializes data as JSON bytes"""
+        return orjson.dumps(
+            obj, default=self.default, option=self._options(**kwargs)
+        )
+
+    def dumps(self, obj: Any, **kwargs) -> str:
+        """Serializes data as JSON"""
+        return self.dumps_bytes(obj, **kwargs).decode()
+
+    def loads(self, s: str | bytes, **kwargs) -> Any:
+        """Deserializes data from JSON"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serializes the arguments as JSON and returns a response with
+        it, like jsonify"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (
+            self.compact is None and self._app.debug
+        )
+
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent=indent) + b"\n",
+            mimetype=self.mimetype,
+        )
+
+
+def json_provider(app: Flask) -> DefaultJSONProvider:
+    """Returns the fastest JSON provider available for the app"""
+    if orjson is None:
+        return DefaultJSONProvider(app)
+
+    return OrjsonProvider(app)
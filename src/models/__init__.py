@@ -1 +1,22 @@
-"""  """
+""" Import every model so SQLAlchemy can resolve relationships by name """
+
+from src.models.amenity import Amenity, PlaceAmenity
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.review import Review
+from src.models.user import User
+
+# Creates the full-text index with the tables and keeps it in sync
+from src.models import search  # noqa: F401
+
+# Every model by the name the repositories store it under
+MODELS: dict = {
+    "amenity": Amenity,
+    "city": City,
+    "country": Country,
+    "place": Place,
+    "placeamenity": PlaceAmenity,
+    "review": Review,
+    "user": User,
+}
@@ -7,7 +7,7 @@ from src.models.base import Base
 
 class Amenity(Base):
     """Amenity representation"""
-    
+
     __tablename__ = 'amenities'
 
     name = db.Column(db.String(50), nullable=False)
@@ -22,15 +22,6 @@ class Amenity(Base):
         """Dummy repr"""
         return f"<Amenity {self.id} ({self.name})>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
-
     @staticmethod
     def create(data: dict) -> "Amenity":
         """Create a new amenity"""
@@ -39,6 +30,27 @@ class Amenity(Base):
         db.session.commit()
         return new_amenity
 
+    @staticmethod
+    def of_place(place_id: str):
+        """Builds the query of the amenities of a place"""
+        return Amenity.query.join(
+            PlaceAmenity, PlaceAmenity.amenity_id == Amenity.id
+        ).filter(PlaceAmenity.place_id == place_id)
+
+    @staticmethod
+    def resolve(names: list[str]) -> list[list[str]]:
+        """Returns the ids of the amenities with each of the given names
+        or ids, an empty list for those that don't exist"""
+        groups = {name: [] for name in names}
+
+        for amenity in Amenity.query.filter(db.or_(
+            Amenity.id.in_(names), Amenity.name.in_(names)
+        )):
+            for key in {amenity.id, amenity.name} & groups.keys():
+                groups[key].append(amenity.id)
+
+        return [groups[name] for name in names]
+
     @staticmethod
     def update(amenity_id: str, data: dict) -> "Amenity | None":
         """Update an existing amenity"""
@@ -58,8 +70,13 @@ class PlaceAmenity(Base):
 
     __tablename__ = 'place_amenities'
 
-    place_id = db.Column(db.String(50), db.Foreignkey('places.id'), primary_key=True)
-    amenity_id = db.Column(db.String(50), db.ForeingKey('amenities.id'), primary_key=True)
+    place_id = db.Column(
+        db.String(50), db.ForeignKey('places.id'), primary_key=True,
+        index=True,
+    )
+    amenity_id = db.Column(
+        db.String(50), db.ForeignKey('amenities.id'), primary_key=True
+    )
 
     def __init__(self, place_id: str, amenity_id: str, **kw) -> None:
         """Dummy init"""
@@ -72,45 +89,68 @@ class PlaceAmenity(Base):
         """Dummy repr"""
         return f"<PlaceAmenity ({self.place_id} - {self.amenity_id})>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "place_id": self.place_id,
-            "amenity_id": self.amenity_id,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
-
-    @staticmethod
-    def get(place_id: str, amenity_id: str) -> "PlaceAmenity | None":
-        """Get a PlaceAmenity object by place_id and amenity_id"""
-        from src.persistence import repo
-
-        place_amenities: list[PlaceAmenity] = repo.get_all("placeamenity")
-
-        for place_amenity in place_amenities:
-            if (
-                place_amenity.place_id == place_id
-                and place_amenity.amenity_id == amenity_id
-            ):
-                return place_amenity
-
-        return None
-
     @staticmethod
     def get(place_id: str, amenity_id: str) -> "PlaceAmenity | None":
         """Get a PlaceAmenity object by place_id and amenity_id"""
-        return PlaceAmenity.query.filter_by(place_id=place_id, amenity_id=amenity_id).first()
+        return PlaceAmenity.query.filter_by(
+            place_id=place_id, amenity_id=amenity_id
+        ).first()
 
     @staticmethod
     def create(data: dict) -> "PlaceAmenity":
         """Create a new PlaceAmenity object"""
+        if PlaceAmenity.get(data["place_id"], data["amenity_id"]):
+            raise ValueError(
+                f"Place {data['place_id']} already has amenity "
+                f"{data['amenity_id']}"
+            )
+
+        PlaceAmenity._check_references([data])
+
         new_place_amenity = PlaceAmenity(**data)
         db.session.add(new_place_amenity)
         db.session.commit()
         return new_place_amenity
 
+    @staticmethod
+    def replace(place_id: str, amenity_ids: list[str]) -> None:
+        """Replaces the amenities of a place, in one transaction"""
+        amenity_ids = list(dict.fromkeys(amenity_ids))
+        PlaceAmenity._check_references([{"place_id": place_id}] + [
+            {"amenity_id": amenity_id} for amenity_id in amenity_ids
+        ])
+
+        current = {
+            place_amenity.amenity_id: place_amenity
+            for place_amenity in PlaceAmenity.query.filter_by(
+                place_id=place_id
+            )
+        }
+
+        for amenity_id, place_amenity in current.items():
+            if amenity_id not in amenity_ids:
+                db.session.delete(place_amenity)
+
+        db.session.add_all([
+            PlaceAmenity(place_id, amenity_id)
+            for amenity_id in amenity_ids if amenity_id not in current
+        ])
+        db.session.commit()
+
+    @staticmethod
+    def places_with_all(groups: list[list[str]]):
+        """
+        Builds the query of the ids of the places that have an amenity of
+        every group of amenity ids. Each group reads the index on
+        (amenity_id, place_id) alone, and the database intersects them.
+        """
+        return db.intersect(*(
+            db.select(PlaceAmenity.place_id).where(
+                PlaceAmenity.amenity_id.in_(group)
+            )
+            for group in groups
+        ))
+
     @staticmethod
     def delete(place_id: str, amenity_id: str) -> bool:
         """Delete a PlaceAmenity object by place_id and amenity_id"""
@@ -128,3 +168,11 @@ class PlaceAmenity(Base):
         raise NotImplementedError(
             "This method is defined only because of the Base class"
         )
+
+
+# Places with a given amenity, read from the index alone by the amenity
+# filter of the place search. Also keeps a pair from being added twice
+db.Index(
+    "ix_place_amenities_amenity_id_place_id",
+    PlaceAmenity.amenity_id, PlaceAmenity.place_id, unique=True,
+)
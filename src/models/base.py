@@ -1,21 +1,152 @@
+"""
+This module exports the Base class that every model inherits from
+"""
+
 from datetime import datetime
 from typing import Any, Optional
 import uuid
-from abc import ABC, abstractmethod
-from sqlalchemy.ext.declarative import as_declarative, declared_attr
+from abc import ABCMeta, abstractmethod
+from sqlalchemy.orm import declared_attr, undefer
 from src import db
+from src.models.cache import cached_object, cached_objects, cached_page
+from src.models.serializers import serializer
+
+# Values per IN clause, well below SQLite's limit of bound parameters
+CHUNK_SIZE = 500
+# Rows fetched at a time when iterating a whole collection
+YIELD_PER = 100
+
+
+def chunks(values: list, size: int = CHUNK_SIZE):
+    """Splits a list into lists of at most `size` values"""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def key_value(column, value: Any) -> Any:
+    """Converts a value of a cursor to the type of its column"""
+    kind = column.type.python_type
 
+    if kind is datetime:
+        return datetime.fromisoformat(value)
+    if kind in (int, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("Invalid cursor")
+    elif not isinstance(value, kind):
+        raise ValueError("Invalid cursor")
 
-@as_declarative()
-class Base(db.Model, ABC):
+    return value
+
+
+def paginate(
+    query,
+    columns: tuple,
+    limit: int | None,
+    after: list | None = None,
+    descending: bool = False,
+):
+    """
+    Keyset pagination: returns up to `limit` rows of the query ordered by
+    the given columns, starting after the row whose key is `after`.
+    The key is compared in SQL, so deep pages cost as much as the first.
+    Returns the rows and the key of the last one, or None if it was the
+    last page. Pages of the models with a cache are cached.
+    Without a limit the rows are every row after `after`, fetched
+    YIELD_PER at a time while they are iterated, and the key is None.
+    """
+    if limit is None:
+        return _paginate(query, columns, limit, after, descending)
+
+    model = query.column_descriptions[0]["entity"]
+    key = (
+        "page", tuple(column.key for column in columns), limit,
+        repr(after), descending,
+    )
+
+    return cached_page(
+        model, query, key,
+        lambda: _paginate(query, columns, limit, after, descending),
+    )
+
+
+def _paginate(
+    query,
+    columns: tuple,
+    limit: int | None,
+    after: list | None,
+    descending: bool,
+):
+    """Helper function of paginate that reads the page"""
+    if after is not None:
+        if len(after) != len(columns):
+            raise ValueError("Invalid cursor")
+
+        try:
+            key = tuple(
+                key_value(column, value)
+                for column, value in zip(columns, after)
+            )
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor") from None
+
+        row = db.tuple_(*columns)
+        query = query.filter(row < key if descending else row > key)
+
+    # The key of the last row is read, even when the query only loads
+    # some columns
+    query = query.options(*(undefer(column) for column in columns))
+
+    if descending:
+        query = query.order_by(*(column.desc() for column in columns))
+    else:
+        query = query.order_by(*columns)
+
+    if limit is None:
+        return query.yield_per(YIELD_PER), None
+
+    # One more row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = [getattr(rows[-1], column.key) for column in columns]
+
+    return rows, [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in last
+    ]
+
+
+class BaseMeta(type(db.Model), ABCMeta):
+    """
+    Metaclass that lets Base be both a SQLAlchemy model and an ABC
+    """
+
+
+class Base(db.Model, metaclass=BaseMeta):
     """
     Abstract base class for all models
     """
     __abstract__ = True
 
-    id = db.Column(db.String(50), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(
+        db.String(50), primary_key=True, default=lambda: str(uuid.uuid4())
+    )
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    @declared_attr.directive
+    def __table_args__(cls) -> tuple:
+        """Every table is paginated by (created_at, id)"""
+        return (
+            db.Index(
+                f"ix_{cls.__tablename__}_created_at_id", "created_at", "id"
+            ),
+        )
 
     def __init__(self, **kwargs) -> None:
         """
@@ -27,19 +158,48 @@ class Base(db.Model, ABC):
                 continue
             setattr(self, key, value)
 
+        # Column defaults are only applied when SQLAlchemy flushes, but the
+        # file and memory repositories need them as soon as the object exists
+        if self.id is None:
+            self.id = str(uuid.uuid4())
+        if self.created_at is None:
+            self.created_at = datetime.utcnow()
+        if self.updated_at is None:
+            self.updated_at = self.created_at
+
     @classmethod
     def get(cls, id: str) -> Optional["Base"]:
         """
         Common method to get a specific object of a class by its id.
         """
-        return cls.query.get(id)
+        return cached_object(cls, ("get", id), lambda: cls.query.get(id))
 
     @classmethod
     def get_all(cls) -> list["Base"]:
         """
         Common method to get all objects of a class.
         """
-        return cls.query.all()
+        return cached_objects(cls, ("all",), cls.query.all)
+
+    @classmethod
+    def find_by(cls, **field_equals) -> list["Base"]:
+        """
+        Common method to get all objects of a class whose fields equal
+        the given values.
+        """
+        return cls.query.filter_by(**field_equals).all()
+
+    @classmethod
+    def paginate(
+        cls, limit: int | None, after: list | None = None, query=None
+    ) -> tuple[list["Base"], list | None]:
+        """
+        Common method to get a page of objects of a class, or of the given
+        query on the class, ordered by (created_at, id).
+        """
+        query = cls.query if query is None else query
+
+        return paginate(query, (cls.created_at, cls.id), limit, after)
 
     @classmethod
     def delete(cls, id: str) -> bool:
@@ -53,9 +213,176 @@ class Base(db.Model, ABC):
         db.session.commit()
         return True
 
-    @abstractmethod
+    @classmethod
+    def create_many(cls, data: list[dict]) -> list["Base"]:
+        """
+        Common method to create many objects of a class at once.
+        The whole batch is validated before anything is written, and then
+        it is inserted in a single transaction.
+        """
+        cls._check_references(data)
+        cls._check_unique(data)
+
+        instances = [cls._build(item) for item in data]
+
+        db.session.add_all(instances)
+        db.session.commit()
+
+        return instances
+
+    @classmethod
+    def update_many(cls, data: list[dict]) -> list["Base"]:
+        """
+        Common method to update many objects of a class at once.
+        Every item holds the id of the object and the fields to change.
+        The whole batch is validated before anything is written.
+        """
+        ids = [item["id"] for item in data]
+        instances = {}
+
+        for chunk in chunks(ids):
+            for instance in cls.query.filter(cls.id.in_(chunk)):
+                instances[instance.id] = instance
+
+        for obj_id in ids:
+            if obj_id not in instances:
+                raise ValueError(f"{cls.__name__} with ID {obj_id} not found")
+
+        cls._check_fields(data)
+        cls._check_references(data)
+        cls._check_unique(data)
+
+        for item in data:
+            instance = instances[item["id"]]
+            for key, value in item.items():
+                if key != "id":
+                    setattr(instance, key, value)
+
+        db.session.commit()
+
+        return [instances[obj_id] for obj_id in ids]
+
+    @classmethod
+    def delete_many(cls, ids: list[str]) -> int:
+        """
+        Common method to delete many objects of a class by their ids,
+        in a single transaction. Returns how many objects were deleted.
+        """
+        deleted = 0
+
+        for chunk in chunks(ids):
+            deleted += cls.query.filter(cls.id.in_(chunk)).delete(
+                synchronize_session=False
+            )
+
+        db.session.commit()
+
+        return deleted
+
+    @classmethod
+    def _build(cls, data: dict) -> "Base":
+        """
+        Builds an object from the data sent to create it.
+        Models whose constructor takes something else override it.
+        """
+        return cls(**data)
+
+    @classmethod
+    def _check_references(
+        cls, data: list[dict], known: dict | None = None
+    ) -> None:
+        """
+        Checks that the foreign keys of a batch point to existing rows,
+        with one query per foreign key instead of one per item.
+        `known` keeps the values found for each column across batches,
+        so they are only queried once.
+        """
+        for column in cls.__table__.columns:
+            for foreign_key in column.foreign_keys:
+                found = set() if known is None else known.setdefault(
+                    column.name, set()
+                )
+                values = list({
+                    item[column.name] for item in data
+                    if column.name in item and item[column.name] not in found
+                })
+                target = foreign_key.column
+                existing = set()
+
+                for chunk in chunks(values):
+                    existing.update(db.session.scalars(
+                        db.select(target).where(target.in_(chunk))
+                    ))
+
+                found.update(existing)
+
+                for value in values:
+                    if value not in existing:
+                        name = next(
+                            mapper.class_.__name__
+                            for mapper in db.Model.registry.mappers
+                            if mapper.local_table is target.table
+                        )
+                        raise ValueError(
+                            f"{name} with {target.name} {value} not found"
+                        )
+
+    @classmethod
+    def _check_fields(cls, data: list[dict]) -> None:
+        """
+        Checks that a batch of updates only sets the columns clients may
+        change: not the id, the timestamps or the `computed_fields` of
+        the model.
+        """
+        fixed = {
+            "id", "created_at", "updated_at",
+            *getattr(cls, "computed_fields", ()),
+        }
+        allowed = set(cls.__table__.columns.keys()) - fixed
+
+        for item in data:
+            for key in item:
+                if key != "id" and key not in allowed:
+                    raise ValueError(f"{key} can't be set")
+
+    @classmethod
+    def _check_unique(cls, data: list[dict]) -> None:
+        """
+        Checks that the unique fields of a batch are neither repeated
+        inside it nor already taken. Items with an id are updates, they
+        may keep the value of their own object.
+        """
+        for column in cls.__table__.columns:
+            if not column.unique:
+                continue
+
+            items = [item for item in data if column.name in item]
+            values = [item[column.name] for item in items]
+            # value -> id of the object that has it
+            taken = {}
+
+            for chunk in chunks(values):
+                taken.update(
+                    (value, obj_id) for obj_id, value in db.session.execute(
+                        db.select(cls.id, column).where(column.in_(chunk))
+                    )
+                )
+
+            seen = set()
+            for item, value in zip(items, values):
+                owner = taken.get(value, item.get("id"))
+
+                if owner != item.get("id") or value in seen:
+                    raise ValueError(
+                        f"{cls.__name__} with {column.name} {value} "
+                        "already exists"
+                    )
+                seen.add(value)
+
     def to_dict(self) -> dict:
-        """Returns the dictionary representation of the object"""
+        """Returns the dictionary representation of the object, with the
+        serializer compiled for its class"""
+        return serializer(type(self))(self)
 
     @staticmethod
     @abstractmethod
@@ -0,0 +1,302 @@
+"""
+In-process read cache of the models
+
+Every model enabled in the configuration (`CACHE_MODELS`, see
+src/config.py) gets its own LRUCache: bounded in size, evicting the least
+recently used entries first, and whose entries also expire after a TTL.
+The cache keeps the column values of the rows it read rather than the
+objects, which belong to the session of a request, and merges them back
+into the current session on a hit, without a query.
+
+Invalidation is automatic: the session events below drop the cache of
+every model a transaction writes to, whichever code path wrote (create,
+update, delete, the batch methods or bulk statements). Every
+invalidation also bumps the generation of the cache, so a read that
+started before a write never stores its stale result after it.
+
+The cache lives in the process: other processes (e.g. gunicorn workers)
+see the writes they didn't make once the TTL runs out.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Hashable
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from src import db
+
+MISSING = object()
+
+
+class LRUCache:
+    """Mapping bounded to `max_size` entries, which expire `ttl` seconds
+    after they are stored"""
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Starts empty"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # key -> (expiration time, value), least recently used first
+        self.__entries: OrderedDict[Hashable, tuple[float, Any]] = (
+            OrderedDict()
+        )
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Amount of entries, expired ones included"""
+        return len(self.__entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value of a key, or the default when it is missing
+        or expired"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is not None and entry[0] <= self.clock():
+                del self.__entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(
+        self, key: Hashable, value: Any, generation: int | None = None
+    ) -> None:
+        """Stores the value of a key, unless the cache was invalidated
+        since `generation`"""
+        with self.__lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.__entries[key] = (self.clock() + self.ttl, value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """Drops every entry"""
+        with self.__lock:
+            self.__entries.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """Counters of the cache"""
+        return {
+            "size": len(self.__entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Model class name -> its cache, only for the models enabled
+caches: dict[str, LRUCache] = {}
+
+
+def configure(models: dict[str, dict]) -> None:
+    """Enables the cache of the given models, by class name, with their
+    options (max_size, ttl). Disables the ones that were enabled before"""
+    caches.clear()
+
+    for name, options in models.items():
+        caches[name] = LRUCache(**options)
+
+
+def stats() -> dict[str, dict]:
+    """Counters of the cache of every model"""
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+def invalidate(*names: str) -> None:
+    """Drops the cache of the given models"""
+    for name in names:
+        if name in caches:
+            caches[name].invalidate()
+
+
+def cached(cls, key: Hashable, load: Callable[[], Any]) -> Any:
+    """Returns the value of a key in the cache of a model, loading and
+    storing it on a miss. Just loads it when the model isn't cached"""
+    cache = caches.get(cls.__name__)
+
+    # The open transaction of the session wrote to the model, what it
+    # reads may never be committed. Sessions can also opt out
+    info = db.session.info
+
+    if (
+        cache is None
+        or info.get("read_cache") is False
+        or cls.__name__ in info.get("cache_written", ())
+    ):
+        return load()
+
+    value = cache.get(key, MISSING)
+
+    if value is MISSING:
+        generation = cache.generation
+        value = load()
+        cache.set(key, value, generation)
+
+    return value
+
+
+def snapshot(obj) -> dict | None:
+    """Values of the loaded columns of an object"""
+    if obj is None:
+        return None
+
+    state = db.inspect(obj)
+
+    return {
+        attr.key: state.dict[attr.key]
+        for attr in state.mapper.column_attrs
+        if attr.key in state.dict
+    }
+
+
+def restore(cls, values: dict | None):
+    """Object of the current session with the given column values,
+    without a query"""
+    if values is None:
+        return None
+
+    obj = db.inspect(cls).class_manager.new_instance()
+
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+
+    # The columns that weren't loaded are loaded when they are read
+    make_transient_to_detached(obj)
+
+    return db.session.merge(obj, load=False)
+
+
+def cached_object(cls, key: Hashable, load: Callable[[], Any]):
+    """Cached version of a lookup of one object of a model"""
+    if cls.__name__ not in caches:
+        return load()
+
+    return restore(cls, cached(cls, key, lambda: snapshot(load())))
+
+
+def cached_objects(cls, key: Hashable, load: Callable[[], list]) -> list:
+    """Cached version of a lookup of many objects of a model"""
+    if cls.__name__ not in caches:
+        return load()
+
+    values = cached(cls, key, lambda: [snapshot(obj) for obj in load()])
+
+    return [restore(cls, item) for item in values]
+
+
+def query_key(cls, query) -> tuple | None:
+    """The SQL of a query and its parameters, or None when the query
+    reads other tables than the one of the model, since writes to them
+    don't invalidate the cache of the model, or opts out with the
+    `read_cache=False` execution option"""
+    statement = query.statement
+
+    if statement.get_final_froms() != [cls.__table__]:
+        return None
+    if statement.get_execution_options().get("read_cache") is False:
+        return None
+
+    compiled = statement.compile()
+
+    return str(compiled), repr(sorted(compiled.params.items()))
+
+
+def cached_query(cls, query, key: tuple, load: Callable[[], Any]) -> Any:
+    """Cached version of something computed from a query on a model,
+    `key` tells apart the things computed from the same query"""
+    if cls.__name__ not in caches:
+        return load()
+
+    statement = query_key(cls, query)
+
+    if statement is None:
+        return load()
+
+    return cached(cls, (*key, statement), load)
+
+
+def cached_page(cls, query, key: tuple, load: Callable[[], tuple]):
+    """Cached version of a page of objects of a query on a model, `load`
+    returns the objects and the key of the last one"""
+    if cls.__name__ not in caches:
+        return load()
+
+    def load_values() -> tuple:
+        """Column values of the objects of the page"""
+        objects, last = load()
+
+        return [snapshot(obj) for obj in objects], last
+
+    values, last = cached_query(cls, query, key, load_values)
+
+    return [restore(cls, item) for item in values], last
+
+
+def _written(session: Session) -> set[str]:
+    """Helper function to get the models written by the transaction of
+    a session"""
+    return session.info.setdefault("cache_written", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, flush_context) -> None:
+    """Invalidates the models a flush wrote to, the session still lists
+    the objects it flushed"""
+    names = {
+        type(obj).__name__
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    }
+
+    _written(session).update(names)
+    invalidate(*names)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _after_bulk(state) -> None:
+    """Invalidates the model of a bulk insert, update or delete"""
+    if state.is_select or state.bind_mapper is None:
+        return
+
+    name = state.bind_mapper.class_.__name__
+    _written(state.session).add(name)
+    invalidate(name)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _after_transaction(session: Session) -> None:
+    """Invalidates the models a transaction wrote to again, reads that
+    ran while it was open may have seen its uncommitted rows"""
+    invalidate(*session.info.pop("cache_written", ()))
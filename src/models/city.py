@@ -9,12 +9,17 @@ from src.models.country import Country
 
 class City(Base):
     """City representation"""
-    
+
     __tablename__ = 'cities'
+    includes = ("country",)
 
-    id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    country_code = db.Column(db.String(10), db.ForeignKey('countries.code'), nullable=False)
+    country_code = db.Column(
+        db.String(10),
+        db.ForeignKey('countries.code'),
+        nullable=False,
+        index=True,
+    )
 
     def __init__(self, name: str, country_code: str, **kw) -> None:
         """Dummy init"""
@@ -27,21 +32,11 @@ class City(Base):
         """Dummy repr"""
         return f"<City {self.id} ({self.name})>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "country_code": self.country_code,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
-
     @staticmethod
     def create(data: dict) -> "City":
         """Create a new city"""
         country = Country.query.filter_by(code=data["country_code"]).first()
-        
+
         if not country:
             raise ValueError("Country not found")
 
@@ -3,8 +3,12 @@ Country related functionality
 """
 
 from src import db
+from src.models.base import paginate
+from src.models.cache import cached_object, cached_objects
+from src.models.serializers import serializer
 
-class Country:
+
+class Country(db.Model):
     """
     Country representation
 
@@ -12,7 +16,7 @@ class Country:
 
     This class is used to get and list countries
     """
-    
+
     __tablename__ = 'countries'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -33,21 +37,30 @@ class Country:
 
     def to_dict(self) -> dict:
         """Returns the dictionary representation of the country"""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "code": self.code,
-        }
+        return serializer(Country)(self)
 
     @staticmethod
     def get_all() -> list["Country"]:
         """Get all countries"""
-        return Country.query.all()
+        return cached_objects(Country, ("all",), Country.query.all)
+
+    @staticmethod
+    def paginate(
+        limit: int | None, after: list | None = None, query=None
+    ) -> tuple[list["Country"], list | None]:
+        """Get a page of countries, or of the given query on countries,
+        ordered by id"""
+        query = Country.query if query is None else query
+
+        return paginate(query, (Country.id,), limit, after)
 
     @staticmethod
     def get(code: str) -> "Country | None":
         """Get a country by its code"""
-        return Country.query.filter_by(code=code).first()
+        return cached_object(
+            Country, ("code", code),
+            lambda: Country.query.filter_by(code=code).first(),
+        )
 
     @staticmethod
     def create(name: str, code: str) -> "Country":
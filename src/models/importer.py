@@ -0,0 +1,217 @@
+"""
+Bulk import of records into the database
+
+Records are read one at a time from NDJSON (one JSON object per line) or
+CSV (a header line, then one line per record), so a file of any size is
+imported in constant memory. They are inserted CHUNK_SIZE at a time, each
+chunk in a transaction of its own: its foreign keys are checked with one
+query per key for the values not seen yet (the ids found are kept for the
+next chunks), its unique fields with one query per field, and then it is
+written and committed.
+
+An import that fails keeps the chunks committed before the failure, and
+reports how many records they hold. Importing the same records again
+skipping that many resumes it where it stopped.
+"""
+
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+from sqlalchemy.exc import IntegrityError
+from src import db
+from src.models.amenity import Amenity
+from src.models.city import City
+from src.models.place import Place
+from src.models.review import Review
+from src.models.user import User
+
+# Models that can be imported, by the name of their collection
+IMPORTABLE = {
+    "amenities": Amenity,
+    "cities": City,
+    "places": Place,
+    "reviews": Review,
+    "users": User,
+}
+FORMATS = ("ndjson", "csv")
+# Records inserted per transaction
+CHUNK_SIZE = 1000
+# Fields set after the object is built, since not every constructor
+# takes them
+RESERVED = ("id", "created_at", "updated_at")
+
+
+class ImportFailed(ValueError):
+    """An import stopped by an invalid record, after `committed` records
+    were committed"""
+
+    def __init__(self, message: str, committed: int) -> None:
+        """Keeps how many records were committed"""
+        super().__init__(message)
+
+        self.committed = committed
+
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[dict]:
+    """Reads the records of NDJSON lines, skipping blank ones"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {number}: {e}") from e
+
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} is not an object")
+
+        yield record
+
+
+def read_csv(model, lines: Iterable[str]) -> Iterator[dict]:
+    """Reads the records of CSV lines, converting the values to the types
+    of the columns of the model. Empty values are left out."""
+    types = {
+        column.key: column.type.python_type
+        for column in model.__table__.columns
+    }
+
+    for row in csv.DictReader(lines):
+        yield {
+            key: convert(types.get(key, str), value)
+            for key, value in row.items()
+            if key is not None and value not in (None, "")
+        }
+
+
+def convert(kind: type, value: str):
+    """Converts a CSV value to the type of its column"""
+    if kind is bool:
+        if value.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"Invalid boolean {value}")
+        return value.lower() in ("true", "1")
+    if kind in (int, float):
+        return kind(value)
+
+    return value
+
+
+def read(model, lines: Iterable[str], format: str) -> Iterator[dict]:
+    """Reads the records of lines in the given format"""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format}")
+
+    if format == "csv":
+        return read_csv(model, lines)
+
+    return read_ndjson(lines)
+
+
+def fields_of(model) -> set[str]:
+    """Returns the fields a record of the model can have"""
+    fields = {column.key for column in model.__table__.columns}
+
+    if model is User:
+        fields.add("password")
+
+    return fields
+
+
+def build(model, record: dict):
+    """Builds an object of the model from a record"""
+    unknown = set(record) - fields_of(model)
+
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    data = dict(record)
+    reserved = {key: data.pop(key) for key in RESERVED if key in data}
+    instance = model._build(data)
+
+    for key, value in reserved.items():
+        if key != "id" and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        setattr(instance, key, value)
+
+    return instance
+
+
+def import_records(
+    model,
+    records: Iterable[dict],
+    chunk_size: int = CHUNK_SIZE,
+    skip: int = 0,
+    on_chunk: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    Imports records into the table of a model, `chunk_size` per
+    transaction, after skipping the first `skip` records (those of an
+    import that stopped). `on_chunk` is called with the progress after
+    every chunk. Returns the progress at the end: how many records were
+    imported and committed (skipped ones included), in how many chunks
+    and seconds, and the records imported per second.
+    Raises ImportFailed when a record is invalid.
+    """
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be positive")
+
+    records = islice(records, skip, None)
+    known = {}
+    start = perf_counter()
+    progress = {
+        "model": model.__tablename__,
+        "imported": 0,
+        "committed": skip,
+        "chunks": 0,
+        "seconds": 0.0,
+        "records_per_second": 0.0,
+    }
+
+    while True:
+        try:
+            chunk = list(islice(records, chunk_size))
+
+            if not chunk:
+                break
+
+            model._check_references(chunk, known)
+            model._check_unique(chunk)
+
+            instances = [build(model, record) for record in chunk]
+            db.session.add_all(instances)
+            db.session.commit()
+        except (IntegrityError, KeyError, TypeError, ValueError) as e:
+            db.session.rollback()
+
+            if isinstance(e, KeyError):
+                e = f"Missing field: {e}"
+            elif isinstance(e, IntegrityError):
+                e = e.orig
+
+            raise ImportFailed(
+                f"Records {progress['committed'] + 1}"
+                f"-{progress['committed'] + chunk_size}: {e}",
+                progress["committed"],
+            ) from None
+
+        # The objects aren't needed anymore, and would pile up
+        for instance in instances:
+            db.session.expunge(instance)
+
+        seconds = perf_counter() - start
+        progress["imported"] += len(chunk)
+        progress["committed"] += len(chunk)
+        progress["chunks"] += 1
+        progress["seconds"] = round(seconds, 3)
+        progress["records_per_second"] = round(
+            progress["imported"] / seconds if seconds else 0.0, 1
+        )
+
+        if on_chunk is not None:
+            on_chunk(dict(progress))
+
+    return progress
@@ -1,31 +1,106 @@
 """
 Place related functionality
 """
+import heapq
+from itertools import islice
+from typing import Any
+from sqlalchemy.orm import validates
 from src import db
-from src.models.base import Base
+from src.models.amenity import Amenity, PlaceAmenity
+from src.models.base import YIELD_PER, Base, chunks, paginate
 from src.models.city import City
 from src.models.user import User
+from utils.geo import (
+    PREFIX_END,
+    bounding_boxes,
+    covering_cells,
+    encode_geohash,
+    haversine_km,
+)
+
+# Filters of the place search: name -> (column, operator). Numbers are
+# lower bounds, except max_price. amenities lists names or ids of
+# amenities, the places must have all of them
+FILTERS = {
+    "city_id": ("city_id", "=="),
+    "host_id": ("host_id", "=="),
+    "country_code": ("country_code", "=="),
+    "min_price": ("price_per_night", ">="),
+    "max_price": ("price_per_night", "<="),
+    "max_guests": ("max_guests", ">="),
+    "number_of_rooms": ("number_of_rooms", ">="),
+    "number_of_bathrooms": ("number_of_bathrooms", ">="),
+    "min_rating": ("avg_rating", ">="),
+    "min_reviews": ("review_count", ">="),
+    "amenities": ("amenities", "all"),
+}
+
+# Sort keys of the place search, prefixed with "-" for descending order
+SORTS = {
+    "created_at": "created_at",
+    "price": "price_per_night",
+    "max_guests": "max_guests",
+    "number_of_rooms": "number_of_rooms",
+    "rating": "avg_rating",
+    "review_count": "review_count",
+}
+
+# Rating aggregates of the reviews of a place, kept up to date by the
+# reviews (see review.py) rather than set by clients
+AGGREGATES = ("review_count", "rating_sum", "avg_rating")
+# Largest difference between a stored and a recomputed rating sum that
+# isn't drift, but the rounding of the additions
+RATING_TOLERANCE = 1e-6
 
 
 class Place(Base):
     """Place representation"""
 
     __tablename__ = 'places'
+    # Internal to the geographic search
+    hidden_fields = ("geohash",)
+    # Kept up to date by the model, batch updates can't set them
+    computed_fields = ("geohash", *AGGREGATES)
+    # Relations a response can embed with ?include=
+    includes = ("host", "city", "reviews", "amenities")
+    # Fields of the full-text search, with the weight of their matches
+    text_fields = {"name": 10.0, "description": 2.0, "address": 1.0}
 
     name = db.Column(db.String(50), nullable=False)
     description = db.Column(db.String(200))
     address = db.Column(db.String(200))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    host_id = db.Column(db.String(50), db.ForeignKey('users.id'), nullable=False)
-    city_id = db.Column(db.String(50), db.ForeignKey('cities.id'), nullable=False)
+    # Kept in sync with the coordinates, see utils/geo.py
+    geohash = db.Column(db.String(12), index=True)
+    # Indexed by the composite indexes at the end of the module
+    host_id = db.Column(
+        db.String(50), db.ForeignKey('users.id'), nullable=False
+    )
+    city_id = db.Column(
+        db.String(50), db.ForeignKey('cities.id'), nullable=False
+    )
     price_per_night = db.Column(db.Integer)
     number_of_rooms = db.Column(db.Integer)
     number_of_bathrooms = db.Column(db.Integer)
     max_guests = db.Column(db.Integer)
+    # Of the reviews with a rating. avg_rating is 0 without any, so that
+    # it can be a sort key
+    review_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    rating_sum = db.Column(
+        db.Float, nullable=False, default=0.0, server_default="0"
+    )
+    avg_rating = db.Column(
+        db.Float, nullable=False, default=0.0, server_default="0"
+    )
 
     host = db.relationship('User', backref=db.backref('places', lazy=True))
     city = db.relationship('City', backref=db.backref('places', lazy=True))
+    amenities = db.relationship(
+        'Amenity', secondary='place_amenities', lazy=True, viewonly=True
+    )
 
     def __init__(self, data: dict | None = None, **kw) -> None:
         """Dummy init"""
@@ -50,24 +125,34 @@ class Place(Base):
         """Dummy repr"""
         return f"<Place {self.id} ({self.name})>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            "address": self.address,
-            "latitude": self.latitude,
-            "longitude": self.longitude,
-            "city_id": self.city_id,
-            "host_id": self.host_id,
-            "price_per_night": self.price_per_night,
-            "number_of_rooms": self.number_of_rooms,
-            "number_of_bathrooms": self.number_of_bathrooms,
-            "max_guests": self.max_guests,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
+    @validates("latitude", "longitude")
+    def _sync_geohash(self, key: str, value: Any) -> float | None:
+        """Checks a coordinate and updates the geohash when it changes.
+        Raises ValueError for values that aren't a number in range"""
+        if value is not None:
+            try:
+                if isinstance(value, bool):
+                    raise TypeError
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a number") from None
+
+            limit = 90 if key == "latitude" else 180
+
+            if not -limit <= value <= limit:
+                raise ValueError(
+                    f"{key} must be between -{limit} and {limit}"
+                )
+
+        latitude = value if key == "latitude" else self.latitude
+        longitude = value if key == "longitude" else self.longitude
+
+        if latitude is None or longitude is None:
+            self.geohash = None
+        else:
+            self.geohash = encode_geohash(latitude, longitude)
+
+        return value
 
     @staticmethod
     def create(data: dict) -> "Place":
@@ -88,6 +173,296 @@ class Place(Base):
 
         return new_place
 
+    @classmethod
+    def _build(cls, data: dict) -> "Place":
+        """Builds a place from the data sent to create it"""
+        return Place(data=data)
+
+    @classmethod
+    def search(cls, **filters: str):
+        """
+        Builds the query of the places matching the given filters, see
+        FILTERS. Raises ValueError for unknown filters or bad values.
+        """
+        query = cls.query
+
+        for name, value in filters.items():
+            if name not in FILTERS:
+                raise ValueError(f"Unknown filter {name}")
+
+            field, operator = FILTERS[name]
+
+            if field == "country_code":
+                query = query.join(City).filter(City.country_code == value)
+                continue
+
+            if field == "amenities":
+                names = list(dict.fromkeys(
+                    name.strip() for name in value.split(",") if name.strip()
+                ))
+
+                if not names:
+                    raise ValueError("amenities can't be empty")
+
+                # Changes to the amenities of a place don't invalidate
+                # the cache of the places
+                query = query.filter(cls.id.in_(
+                    PlaceAmenity.places_with_all(Amenity.resolve(names))
+                )).execution_options(read_cache=False)
+                continue
+
+            column = getattr(cls, field)
+
+            if column.type.python_type is int:
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise ValueError(f"{name} must be an integer") from None
+            elif column.type.python_type is float:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError(f"{name} must be a number") from None
+
+            if operator == "==":
+                query = query.filter(column == value)
+            elif operator == ">=":
+                query = query.filter(column >= value)
+            else:
+                query = query.filter(column <= value)
+
+        return query
+
+    @classmethod
+    def paginate(
+        cls,
+        limit: int | None,
+        after: list | None = None,
+        query=None,
+        sort: str = "created_at",
+    ) -> tuple[list["Place"], list | None]:
+        """
+        Get a page of places, or of the given query, ordered by one of
+        the SORTS and then by id.
+        """
+        name = sort.removeprefix("-")
+
+        if name not in SORTS:
+            raise ValueError(f"Unknown sort key {name}")
+
+        return paginate(
+            cls.query if query is None else query,
+            (getattr(cls, SORTS[name]), cls.id),
+            limit,
+            after,
+            descending=sort.startswith("-"),
+        )
+
+    @classmethod
+    def box_filter(
+        cls,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+    ):
+        """
+        Builds the condition of the places inside a box, using the geohash
+        index to only read the cells that cover it.
+        """
+        cells = covering_cells(min_lat, min_lon, max_lat, max_lon)
+        condition = db.and_(
+            cls.latitude.between(min_lat, max_lat),
+            cls.longitude.between(min_lon, max_lon),
+        )
+
+        if cells:
+            condition = db.and_(condition, db.or_(*(
+                db.and_(cls.geohash >= cell, cls.geohash < cell + PREFIX_END)
+                for cell in cells
+            )))
+
+        return condition
+
+    @classmethod
+    def in_box(
+        cls,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+    ):
+        """Builds the query of the places inside a box"""
+        return cls.query.filter(
+            cls.box_filter(min_lat, min_lon, max_lat, max_lon)
+        )
+
+    @staticmethod
+    def by_distance(
+        places: list["Place"], latitude: float, longitude: float
+    ) -> list[tuple["Place", float]]:
+        """Pairs places with their distance in km to a point, closest
+        first. The distances are computed at once for every place"""
+        distances = haversine_km(
+            latitude,
+            longitude,
+            [place.latitude for place in places],
+            [place.longitude for place in places],
+        )
+
+        return sorted(zip(places, distances), key=lambda pair: pair[1])
+
+    @classmethod
+    def closest(
+        cls,
+        query,
+        latitude: float,
+        longitude: float,
+        limit: int,
+        radius_km: float | None = None,
+    ) -> list[tuple["Place", float]]:
+        """
+        Get up to `limit` places of a query closest to a point, within
+        `radius_km` if given, paired with their distance in km. The
+        candidates are read YIELD_PER at a time and only the closest are
+        kept, however many the query matches.
+        """
+        candidates = iter(query.yield_per(YIELD_PER))
+        closest = []
+
+        while batch := list(islice(candidates, YIELD_PER)):
+            pairs = cls.by_distance(batch, latitude, longitude)
+
+            if radius_km is not None:
+                pairs = [pair for pair in pairs if pair[1] <= radius_km]
+
+            closest = heapq.nsmallest(
+                limit, closest + pairs, key=lambda pair: pair[1]
+            )
+
+        return closest
+
+    @classmethod
+    def nearby(
+        cls, latitude: float, longitude: float, radius_km: float, limit: int
+    ) -> list[tuple["Place", float]]:
+        """
+        Get up to `limit` places within `radius_km` of a point, closest
+        first, paired with their distance in km.
+        """
+        query = cls.query.filter(db.or_(*(
+            cls.box_filter(*box)
+            for box in bounding_boxes(latitude, longitude, radius_km)
+        )))
+
+        return cls.closest(query, latitude, longitude, limit, radius_km)
+
+    @classmethod
+    def within(
+        cls,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        limit: int,
+    ) -> list[tuple["Place", float]]:
+        """
+        Get up to `limit` places inside a box, closest to its center
+        first, paired with their distance in km to the center.
+        """
+        return cls.closest(
+            cls.in_box(min_lat, min_lon, max_lat, max_lon),
+            (min_lat + max_lat) / 2,
+            (min_lon + max_lon) / 2,
+            limit,
+        )
+
+    @classmethod
+    def add_ratings(
+        cls, session, changes: dict[str, tuple[int, float]]
+    ) -> None:
+        """
+        Adds to the rating aggregates of places, by id, a number of
+        ratings and their sum (negative to remove them). The new values
+        are computed by the database from the stored ones, in one UPDATE
+        per chunk of places, so concurrent reviews don't lose updates.
+        """
+        ids = [place_id for place_id, change in changes.items() if any(change)]
+        pending = {
+            obj.id: obj for obj in session.new if isinstance(obj, cls)
+        }
+
+        # Places the same flush inserts have no row to update yet
+        for place in (pending[key] for key in ids if key in pending):
+            count, total = changes[place.id]
+            place.review_count = (place.review_count or 0) + count
+            place.rating_sum = (place.rating_sum or 0.0) + total
+            place.avg_rating = (
+                place.rating_sum / place.review_count
+                if place.review_count > 0 else 0.0
+            )
+
+        ids = [place_id for place_id in ids if place_id not in pending]
+
+        for chunk in chunks(ids):
+            count = db.case(
+                {place_id: changes[place_id][0] for place_id in chunk},
+                value=cls.id, else_=0,
+            )
+            total = db.case(
+                {place_id: changes[place_id][1] for place_id in chunk},
+                value=cls.id, else_=0.0,
+            )
+
+            # Every SET expression reads the values before the update
+            session.execute(
+                db.update(cls).where(cls.id.in_(chunk)).values(
+                    review_count=cls.review_count + count,
+                    rating_sum=cls.rating_sum + total,
+                    avg_rating=db.case(
+                        (
+                            cls.review_count + count > 0,
+                            (cls.rating_sum + total)
+                            / (cls.review_count + count),
+                        ),
+                        else_=0.0,
+                    ),
+                ).execution_options(synchronize_session="fetch")
+            )
+
+    @classmethod
+    def repair_ratings(cls) -> int:
+        """
+        Recomputes the rating aggregates of the places whose stored values
+        drifted from their reviews, in a single UPDATE. Returns how many
+        places were repaired.
+        """
+        # Imported here to avoid circular imports
+        from src.models.review import Review
+
+        def reviews(aggregate):
+            """Subquery of an aggregate of the ratings of a place"""
+            return db.select(aggregate).where(
+                Review.place_id == cls.id
+            ).scalar_subquery()
+
+        count = reviews(db.func.count(Review.rating))
+        total = reviews(db.func.coalesce(db.func.sum(Review.rating), 0.0))
+        average = reviews(db.func.coalesce(db.func.avg(Review.rating), 0.0))
+
+        result = db.session.execute(
+            db.update(cls).where(db.or_(
+                cls.review_count != count,
+                db.func.abs(cls.rating_sum - total) > RATING_TOLERANCE,
+                db.func.abs(cls.avg_rating - average) > RATING_TOLERANCE,
+            )).values(
+                review_count=count, rating_sum=total, avg_rating=average
+            ).execution_options(synchronize_session="fetch")
+        )
+        db.session.commit()
+
+        return result.rowcount
+
     @staticmethod
     def update(place_id: str, data: dict) -> "Place | None":
         """Update an existing place"""
@@ -96,9 +471,37 @@ class Place(Base):
         if not place:
             return None
 
-        for key, value in data.items():
-            setattr(place, key, value)
+        for key in Place.computed_fields:
+            if key in data:
+                raise ValueError(f"{key} can't be set")
+
+        try:
+            for key, value in data.items():
+                setattr(place, key, value)
+        except ValueError:
+            db.session.rollback()
+            raise
 
         db.session.commit()
 
         return place
+
+
+# The filters and sorts clients combine the most: by city or host in
+# creation order, by city and price, and by price alone
+db.Index(
+    "ix_places_city_id_created_at_id",
+    Place.city_id, Place.created_at, Place.id,
+)
+db.Index(
+    "ix_places_city_id_price_per_night_id",
+    Place.city_id, Place.price_per_night, Place.id,
+)
+db.Index(
+    "ix_places_host_id_created_at_id",
+    Place.host_id, Place.created_at, Place.id,
+)
+db.Index("ix_places_price_per_night_id", Place.price_per_night, Place.id)
+# Best rated or most reviewed first
+db.Index("ix_places_avg_rating_id", Place.avg_rating, Place.id)
+db.Index("ix_places_review_count_id", Place.review_count, Place.id)
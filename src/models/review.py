@@ -1,9 +1,19 @@
 """
 Review related functionality
+
+The rating aggregates of the places (see place.py) follow the reviews:
+before every flush, the reviews it inserts, deletes or moves to another
+place or rating are added to or removed from the aggregates of their
+places, in the same transaction. Whatever writes the reviews (create,
+update, delete, the bulk methods or an import) keeps them up to date.
 """
 
+from typing import Any
+from sqlalchemy import event
+from sqlalchemy.orm import Session, validates
+from sqlalchemy.orm.attributes import get_history
 from src import db
-from src.models.base import Base
+from src.models.base import Base, chunks
 from src.models.place import Place
 from src.models.user import User
 
@@ -12,9 +22,16 @@ class Review(Base):
     """Review representation"""
 
     __tablename__ = 'reviews'
-
-    place_id = db.Column(db.String(50), db.ForeignKey('places.id'), nullable=False)
-    user_id = db.Column(db.String(50), db.ForeignKey('users.id'), nullable=False)
+    includes = ("user", "place")
+    # Fields of the full-text search, with the weight of their matches
+    text_fields = {"comment": 2.0}
+
+    place_id = db.Column(
+        db.String(50), db.ForeignKey('places.id'), nullable=False, index=True
+    )
+    user_id = db.Column(
+        db.String(50), db.ForeignKey('users.id'), nullable=False, index=True
+    )
     comment = db.Column(db.String(200))
     rating = db.Column(db.Float)
 
@@ -36,17 +53,24 @@ class Review(Base):
         """Dummy repr"""
         return f"<Review {self.id} - '{self.comment[:25]}...'>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "place_id": self.place_id,
-            "user_id": self.user_id,
-            "comment": self.comment,
-            "rating": self.rating,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-        }
+    @validates("rating")
+    def _check_rating(self, key: str, value: Any) -> float | None:
+        """Converts the rating to a number, the aggregates of the place
+        add it up. Raises ValueError for anything else"""
+        if value is None:
+            return None
+
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError("rating must be a number") from None
+
+        if value != value:
+            raise ValueError("rating must be a number")
+
+        return value
 
     @staticmethod
     def create(data: dict) -> "Review":
@@ -75,9 +99,78 @@ class Review(Base):
         if not review:
             return None
 
-        for key, value in data.items():
-            setattr(review, key, value)
+        try:
+            for key, value in data.items():
+                setattr(review, key, value)
+        except ValueError:
+            db.session.rollback()
+            raise
 
         db.session.commit()
 
         return review
+
+    @classmethod
+    def delete_many(cls, ids: list[str]) -> int:
+        """Deletes many reviews at once, removing their ratings from
+        their places first"""
+        changes = {}
+
+        for chunk in chunks(ids):
+            for place_id, count, total in db.session.execute(
+                db.select(
+                    cls.place_id,
+                    db.func.count(cls.rating),
+                    db.func.coalesce(db.func.sum(cls.rating), 0.0),
+                ).where(cls.id.in_(chunk)).group_by(cls.place_id)
+            ):
+                previous = changes.get(place_id, (0, 0.0))
+                changes[place_id] = (
+                    previous[0] - count, previous[1] - total
+                )
+
+        Place.add_ratings(db.session, changes)
+
+        return super().delete_many(ids)
+
+
+def committed(review: Review, key: str):
+    """Returns the value of a field of a review before its changes"""
+    history = get_history(review, key)
+    values = history.deleted or history.unchanged
+
+    return values[0] if values else None
+
+
+@event.listens_for(Session, "before_flush")
+def _update_ratings(session: Session, flush_context, instances) -> None:
+    """Adds the ratings of the reviews a flush writes to the aggregates
+    of their places"""
+    changes = {}
+
+    def add(place_id: str | None, rating: float | None, sign: int) -> None:
+        """Adds (or removes) a rating of a place"""
+        if place_id is None or rating is None:
+            return
+
+        count, total = changes.get(place_id, (0, 0.0))
+        changes[place_id] = (count + sign, total + sign * rating)
+
+    for obj in session.new:
+        if isinstance(obj, Review):
+            add(obj.place_id, obj.rating, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Review):
+            add(committed(obj, "place_id"), committed(obj, "rating"), -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Review) and (
+            get_history(obj, "place_id").has_changes()
+            or get_history(obj, "rating").has_changes()
+        ):
+            add(committed(obj, "place_id"), committed(obj, "rating"), -1)
+            add(obj.place_id, obj.rating, 1)
+
+    if changes:
+        Place.add_ratings(session, changes)
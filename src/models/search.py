@@ -0,0 +1,377 @@
+"""
+Full-text search over places and reviews
+
+The text fields of places (name, description, address) and reviews
+(comment) are indexed in an SQLite FTS5 table, `search_index`, one row per
+object. The session events below keep it in sync: after every flush, the
+rows of the places and reviews it inserted, deleted or whose text changed
+are replaced, in the same transaction, and bulk deletes (e.g.
+Base.delete_many) remove the rows of the objects they delete.
+`python manage.py rebuild-search` rebuilds the whole index (e.g. for a
+database created before it existed).
+
+Matches are ranked with BM25, weighting each field by the `text_fields`
+of its model. Other databases than SQLite don't have FTS5: there the text
+is scanned and ranked the same way by the inverted index the in-memory
+repositories use (see utils/text.py), built for every search.
+"""
+
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from src import db
+from src.models.base import chunks
+from src.models.place import Place
+from src.models.review import Review
+from utils.text import (
+    ELLIPSIS,
+    SENTINELS,
+    SNIPPET_TOKENS,
+    TextIndex,
+    fts_query,
+    markup,
+    parse_query,
+    snippet,
+)
+
+TABLE = "search_index"
+# Models in the index, by the type of their rows
+KINDS = {"place": Place, "review": Review}
+# Every text field of the index, in the order of its columns
+FIELDS = list(dict.fromkeys(
+    field for model in KINDS.values() for field in model.text_fields
+))
+# Weight of a match in each text field
+WEIGHTS = {
+    field: max(model.text_fields.get(field, 0.0) for model in KINDS.values())
+    for field in FIELDS
+}
+# BM25 rank of a row, with the weights of the text columns (the type and
+# id columns aren't matched)
+RANK = "bm25({}, 0, 0, {})".format(
+    TABLE, ", ".join(str(weight) for weight in WEIGHTS.values())
+)
+SNIPPET = "snippet({}, -1, '{}', '{}', '{}', {})".format(
+    TABLE, *SENTINELS, ELLIPSIS, SNIPPET_TOKENS
+)
+
+CREATE = db.DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    f"kind UNINDEXED, object_id UNINDEXED, {', '.join(FIELDS)}, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP = db.DDL(f"DROP TABLE IF EXISTS {TABLE}")
+
+# Engines whose database was found to have the index
+indexed: WeakKeyDictionary = WeakKeyDictionary()
+
+event.listen(
+    db.metadata, "after_create", CREATE.execute_if(dialect="sqlite")
+)
+event.listen(db.metadata, "before_drop", DROP.execute_if(dialect="sqlite"))
+
+
+@event.listens_for(db.metadata, "after_drop")
+def _forget(target, connection, **kw) -> None:
+    """The index was dropped with the tables"""
+    indexed.pop(connection.engine, None)
+
+
+def available(connection) -> bool:
+    """Whether the database of a connection has the index. Only finding
+    it is remembered: it may still be created (see rebuild)"""
+    engine = connection.engine
+
+    if engine in indexed:
+        return True
+    if engine.dialect.name != "sqlite":
+        return False
+
+    found = bool(connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (TABLE,)
+    ).first())
+
+    if found:
+        indexed[engine] = True
+
+    return found
+
+
+def row(kind: str, obj) -> dict:
+    """The row of an object in the index"""
+    fields = KINDS[kind].text_fields
+
+    return {"kind": kind, "object_id": obj.id} | {
+        field: getattr(obj, field) if field in fields else None
+        for field in FIELDS
+    }
+
+
+def text_changed(kind: str, obj) -> bool:
+    """Whether the text fields of an object changed"""
+    return any(
+        get_history(obj, field).has_changes()
+        for field in KINDS[kind].text_fields
+    )
+
+
+def remove_rows(connection, removed: list[dict]) -> None:
+    """Deletes the rows of objects, by kind and object_id"""
+    connection.execute(db.text(
+        f"DELETE FROM {TABLE} WHERE kind = :kind AND object_id = :object_id"
+    ), removed)
+
+
+@event.listens_for(Session, "after_flush")
+def _update_index(session: Session, flush_context) -> None:
+    """Replaces the rows of the places and reviews a flush wrote"""
+    removed = []
+    added = []
+
+    for kind, model in KINDS.items():
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                removed.append({"kind": kind, "object_id": obj.id})
+
+        for obj in (*session.new, *session.dirty):
+            if isinstance(obj, model) and (
+                obj in session.new or text_changed(kind, obj)
+            ):
+                removed.append({"kind": kind, "object_id": obj.id})
+                added.append(row(kind, obj))
+
+    if not removed:
+        return
+
+    connection = session.connection()
+
+    if not available(connection):
+        return
+
+    remove_rows(connection, removed)
+
+    if added:
+        connection.execute(db.text(
+            f"INSERT INTO {TABLE} (kind, object_id, {', '.join(FIELDS)}) "
+            f"VALUES (:kind, :object_id, {', '.join(':' + f for f in FIELDS)})"
+        ), added)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _remove_bulk_deleted(state) -> None:
+    """Removes the rows of the places or reviews a bulk delete deletes,
+    which the flush events never see"""
+    if not state.is_delete or state.bind_mapper is None:
+        return
+
+    model = state.bind_mapper.class_
+    kind = next((k for k, m in KINDS.items() if m is model), None)
+    connection = state.session.connection()
+
+    if kind is None or not available(connection):
+        return
+
+    ids = db.select(model.id)
+    if state.statement.whereclause is not None:
+        ids = ids.where(state.statement.whereclause)
+
+    removed = [
+        {"kind": kind, "object_id": obj_id}
+        for obj_id in state.session.scalars(ids)
+    ]
+
+    if removed:
+        remove_rows(connection, removed)
+
+
+def rebuild() -> dict[str, int]:
+    """Creates the index if it doesn't exist and indexes every place and
+    review again. Returns how many objects of each type were indexed"""
+    connection = db.session.connection()
+
+    if connection.dialect.name != "sqlite":
+        raise ValueError("Full-text search needs SQLite with FTS5")
+
+    connection.execute(CREATE)
+    connection.exec_driver_sql(f"DELETE FROM {TABLE}")
+    counts = {}
+
+    for kind, model in KINDS.items():
+        fields = model.text_fields
+        columns = ", ".join(
+            field if field in fields else "NULL" for field in FIELDS
+        )
+
+        counts[kind] = connection.exec_driver_sql(
+            f"INSERT INTO {TABLE} (kind, object_id, {', '.join(FIELDS)}) "
+            f"SELECT '{kind}', id, {columns} FROM {model.__tablename__}"
+        ).rowcount
+
+    db.session.commit()
+    indexed[connection.engine] = True
+
+    return counts
+
+
+class Hit(NamedTuple):
+    """A match of a search, its snippet is HTML"""
+    kind: str
+    object_id: str
+    rank: float
+    snippet: str
+
+
+def search(
+    query: str,
+    kinds: list[str] | None = None,
+    limit: int | None = None,
+    after: list | None = None,
+) -> tuple[list[dict], list | None]:
+    """
+    Searches the places and reviews (or only the given kinds) matching
+    every term of a query (see utils/text.py), best first. Pages are
+    keyset paginated by (rank, object_id) like Base.paginate: returns up
+    to `limit` results, or every one without a limit, starting after the
+    `after` key, and the key of the last one if there are more.
+    Each result has the type, the object, its score and a snippet of
+    the field that matched the best, with the matches marked.
+    Raises ValueError for invalid queries or keys.
+    """
+    terms = parse_query(query)
+    kinds = kinds or list(KINDS)
+    unknown = [kind for kind in kinds if kind not in KINDS]
+
+    if unknown:
+        raise ValueError(f"Unknown types: {', '.join(unknown)}")
+
+    if after is not None and (
+        len(after) != 2
+        or not isinstance(after[0], (int, float))
+        or isinstance(after[0], bool)
+        or not isinstance(after[1], str)
+    ):
+        raise ValueError("Invalid cursor")
+
+    # One more hit tells whether there is a next page
+    size = None if limit is None else limit + 1
+    connection = db.session.connection()
+
+    if available(connection):
+        hits = match(connection, terms, kinds, size, after)
+    else:
+        hits = scan(terms, kinds, size, after)
+
+    key = None
+
+    if limit is not None and len(hits) > limit:
+        hits = hits[:limit]
+        key = [hits[-1].rank, hits[-1].object_id]
+
+    return load(hits), key
+
+
+def match(
+    connection,
+    terms: list[tuple[str, bool]],
+    kinds: list[str],
+    size: int | None,
+    after: list | None,
+) -> list[Hit]:
+    """Gets a page of hits from the FTS5 index"""
+    params = {"query": fts_query(terms), "kinds": kinds}
+    where = [f"{TABLE} MATCH :query", "kind IN :kinds"]
+
+    if after is not None:
+        params["rank"], params["object_id"] = after
+        where.append(
+            f"({RANK} > :rank OR ({RANK} = :rank AND object_id > :object_id))"
+        )
+
+    if size is not None:
+        params["size"] = size
+
+    statement = db.text(
+        f"SELECT kind, object_id, {RANK} AS rank, {SNIPPET} AS snippet "
+        f"FROM {TABLE} WHERE {' AND '.join(where)} "
+        "ORDER BY rank, object_id"
+        + ("" if size is None else " LIMIT :size")
+    ).bindparams(db.bindparam("kinds", expanding=True))
+
+    try:
+        rows = connection.execute(statement, params).all()
+    except OperationalError as e:
+        raise ValueError(f"Invalid query: {e.orig}") from None
+
+    return [
+        Hit(row.kind, row.object_id, row.rank, markup(row.snippet))
+        for row in rows
+    ]
+
+
+def scan(
+    terms: list[tuple[str, bool]],
+    kinds: list[str],
+    size: int | None,
+    after: list | None,
+) -> list[Hit]:
+    """Gets a page of hits without the index, for the databases that
+    don't have FTS5: the text of every object of the kinds is read, in
+    one query per type, and ranked with an inverted index built for this
+    search only. Costs a scan, but ranks and pages like the index"""
+    # One index for every type, so rare terms are rare in all of them
+    # like in the FTS5 table
+    index = TextIndex({"all": WEIGHTS})
+    texts = {}
+
+    for kind in kinds:
+        model = KINDS[kind]
+        fields = list(model.text_fields)
+
+        for obj_id, *values in db.session.execute(db.select(
+            model.id, *(getattr(model, field) for field in fields)
+        )):
+            texts[obj_id] = (kind, dict(zip(fields, values)))
+            index.add("all", obj_id, texts[obj_id][1])
+
+    ranked = [
+        (-score, obj_id) for obj_id, score in index.search("all", terms)
+    ]
+    ranked.sort()
+
+    if after is not None:
+        ranked = [hit for hit in ranked if tuple(after) < hit]
+
+    # The snippet of the field with the highest weight that matches
+    return [
+        Hit(texts[obj_id][0], obj_id, rank, next(filter(None, (
+            snippet(text, terms) for text in texts[obj_id][1].values()
+        )), ""))
+        for rank, obj_id in ranked[:size]
+    ]
+
+
+def load(hits: list[Hit]) -> list[dict]:
+    """Loads the objects of hits, with one query per type, and skips
+    those that were deleted"""
+    objects = {}
+
+    for kind, model in KINDS.items():
+        ids = [hit.object_id for hit in hits if hit.kind == kind]
+
+        for chunk in chunks(ids):
+            for obj in model.query.filter(model.id.in_(chunk)):
+                objects[kind, obj.id] = obj
+
+    return [
+        {
+            "type": hit.kind,
+            "object": objects[hit.kind, hit.object_id],
+            # BM25 ranks are negative, the best match is the lowest
+            "score": -hit.rank,
+            "snippet": hit.snippet,
+        }
+        for hit in hits if (hit.kind, hit.object_id) in objects
+    ]
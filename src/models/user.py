@@ -8,11 +8,12 @@ from flask_bcrypt import Bcrypt
 
 bcrypt = Bcrypt()
 
+
 class User(Base):
     """User representation"""
 
     __tablename__ = 'users'
-
+    hidden_fields = ("username", "password_hash")
 
     id = db.Column(db.String(50), primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -22,7 +23,7 @@ class User(Base):
     updated_at = db.Column(db.DateTime, onupdate=db.func.current_timestamp())
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
-    is_adming = db.Column(db.Boolean, default=False)
+    is_admin = db.Column(db.Boolean, default=False)
 
     def __init__(self, email: str, first_name: str, last_name: str, **kw):
         """Initialize the user"""
@@ -35,21 +36,11 @@ class User(Base):
         """String representation of the user"""
         return f"<User {self.id} ({self.email})>"
 
-    def to_dict(self) -> dict:
-        """Dictionary representation of the object"""
-        return {
-            "id": self.id,
-            "email": self.email,
-            "first_name": self.first_name,
-            "last_name": self.last_name,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            "is_admind": self.is_admin,
-        }
-
     def set_password(self, password):
         """Hash and set the user's password"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = bcrypt.generate_password_hash(
+            password
+        ).decode('utf-8')
 
     def check_password(self, password):
         """Checks the user's password"""
@@ -70,6 +61,22 @@ class User(Base):
 
         return new_user
 
+    @classmethod
+    def _build(cls, data: dict) -> "User":
+        """Builds a user from the data sent to create it, with a password
+        or already hashed one (imports)"""
+        data = dict(data)
+
+        if "password_hash" in data and "password" not in data:
+            return User(**data)
+
+        password = data.pop("password")
+
+        user = User(**data)
+        user.set_password(password)
+
+        return user
+
     @staticmethod
     def update(user_id: str, data: dict) -> "User | None":
         """Update an existing user"""
@@ -3,11 +3,20 @@ to be used based on the environment variable REPOSITORY_ENV_VAR."""
 
 import os
 
+from src.config import Config
+from src.persistence.concurrent import ConcurrentRepository
 from src.persistence.repository import Repository
-from utils.constants import REPOSITORY_ENV_VAR
+from utils.constants import FILE_STORAGE_MODE_ENV_VAR, REPOSITORY_ENV_VAR
 
 repo: Repository
 
+flush_options = {
+    "flush_policy": Config.REPOSITORY_FLUSH_POLICY,
+    "flush_interval_ms": Config.REPOSITORY_FLUSH_INTERVAL_MS,
+    "flush_max_pending": Config.REPOSITORY_FLUSH_MAX_PENDING,
+    "shared": Config.REPOSITORY_SHARED,
+}
+
 if os.getenv(key=REPOSITORY_ENV_VAR) == "db":
     from src.persistence.db import DBRepository
 
@@ -15,14 +24,24 @@ if os.getenv(key=REPOSITORY_ENV_VAR) == "db":
 elif os.getenv(REPOSITORY_ENV_VAR) == "file":
     from src.persistence.file import FileRepository
 
-    repo = FileRepository()
+    repo = FileRepository(
+        journaled=os.getenv(FILE_STORAGE_MODE_ENV_VAR) == "journal",
+        **flush_options,
+    )
 elif os.getenv(REPOSITORY_ENV_VAR) == "pickle":
     from src.persistence.pickled import PickleRepository
 
-    repo = PickleRepository()
+    repo = PickleRepository(
+        parallel_load=Config.PICKLE_PARALLEL_LOAD, **flush_options
+    )
 else:
     from src.persistence.memory import MemoryRepository
 
     repo = MemoryRepository()
 
 print(f"Using {repo.__class__.__name__} as repository")
+
+# SQLite handles concurrency itself, the other repositories keep their
+# objects in memory and need a lock to be used by threaded workers
+if os.getenv(REPOSITORY_ENV_VAR) != "db":
+    repo = ConcurrentRepository(repo)
@@ -0,0 +1,241 @@
+"""
+This module exports ConcurrentRepository, which makes a repository that
+keeps its objects in memory safe to use from many threads (for example
+gunicorn gthread workers), and the RWLock it is built on
+
+Mutations hold the write lock, so there is a single writer at a time and
+it never runs while a reader walks the objects of the repository. Reads of
+a whole model don't lock at all: they return a copy of a snapshot of the
+model, published by the first reader after the model last changed. Reads
+that can't use a snapshot share the read lock, so they run in parallel;
+the wrapped repositories that change their data while reading (to catch
+up or build instances) do it under a mutex of their own.
+"""
+
+from contextlib import contextmanager
+import threading
+from src.persistence.repository import Repository
+
+
+class RWLock:
+    """Lock held by many readers or a single writer. Waiting writers go
+    first so a steady flow of readers can't starve them. The writer may
+    take both locks again while it holds the write lock"""
+
+    def __init__(self) -> None:
+        """Starts unlocked"""
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writers_waiting = 0
+        self.__writer: int | None = None
+        self.__depth = 0
+
+    @contextmanager
+    def read(self):
+        """Holds the lock shared by every reader"""
+        if self.__writer == threading.get_ident():
+            yield
+            return
+
+        with self.__condition:
+            while self.__writer is not None or self.__writers_waiting:
+                self.__condition.wait()
+            self.__readers += 1
+
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__readers -= 1
+                if not self.__readers:
+                    self.__condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Holds the lock exclusively"""
+        me = threading.get_ident()
+
+        with self.__condition:
+            if self.__writer != me:
+                self.__writers_waiting += 1
+                while self.__writer is not None or self.__readers:
+                    self.__condition.wait()
+                self.__writers_waiting -= 1
+                self.__writer = me
+            self.__depth += 1
+
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__depth -= 1
+                if not self.__depth:
+                    self.__writer = None
+                    self.__condition.notify_all()
+
+
+class ConcurrentRepository(Repository):
+    """Thread safe wrapper around a repository"""
+
+    def __init__(self, repo: Repository) -> None:
+        """Wraps the given repository"""
+        self.repo = repo
+        self.lock = RWLock()
+
+        # model -> amount of mutations, and the snapshot of every model
+        # with the version it was taken at
+        self.__versions: dict[str, int] = {}
+        self.__snapshots: dict[str, tuple[int, dict]] = {}
+
+    def __getattr__(self, name: str):
+        """Exposes the attributes of the wrapped repository"""
+        return getattr(self.repo, name)
+
+    def _snapshot(self, model_name: str) -> dict | None:
+        """Helper method to get the current snapshot of a model, without
+        locking. None when the model changed since it was taken"""
+        self._catch_up()
+
+        snapshot = self.__snapshots.get(model_name)
+
+        if snapshot and snapshot[0] == self.__versions.get(model_name, 0):
+            return snapshot[1]
+
+        return None
+
+    def _catch_up(self):
+        """Helper method to let a shared repository catch up with the
+        writes of other processes, under the write lock as it changes
+        the objects every reader walks"""
+        shared = getattr(self.repo, "shared", None)
+
+        if shared is None or not shared.changed():
+            return
+
+        with self.lock.write():
+            self.repo.sync()
+            self.__snapshots.clear()
+
+    def _changed(self, *models: str):
+        """Helper method to invalidate the snapshots of the given models,
+        called while holding the write lock"""
+        for model in models:
+            self.__versions[model] = self.__versions.get(model, 0) + 1
+
+    @staticmethod
+    def _model(obj) -> str:
+        """Helper method to get the model name of an object"""
+        return obj.__class__.__name__.lower()
+
+    def get_all(self, model_name: str) -> list:
+        """Get all objects of a model from its snapshot"""
+        snapshot = self._snapshot(model_name)
+
+        if snapshot is None:
+            with self.lock.read():
+                # No writer runs now, so the version can't move
+                version = self.__versions.get(model_name, 0)
+                objects = self.repo.get_all(model_name)
+                snapshot = {obj.id: obj for obj in objects}
+                self.__snapshots[model_name] = (version, snapshot)
+
+        return list(snapshot.values())
+
+    def get(self, model_name: str, obj_id: str):
+        """Get an object by its ID"""
+        snapshot = self._snapshot(model_name)
+
+        if snapshot is not None:
+            return snapshot.get(obj_id)
+
+        with self.lock.read():
+            return self.repo.get(model_name, obj_id)
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values"""
+        self._catch_up()
+
+        with self.lock.read():
+            return self.repo.find_by(model_name, **field_equals)
+
+    def search(self, model_name: str, query: str) -> list:
+        """Get the objects of a model matching a full-text query"""
+        self._catch_up()
+
+        with self.lock.read():
+            return self.repo.search(model_name, query)
+
+    def reload(self) -> None:
+        """Reloads the wrapped repository"""
+        with self.lock.write():
+            self.repo.reload()
+            self.__snapshots.clear()
+
+    def sync(self) -> None:
+        """Catches up with the writes of other processes"""
+        self._catch_up()
+
+    def save(self, obj, *args, **kwargs):
+        """Save an object"""
+        with self.lock.write():
+            result = self.repo.save(obj, *args, **kwargs)
+            self._changed(self._model(obj))
+
+        return result
+
+    def update(self, obj):
+        """Update an object"""
+        with self.lock.write():
+            result = self.repo.update(obj)
+
+            # Unknown objects aren't updated
+            if result is not None:
+                self._changed(self._model(obj))
+
+        return result
+
+    def delete(self, obj) -> bool:
+        """Delete an object"""
+        with self.lock.write():
+            result = self.repo.delete(obj)
+
+            if result:
+                self._changed(self._model(obj))
+
+        return result
+
+    def save_many(self, objs: list) -> None:
+        """Save many objects at once"""
+        with self.lock.write():
+            self.repo.save_many(objs)
+            self._changed(*{self._model(obj) for obj in objs})
+
+    def update_many(self, objs: list) -> list:
+        """Update many objects at once, returns the ones that existed"""
+        with self.lock.write():
+            updated = self.repo.update_many(objs)
+            self._changed(*{self._model(obj) for obj in updated})
+
+        return updated
+
+    def delete_many(self, objs: list) -> int:
+        """Delete many objects at once, returns how many existed"""
+        with self.lock.write():
+            deleted = self.repo.delete_many(objs)
+
+            if deleted:
+                self._changed(*{self._model(obj) for obj in objs})
+
+        return deleted
+
+    @contextmanager
+    def batch(self):
+        """Holds the write lock for the whole block, so other threads
+        never see half of it, and groups its writes"""
+        with self.lock.write(), self.repo.batch():
+            yield
+
+    def flush(self) -> None:
+        """Writes the mutations the wrapped repository is still holding"""
+        with self.lock.write():
+            self.repo.flush()
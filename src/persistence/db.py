@@ -1,44 +1,328 @@
 """
-  Now is easy to implement the database repository. The DBRepository
-  should implement the Repository (Storage) interface and the methods defined
-  in the abstract class Storage.
-
-  The methods to implement are:
-    - get_all
-    - get
-    - save
-    - update
-    - delete
-    - reload (which can be empty)
+This module exports a Repository that persists data in a SQLite database
+using the standard library `sqlite3` module
+
+Every model gets its own table, built from the columns the model declares
+for SQLAlchemy. The database runs in WAL mode so readers don't block the
+writer, and every thread gets its own connection, which keeps the
+repository safe under threaded gunicorn workers. Only the thread local
+of its thread holds a connection, so it is closed when the thread ends.
+The SQL of every
+statement is built once per table, so sqlite3's per connection statement
+cache always hits and statements are only prepared once.
 """
 
+from datetime import datetime
+import os
+import sqlite3
+import threading
+import weakref
+from src.models import MODELS
 from src.models.base import Base
+from src.persistence.indexes import INDEXES
 from src.persistence.repository import Repository
+from utils.constants import DB_STORAGE_FILENAME
+
+SQLITE_TYPES = {
+    bool: "INTEGER",
+    int: "INTEGER",
+    float: "REAL",
+    str: "TEXT",
+    datetime: "TEXT",
+}
+
+
+class Table:
+    """The table of a model and the SQL statements to handle it"""
+
+    def __init__(self, name: str, model: type) -> None:
+        """Builds the statements from the model columns"""
+        self.name = name
+        self.model = model
+        self.columns: dict[str, type] = {
+            column.name: column.type.python_type
+            for column in model.__table__.columns
+        }
+
+        names = ", ".join(self.columns)
+        params = ", ".join(f":{column}" for column in self.columns)
+        assignments = ", ".join(
+            f"{column} = :{column}" for column in self.columns
+            if column != "id"
+        )
+
+        definitions = ", ".join(
+            f"{column} {SQLITE_TYPES.get(kind, 'TEXT')}"
+            + (" PRIMARY KEY" if column == "id" else "")
+            for column, kind in self.columns.items()
+        )
+        self.create = f"CREATE TABLE IF NOT EXISTS {name} ({definitions})"
+        self.create_indexes = [
+            f"CREATE INDEX IF NOT EXISTS ix_{name}_{column} "
+            f"ON {name} ({column})"
+            for column in INDEXES.get(name, ())
+        ]
+        self.names = names
+
+        self.select_all = f"SELECT {names} FROM {name} ORDER BY rowid"
+        self.select = f"SELECT {names} FROM {name} WHERE id = ?"
+        self.insert = (
+            f"INSERT INTO {name} ({names}) VALUES ({params}) "
+            f"ON CONFLICT(id) DO UPDATE SET {assignments}"
+        )
+        self.update = f"UPDATE {name} SET {assignments} WHERE id = :id"
+        self.delete = f"DELETE FROM {name} WHERE id = ?"
+        self.count = f"SELECT COUNT(*) FROM {name}"
+        self.__find_by: dict[tuple[str, ...], str] = {}
+
+    def find_by(self, fields: tuple[str, ...]) -> str:
+        """Returns the statement filtering by the given fields, built once
+        for every combination so it is only prepared once"""
+        if fields not in self.__find_by:
+            conditions = " AND ".join(f"{field} = ?" for field in fields)
+            self.__find_by[fields] = (
+                f"SELECT {self.names} FROM {self.name} "
+                f"WHERE {conditions} ORDER BY rowid"
+            )
+
+        return self.__find_by[fields]
+
+    def to_row(self, obj: Base) -> dict:
+        """Returns the statement parameters for an object"""
+        row = {}
+
+        for column, kind in self.columns.items():
+            value = getattr(obj, column, None)
+
+            if kind is datetime and value is not None:
+                value = value.isoformat()
+
+            row[column] = value
+
+        return row
+
+    def from_row(self, row: tuple) -> Base:
+        """Builds an object from a selected row"""
+        data = {}
+
+        for (column, kind), value in zip(self.columns.items(), row):
+            if value is not None:
+                if kind is datetime:
+                    value = datetime.fromisoformat(value)
+                elif kind is bool:
+                    value = bool(value)
+
+            data[column] = value
+
+        return self.model(**data)
+
+
+class ThreadConnection:
+    """The connection of a thread, closed when the last reference to it
+    goes away: the thread local of its thread, when the thread ends.
+    sqlite3 connections can't be referenced weakly and are only freed by
+    the garbage collector, hence this wrapper"""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        """Wraps a connection opened by the current process"""
+        self.connection = connection
+        self.pid = os.getpid()
+
+    def close(self) -> None:
+        """Closes the connection, unless it was inherited from the parent
+        of a forked process: closing it there could remove the WAL the
+        parent still uses"""
+        if self.pid == os.getpid():
+            self.connection.close()
+
+    def __del__(self) -> None:
+        """Closes the connection when its thread ends"""
+        self.close()
 
 
 class DBRepository(Repository):
-    """Dummy DB repository"""
+    """SQLite Repository"""
+
+    def __init__(self, filename: str = DB_STORAGE_FILENAME) -> None:
+        """Calls reload method"""
+        self.filename = filename
+        self.tables = {
+            name: Table(name, model) for name, model in MODELS.items()
+        }
+
+        self.__local = threading.local()
+        # The connections of the threads that are still alive
+        self.__connections: weakref.WeakSet[ThreadConnection] = (
+            weakref.WeakSet()
+        )
+        self.__lock = threading.Lock()
+
+        self.reload()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the current thread, opened on first use"""
+        local = self.__local
+
+        current = getattr(local, "current", None)
+
+        # A forked worker must not share the connections of its parent
+        if current is None or current.pid != os.getpid():
+            # Only this thread uses the connection, close() is the
+            # exception, hence check_same_thread=False
+            connection = sqlite3.connect(
+                self.filename,
+                timeout=30,
+                cached_statements=256,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+
+            current = local.current = ThreadConnection(connection)
+
+            with self.__lock:
+                self.__connections.add(current)
+
+        return current.connection
 
-    def __init__(self) -> None:
-        """Initialize database"""
-        super().__init__()
+    def close(self) -> None:
+        """Closes the connection of every thread"""
+        with self.__lock:
+            for current in list(self.__connections):
+                current.close()
+
+            self.__connections.clear()
+
+        self.__local = threading.local()
 
     def get_all(self, model_name: str) -> list:
-        """Not implemented"""
-        return []
+        """Get all objects of a model, in insertion order"""
+        table = self.tables.get(model_name)
+
+        if not table:
+            return []
+
+        rows = self.connection.execute(table.select_all).fetchall()
+
+        return [table.from_row(row) for row in rows]
 
     def get(self, model_name: str, obj_id: str) -> Base | None:
-        """Not implemented"""
+        """Get an object by its ID"""
+        table = self.tables.get(model_name)
+
+        if not table:
+            return None
+
+        row = self.connection.execute(table.select, (obj_id,)).fetchone()
+
+        return table.from_row(row) if row else None
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values"""
+        table = self.tables.get(model_name)
+
+        # Unknown fields never match, like in the other repositories
+        if not table or any(f not in table.columns for f in field_equals):
+            return []
+
+        if not field_equals:
+            return self.get_all(model_name)
+
+        fields = tuple(field_equals)
+        rows = self.connection.execute(
+            table.find_by(fields), tuple(field_equals.values())
+        ).fetchall()
+
+        return [table.from_row(row) for row in rows]
 
     def reload(self) -> None:
-        """Not implemented"""
+        """Creates the missing tables and the dummy country"""
+        with self.connection as connection:
+            for table in self.tables.values():
+                connection.execute(table.create)
+
+                for statement in table.create_indexes:
+                    connection.execute(statement)
+
+        count = self.connection.execute(self.tables["country"].count)
+
+        if not count.fetchone()[0]:
+            from src.models.country import Country
+
+            self.save(Country("Uruguay", "UY"))
 
     def save(self, obj: Base) -> None:
-        """Not implemented"""
+        """Save an object"""
+        table = self.tables[obj.__class__.__name__.lower()]
+
+        with self.connection as connection:
+            connection.execute(table.insert, table.to_row(obj))
+
+    def save_many(self, objs: list) -> None:
+        """Save many objects in a single transaction"""
+        with self.connection as connection:
+            for model, group in self._group(objs).items():
+                table = self.tables[model]
+                connection.executemany(
+                    table.insert, [table.to_row(obj) for obj in group]
+                )
+
+    def update_many(self, objs: list) -> list:
+        """Update many objects in a single transaction, returns the ones
+        that existed"""
+        updated = []
+
+        with self.connection as connection:
+            for obj in objs:
+                table = self.tables[obj.__class__.__name__.lower()]
+                obj.updated_at = datetime.now()
+                cursor = connection.execute(table.update, table.to_row(obj))
+
+                if cursor.rowcount:
+                    updated.append(obj)
+
+        return updated
+
+    def delete_many(self, objs: list) -> int:
+        """Delete many objects in a single transaction, returns how many
+        existed"""
+        deleted = 0
+
+        with self.connection as connection:
+            for model, group in self._group(objs).items():
+                cursor = connection.executemany(
+                    self.tables[model].delete, [(obj.id,) for obj in group]
+                )
+                deleted += cursor.rowcount
+
+        return deleted
+
+    @staticmethod
+    def _group(objs: list) -> dict[str, list]:
+        """Helper method to group objects by model"""
+        groups: dict[str, list] = {}
+
+        for obj in objs:
+            groups.setdefault(obj.__class__.__name__.lower(), []).append(obj)
+
+        return groups
 
     def update(self, obj: Base) -> Base | None:
-        """Not implemented"""
+        """Update an object"""
+        table = self.tables[obj.__class__.__name__.lower()]
+        obj.updated_at = datetime.now()
+
+        with self.connection as connection:
+            cursor = connection.execute(table.update, table.to_row(obj))
+
+        return obj if cursor.rowcount else None
 
     def delete(self, obj: Base) -> bool:
-        """Not implemented"""
-        return False
+        """Delete an object"""
+        table = self.tables[obj.__class__.__name__.lower()]
+
+        with self.connection as connection:
+            cursor = connection.execute(table.delete, (obj.id,))
+
+        return cursor.rowcount > 0
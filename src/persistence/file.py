@@ -1,132 +1,480 @@
 """
 This module exports a Repository that persists data in a JSON file
+
+By default every mutation rewrites the whole JSON file. In journaled mode
+mutations are appended to a JSON-lines log instead, and the log is
+compacted into the JSON file once it grows past a threshold.
+
+When those writes happen is decided by the flush policy, see
+src/persistence/flusher.py
+
+Reloading streams the JSON file record by record and keeps the JSON text
+of every record until it is first accessed, only then it is decoded and
+the model instance is built, so startup cost depends on what is used and
+not on file size: the file has a record per line, and only the id of a
+record is read to load it (see src/persistence/streaming.py). The indexes
+of a model are built by its first find_by or search. Records that were
+never accessed are written back without re-encoding.
+
+Every access to the data holds the lock of the flusher: reads may catch
+up or build instances, which change it, and the batched flusher reads it
+from its own thread.
+
+In shared mode several processes use the same files, see
+src/persistence/shared.py. Writes hold the shared lock, and a process
+that notices another one wrote catches up before reading or writing: it
+only replays the new journal entries when the JSON file is the same one
+it loaded, and reloads it otherwise. The mutations it didn't write yet
+are applied again on top.
 """
 
+from contextlib import contextmanager
 from datetime import datetime
 import json
+import os
+from src.models import MODELS
 from src.models.base import Base
-from src.persistence.repository import Repository
-from utils.constants import FILE_STORAGE_FILENAME
+from src.persistence.flusher import WriteBehind
+from src.persistence.indexes import SecondaryIndexes
+from src.persistence.repository import Repository, matches
+from src.persistence.shared import SharedState
+from src.persistence.streaming import iter_record_texts, write_records
+from utils.constants import (
+    FILE_STORAGE_COMPACT_THRESHOLD,
+    FILE_STORAGE_FILENAME,
+    FILE_STORAGE_JOURNAL_FILENAME,
+    SHARED_GENERATION_FILENAME,
+    SHARED_LOCK_FILENAME,
+)
+from utils.text import parse_query
 
 
 class FileRepository(Repository):
     """File Repository"""
 
     __filename = FILE_STORAGE_FILENAME
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __journal_filename = FILE_STORAGE_JOURNAL_FILENAME
+    # Values are model instances, or the JSON text (from the file) or the
+    # dict (from the journal) of records that weren't accessed yet
+    __data: dict[str, dict[str, Base | str | dict]] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
+    __indexes = SecondaryIndexes()
+    # Models whose indexes weren't built since the file was loaded
+    __unindexed: set[str] = set()
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        journaled: bool = False,
+        compact_threshold: int = FILE_STORAGE_COMPACT_THRESHOLD,
+        flush_policy: str = "sync",
+        flush_interval_ms: int = 500,
+        flush_max_pending: int = 100,
+        shared: bool = False,
+    ) -> None:
         """Calls reload method"""
+        self.journaled = journaled
+        self.compact_threshold = compact_threshold
+        self.__journal_size = 0
+        # Byte offset of the journal up to which it was applied
+        self.__journal_offset = 0
+        # Identifies the version of the JSON file that was loaded
+        self.__snapshot: tuple | None = None
+        self.__unwritten: list[dict] = []
+        self.flusher = WriteBehind(
+            self._write,
+            policy=flush_policy,
+            interval_ms=flush_interval_ms,
+            max_pending=flush_max_pending,
+        )
+        self.shared = (
+            SharedState(SHARED_LOCK_FILENAME, SHARED_GENERATION_FILENAME)
+            if shared else None
+        )
         self.reload()
 
+    def _stat_snapshot(self) -> tuple | None:
+        """Helper method to get what identifies a JSON file version"""
+        try:
+            stat = os.stat(self.__filename)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns
+
+    @contextmanager
+    def _locked(self):
+        """Helper method to hold the locks that protect the files, the
+        shared lock is only taken in shared mode"""
+        with self.flusher.lock:
+            if not self.shared:
+                yield
+                return
+
+            with self.shared.locked():
+                yield
+
+    def sync(self):
+        """Catches up with the writes of other processes in shared mode,
+        it only costs a stat when there were none"""
+        if not self.shared or not self.shared.changed():
+            return
+
+        with self._locked():
+            if not self.shared.changed():
+                return
+
+            if self._stat_snapshot() != self.__snapshot:
+                self._load()
+            else:
+                self._replay_journal()
+
+            for entry in self.__unwritten:
+                self._apply(entry)
+
+            self.shared.mark_seen()
+
+    def _written(self):
+        """Helper method to tell the other processes that files changed"""
+        if self.shared:
+            self.shared.bump()
+
     def _save_to_file(self):
         """Helper method to save the current object data to the file"""
-        serialized = {
-            k: [v.to_dict() for v in l if type(v) is not dict]
-            for k, l in self.__data.items()
-        }
+        # The JSON text of every object is taken under the lock every
+        # mutation holds, so the file is a consistent snapshot
+        with self.flusher.lock:
+            snapshot = [
+                (model, [self._dumps(obj) for obj in objects.values()])
+                for model, objects in self.__data.items()
+            ]
+
+        # Write to a temporary file first so a crash never leaves a
+        # half written snapshot behind
+        tmp_filename = f"{self.__filename}.tmp"
+        with open(tmp_filename, "w") as file:
+            write_records(file, snapshot)
+        os.replace(tmp_filename, self.__filename)
+
+        # Every mutation is in the snapshot now
+        self.__unwritten.clear()
+        self.__snapshot = self._stat_snapshot()
+
+    @staticmethod
+    def _dumps(obj: Base | str | dict) -> str:
+        """Helper method to get the JSON text of a stored object"""
+        if type(obj) is str:
+            return obj
+        if type(obj) is dict:
+            return json.dumps(obj)
+
+        return json.dumps(obj.to_dict())
+
+    def _append_to_journal(self):
+        """Helper method to log the unwritten mutations to the journal"""
+        with open(self.__journal_filename, "ab") as file:
+            file.writelines(
+                json.dumps(entry).encode() + b"\n"
+                for entry in self.__unwritten
+            )
+            self.__journal_offset = file.tell()
 
-        with open(self.__filename, "w") as file:
-            json.dump(serialized, file)
+        self.__journal_size += len(self.__unwritten)
+        self.__unwritten.clear()
+
+        if self.__journal_size >= self.compact_threshold:
+            self.compact()
+
+    def _write(self):
+        """Helper method to write the pending mutations with the current
+        mode, called by the flusher"""
+        with self._locked():
+            # Never write over what other processes wrote
+            self.sync()
+
+            if self.journaled:
+                self._append_to_journal()
+            else:
+                self._save_to_file()
+
+            self._written()
+
+    def _persist(self, op: str, obj: Base):
+        """Helper method to record a mutation for the flusher"""
+        with self.flusher.lock:
+            # In shared mode the entries are applied again after catching
+            # up, until they are written
+            if self.journaled or self.shared:
+                entry = {"op": op, "model": obj.__class__.__name__.lower()}
+
+                if op == "delete":
+                    entry["id"] = obj.id
+                else:
+                    entry["data"] = obj.to_dict()
+
+                self.__unwritten.append(entry)
+
+            self.flusher.mark_dirty()
+
+    def flush(self):
+        """Writes the mutations the flush policy is still holding"""
+        self.flusher.flush()
+
+    def batch(self):
+        """Writes the mutations made inside the block at once"""
+        return self.flusher.deferred()
+
+    def compact(self):
+        """Folds the journal into the JSON file and empties the journal"""
+        with self._locked():
+            self.sync()
+            self._save_to_file()
+
+            with open(self.__journal_filename, "w"):
+                pass
+
+            self.__journal_size = 0
+            self.__journal_offset = 0
+            self._written()
 
     def get_all(self, model_name: str):
         """Get all objects of a given model"""
-        return self.__data.get(model_name, [])
+        with self.flusher.lock:
+            self.sync()
+
+            return [
+                self._materialize(model_name, obj)
+                for obj in list(self.__data.get(model_name, {}).values())
+            ]
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.get_all(model_name):
-            if obj.id == obj_id:
-                return obj
-        return None
+        with self.flusher.lock:
+            self.sync()
+
+            obj = self.__data.get(model_name, {}).get(obj_id)
+
+            if obj is None:
+                return None
+
+            return self._materialize(model_name, obj)
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values"""
+        with self.flusher.lock:
+            self.sync()
+
+            ids = self._indexes(model_name).lookup(
+                model_name, **field_equals
+            )
+
+            if ids is None:
+                return super().find_by(model_name, **field_equals)
+
+            objects = [self.get(model_name, obj_id) for obj_id in ids]
+
+            return [obj for obj in objects if matches(obj, field_equals)]
+
+    def search(self, model_name: str, query: str) -> list:
+        """Get the objects of a model matching a full-text query, best
+        first, from the inverted index"""
+        with self.flusher.lock:
+            self.sync()
+
+            ids = self._indexes(model_name).text.search(
+                model_name, parse_query(query)
+            )
+
+            return [self.get(model_name, obj_id) for obj_id, _ in ids]
+
+    def _indexes(self, model: str) -> SecondaryIndexes:
+        """Helper method to get the indexes, after indexing the records of
+        the model if they weren't since the file was loaded"""
+        if model in self.__unindexed:
+            self.__unindexed.discard(model)
+
+            for obj_id, obj in self.__data.get(model, {}).items():
+                record = json.loads(obj) if type(obj) is str else obj
+                self.__indexes.add(model, obj_id, record)
+
+        return self.__indexes
+
+    def _index(self, model: str, obj_id: str, record: Base | dict):
+        """Helper method to index an object, unless the indexes of its
+        model are still to be built"""
+        if model not in self.__unindexed:
+            self.__indexes.add(model, obj_id, record)
+
+    def _unindex(self, model: str, obj_id: str):
+        """Helper method to remove an object from the indexes, unless the
+        indexes of its model are still to be built"""
+        if model not in self.__unindexed:
+            self.__indexes.remove(model, obj_id)
+
+    def _materialize(self, model: str, obj: Base | str | dict) -> Base:
+        """Replaces a record that wasn't accessed yet by its instance"""
+        if type(obj) is str:
+            obj = json.loads(obj)
+        elif type(obj) is not dict:
+            return obj
+
+        instance = self._from_dict(model, obj)
+        self.__data[model][instance.id] = instance
+
+        return instance
+
+    def _from_dict(self, model: str, item: dict) -> Base:
+        """Builds a model instance from its dictionary representation"""
+        instance: Base = MODELS[model](**item)
+
+        if "created_at" in item:
+            instance.created_at = datetime.fromisoformat(item["created_at"])
+        if "updated_at" in item:
+            instance.updated_at = datetime.fromisoformat(item["updated_at"])
+
+        return instance
+
+    def _apply(self, entry: dict):
+        """Helper method to apply a journal entry to the loaded data"""
+        model = entry["model"]
+
+        if entry["op"] == "delete":
+            self.__data.get(model, {}).pop(entry["id"], None)
+            self._unindex(model, entry["id"])
+        else:
+            item = entry["data"]
+            self.__data.setdefault(model, {})[item["id"]] = item
+            self._index(model, item["id"], item)
+
+    def _replay_journal(self):
+        """Applies the journal entries that weren't applied yet on top of
+        the loaded snapshot"""
+        try:
+            file = open(self.__journal_filename, "r+b")
+        except FileNotFoundError:
+            return
+
+        with file:
+            file.seek(self.__journal_offset)
+
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash in the middle of an append leaves a partial
+                    # line at the end of the journal, that never happened.
+                    # It is cut off so the next append starts a new line
+                    file.truncate(self.__journal_offset)
+                    break
+
+                self._apply(entry)
+                self.__journal_size += 1
+                self.__journal_offset += len(line)
+
+    def _load(self) -> bool:
+        """Helper method to load the JSON file and replay the journal,
+        returns whether the JSON file existed"""
+        for objects in self.__data.values():
+            objects.clear()
+        self.__indexes.clear()
+        self.__unindexed.clear()
+
+        self.__snapshot = self._stat_snapshot()
+        self.__journal_size = 0
+        self.__journal_offset = 0
 
-    def reload(self):
-        """Reloads the data from the file"""
-        file_data = {}
         try:
             with open(self.__filename, "r") as file:
-                file_data = json.load(file)
+                for model, obj_id, text in iter_record_texts(file):
+                    self.__data.setdefault(model, {})[obj_id] = text
+                    self.__unindexed.add(model)
         except FileNotFoundError:
-            from src.models.country import Country
+            self._replay_journal()
+            return False
 
-            self.__data["country"] = [Country("Uruguay", "UY")]
+        self._replay_journal()
+        return True
 
-            self._save_to_file()
+    def reload(self):
+        """Reloads the data from the file and replays the journal"""
+        # Don't lose what the flush policy is still holding
+        self.flusher.flush()
 
-        from src.models.amenity import Amenity, PlaceAmenity
-        from src.models.city import City
-        from src.models.country import Country
-        from src.models.place import Place
-        from src.models.review import Review
-        from src.models.user import User
-
-        models = {
-            "amenity": Amenity,
-            "city": City,
-            "country": Country,
-            "place": Place,
-            "placeamenity": PlaceAmenity,
-            "review": Review,
-            "user": User,
-        }
-
-        for model, data in file_data.items():
-            for item in data:
-                instance: Base = models[model](**item)
-
-                if "created_at" in item:
-                    instance.created_at = datetime.fromisoformat(
-                        item["created_at"]
-                    )
-                if "updated_at" in item:
-                    instance.updated_at = datetime.fromisoformat(
-                        item["updated_at"]
-                    )
-
-                self.save(data=instance, save_to_file=False)
+        with self._locked():
+            if not self._load():
+                from src.models.country import Country
+
+                country = Country("Uruguay", "UY")
+                self.__data["country"][country.id] = country
+
+                self._save_to_file()
+                self._written()
+
+            if self.shared:
+                self.shared.mark_seen()
+
+            # Without journaling the snapshot is rewritten on every
+            # mutation, so a leftover journal has to be folded in before
+            # it goes stale
+            if self.__journal_size and (
+                not self.journaled
+                or self.__journal_size >= self.compact_threshold
+            ):
+                self.compact()
 
     def save(self, data: Base, save_to_file=True):
         """Save an object to the repository"""
         model: str = data.__class__.__name__.lower()
 
-        if model not in self.__data:
-            self.__data[model] = []
+        with self.flusher.lock:
+            # Never write from a stale copy of what other processes wrote
+            self.sync()
 
-        self.__data[model].append(data)
+            if model not in self.__data:
+                self.__data[model] = {}
 
-        if save_to_file:
-            self._save_to_file()
+            self.__data[model][data.id] = data
+            self._index(model, data.id, data)
+
+            if save_to_file:
+                self._persist("save", data)
 
     def update(self, obj: Base):
         """Update an object in the repository"""
         cls = obj.__class__.__name__.lower()
 
-        for i, o in enumerate(self.__data[cls]):
-            if o.id == obj.id:
-                obj.updated_at = datetime.now()
-                self.__data[cls][i] = obj
-                self._save_to_file()
-                return obj
+        with self.flusher.lock:
+            self.sync()
+
+            if obj.id not in self.__data[cls]:
+                return None
+
+            obj.updated_at = datetime.now()
+            self.__data[cls][obj.id] = obj
+            self._index(cls, obj.id, obj)
+            self._persist("update", obj)
 
-        return None
+        return obj
 
     def delete(self, obj: Base):
         """Delete an object from the repository"""
         class_name = obj.__class__.__name__.lower()
 
-        if obj not in self.__data[class_name]:
-            return False
+        with self.flusher.lock:
+            self.sync()
+
+            if obj.id not in self.__data[class_name]:
+                return False
 
-        self.__data[class_name].remove(obj)
+            del self.__data[class_name][obj.id]
+            self._unindex(class_name, obj.id)
 
-        self._save_to_file()
+            self._persist("delete", obj)
 
         return True
@@ -0,0 +1,120 @@
+"""
+This module exports the WriteBehind helper used by the repositories that
+persist data in files, it decides when pending mutations hit the disk
+
+The available policies are:
+
+- sync: every mutation is written right away (the default)
+- batched: mutations only mark the store dirty, a background thread
+  coalesces them into one write every `interval_ms` milliseconds or as
+  soon as `max_pending` mutations are waiting
+- on-shutdown: mutations are only written by `flush` or at exit
+"""
+
+import atexit
+from contextlib import contextmanager
+import threading
+from typing import Callable
+
+FLUSH_POLICIES = ("sync", "batched", "on-shutdown")
+
+
+class WriteBehind:
+    """Coalesces the mutations of a repository into as few writes as
+    possible, according to the selected policy"""
+
+    def __init__(
+        self,
+        write: Callable[[], None],
+        policy: str = "sync",
+        interval_ms: int = 500,
+        max_pending: int = 100,
+    ) -> None:
+        """Starts the background flusher when the policy needs it"""
+        if policy not in FLUSH_POLICIES:
+            raise ValueError(
+                f"Unknown flush policy {policy}, "
+                f"expected one of {', '.join(FLUSH_POLICIES)}"
+            )
+
+        self.write = write
+        self.policy = policy
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+
+        # Held by the repository while it touches what `write` reads
+        self.lock = threading.RLock()
+
+        self.__pending = 0
+        self.__deferred = 0
+        self.__closed = False
+        self.__wakeup = threading.Condition(self.lock)
+        self.__thread: threading.Thread | None = None
+
+        if policy == "batched":
+            self.__thread = threading.Thread(
+                target=self.__run, name="write-behind", daemon=True
+            )
+            self.__thread.start()
+
+        if policy != "sync":
+            atexit.register(self.close)
+
+    @property
+    def pending(self) -> int:
+        """Amount of mutations that weren't written yet"""
+        return self.__pending
+
+    def mark_dirty(self) -> None:
+        """Records a mutation, writing it when the policy says so"""
+        with self.lock:
+            self.__pending += 1
+
+            if self.policy == "sync" and not self.__deferred:
+                self.flush()
+            elif (
+                self.policy == "batched"
+                and self.__pending >= self.max_pending
+            ):
+                self.__wakeup.notify()
+
+    def flush(self) -> None:
+        """Writes every pending mutation now"""
+        with self.lock:
+            if not self.__pending:
+                return
+
+            self.write()
+            self.__pending = 0
+
+    @contextmanager
+    def deferred(self):
+        """Holds the writes of the sync policy until the block ends, so a
+        batch of mutations is written at once. Other threads wait for the
+        block to end before they can mark the store dirty"""
+        with self.lock:
+            self.__deferred += 1
+            try:
+                yield
+            finally:
+                self.__deferred -= 1
+
+                if self.policy == "sync" and not self.__deferred:
+                    self.flush()
+
+    def close(self) -> None:
+        """Flushes the pending mutations and stops the background flusher"""
+        with self.lock:
+            self.__closed = True
+            self.__wakeup.notify()
+            self.flush()
+
+        if self.__thread and self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def __run(self) -> None:
+        """Background loop of the batched policy"""
+        with self.lock:
+            while not self.__closed:
+                self.__wakeup.wait(self.interval)
+                self.flush()
@@ -0,0 +1,122 @@
+"""
+This module exports the secondary indexes the repositories maintain, so
+find_by can answer equality queries on the declared fields without
+scanning the whole model, along with the inverted index of their text
+fields (see utils/text.py) that answers full-text searches
+"""
+
+from typing import Any
+from src.models.place import Place
+from src.models.review import Review
+from utils.text import TextIndex
+
+# Fields of every model that are looked up by value
+INDEXES: dict[str, tuple[str, ...]] = {
+    "review": ("place_id", "user_id"),
+    "city": ("country_code",),
+    "place": ("city_id", "host_id"),
+    "placeamenity": ("place_id",),
+}
+
+# Text fields of the models that are searched, with the weight of a
+# match in each of them (the same as the FTS5 index of src/models/search.py)
+TEXT_INDEXES: dict[str, dict[str, float]] = {
+    "place": Place.text_fields,
+    "review": Review.text_fields,
+}
+
+
+class SecondaryIndexes:
+    """In-memory indexes from field values to object ids, used by the
+    repositories that keep their objects in memory"""
+
+    def __init__(self, declared: dict[str, tuple[str, ...]] = INDEXES):
+        """Starts with empty indexes for the declared fields"""
+        self.declared = declared
+        self.text = TextIndex(TEXT_INDEXES)
+
+        # model -> field -> value -> ids (a dict is used as ordered set)
+        self.__index: dict[str, dict[str, dict[Any, dict[str, None]]]] = {
+            model: {field: {} for field in fields}
+            for model, fields in declared.items()
+        }
+        # model -> id -> indexed values, to unindex objects that were
+        # changed in place before being updated
+        self.__values: dict[str, dict[str, tuple]] = {
+            model: {} for model in declared
+        }
+
+    def add(self, model: str, obj_id: str, record: Any) -> None:
+        """Indexes an object, or the dict of a record, replacing the
+        entries of a previous version"""
+        self.remove(model, obj_id)
+        self.text.add(model, obj_id, record)
+        fields = self.declared.get(model)
+
+        if not fields:
+            return
+
+        if isinstance(record, dict):
+            values = tuple(record.get(field) for field in fields)
+        else:
+            values = tuple(getattr(record, field, None) for field in fields)
+
+        for field, value in zip(fields, values):
+            self.__index[model][field].setdefault(value, {})[obj_id] = None
+
+        self.__values[model][obj_id] = values
+
+    def remove(self, model: str, obj_id: str) -> None:
+        """Removes an object from the indexes"""
+        self.text.remove(model, obj_id)
+        fields = self.declared.get(model)
+
+        if not fields:
+            return
+
+        values = self.__values[model].pop(obj_id, None)
+
+        if values is None:
+            return
+
+        for field, value in zip(fields, values):
+            ids = self.__index[model][field][value]
+            del ids[obj_id]
+
+            if not ids:
+                del self.__index[model][field][value]
+
+    def clear(self, model: str | None = None) -> None:
+        """Empties the indexes of a model, or every index"""
+        self.text.clear(model)
+
+        for name, fields in self.__index.items():
+            if model is not None and name != model:
+                continue
+
+            for field in fields.values():
+                field.clear()
+
+            self.__values[name].clear()
+
+    def lookup(self, model: str, **field_equals) -> list[str] | None:
+        """Returns the ids of the objects matching the indexed fields in
+        order, or None when none of the fields is indexed. The remaining
+        fields still have to be checked by the caller"""
+        fields = self.__index.get(model, {})
+        buckets = [
+            fields[field].get(value, {})
+            for field, value in field_equals.items()
+            if field in fields
+        ]
+
+        if not buckets:
+            return None
+
+        # Walk the smallest bucket and probe the others
+        buckets.sort(key=len)
+
+        return [
+            obj_id for obj_id in buckets[0]
+            if all(obj_id in ids for ids in buckets[1:])
+        ]
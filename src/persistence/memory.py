@@ -5,8 +5,10 @@ it only stores it in memory
 
 from datetime import datetime
 from src.models.base import Base
-from src.persistence.repository import Repository
+from src.persistence.indexes import SecondaryIndexes
+from src.persistence.repository import Repository, matches
 from utils.populate import populate_db
+from utils.text import parse_query
 
 
 class MemoryRepository(Repository):
@@ -16,32 +18,55 @@ class MemoryRepository(Repository):
 
 
     Every time the server is restarted, the data is lost
+
+    Objects are indexed by id inside each model, so get, update and
+    delete don't depend on the amount of stored objects
     """
 
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __data: dict[str, dict[str, Base]] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
+    __indexes = SecondaryIndexes()
 
     def __init__(self) -> None:
         """Calls reload method"""
         self.reload()
 
     def get_all(self, model_name: str) -> list:
-        """Get all objects of a given model"""
-        return self.__data.get(model_name, [])
+        """Get all objects of a given model, in insertion order"""
+        return list(self.__data.get(model_name, {}).values())
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.get_all(model_name):
-            if obj.id == obj_id:
-                return obj
-        return None
+        return self.__data.get(model_name, {}).get(obj_id)
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values"""
+        ids = self.__indexes.lookup(model_name, **field_equals)
+
+        if ids is None:
+            return super().find_by(model_name, **field_equals)
+
+        objects = self.__data[model_name]
+
+        return [
+            objects[obj_id] for obj_id in ids
+            if matches(objects[obj_id], field_equals)
+        ]
+
+    def search(self, model_name: str, query: str) -> list:
+        """Get the objects of a model matching a full-text query, best
+        first, from the inverted index"""
+        ids = self.__indexes.text.search(model_name, parse_query(query))
+        objects = self.__data[model_name]
+
+        return [objects[obj_id] for obj_id, _ in ids]
 
     def reload(self):
         """Populates the database with some dummy data"""
@@ -51,9 +76,9 @@ class MemoryRepository(Repository):
         """Save an object"""
         cls = obj.__class__.__name__.lower()
 
-        if obj not in self.__data[cls]:
-            # print(f"Saving {obj}, {cls}")
-            self.__data[cls].append(obj)
+        if obj.id not in self.__data[cls]:
+            self.__data[cls][obj.id] = obj
+            self.__indexes.add(cls, obj.id, obj)
 
         return obj
 
@@ -61,20 +86,23 @@ class MemoryRepository(Repository):
         """Update an object"""
         cls = obj.__class__.__name__.lower()
 
-        for i, o in enumerate(self.__data[cls]):
-            if o.id == obj.id:
-                obj.updated_at = datetime.now()
-                self.__data[cls][i] = obj
-                return obj
+        if obj.id not in self.__data[cls]:
+            return None
 
-        return None
+        obj.updated_at = datetime.now()
+        self.__data[cls][obj.id] = obj
+        self.__indexes.add(cls, obj.id, obj)
+
+        return obj
 
     def delete(self, obj: Base) -> bool:
         """Delete an object"""
         cls = obj.__class__.__name__.lower()
 
-        if obj in self.__data[cls]:
-            self.__data[cls].remove(obj)
-            return True
+        if obj.id not in self.__data[cls]:
+            return False
+
+        del self.__data[cls][obj.id]
+        self.__indexes.remove(cls, obj.id)
 
-        return False
+        return True
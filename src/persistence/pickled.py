@@ -1,77 +1,333 @@
 """
-This module exports a Repository that persists data in a pickle file
+This module exports a Repository that persists data in pickle files
+
+Every model is stored in its own pickle file (a shard) using protocol 5,
+and only the shards of the models that changed since the last write are
+pickled again. When they are written is decided by the flush policy, see
+src/persistence/flusher.py
+
+In shared mode several processes use the same shards, see
+src/persistence/shared.py. Writes hold the shared lock, and a process
+that notices another one wrote catches up before reading or writing by
+loading again only the shards that were replaced, and applying on top the
+changes it didn't write yet.
+
+Every access to the data holds the lock of the flusher: reads may catch
+up, which changes it, and the batched flusher reads it from its own
+thread.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
 import pickle
-from src.persistence.repository import Repository
-from utils.constants import PICKLE_STORAGE_FILENAME
+from src.persistence.flusher import WriteBehind
+from src.persistence.indexes import SecondaryIndexes
+from src.persistence.repository import Repository, matches
+from src.persistence.shared import SharedState
+from utils.constants import (
+    PICKLE_SHARD_FILENAME,
+    PICKLE_STORAGE_FILENAME,
+    SHARED_GENERATION_FILENAME,
+    SHARED_LOCK_FILENAME,
+)
+from utils.text import parse_query
+
+PICKLE_PROTOCOL = 5
 
 
 class PickleRepository(Repository):
     """Pickle Repository"""
 
+    # Single file used before the data was sharded, migrated on reload
     __filename = PICKLE_STORAGE_FILENAME
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __shard_filename = PICKLE_SHARD_FILENAME
+    __data: dict[str, dict] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        flush_policy: str = "sync",
+        flush_interval_ms: int = 500,
+        flush_max_pending: int = 100,
+        parallel_load: bool = False,
+        shared: bool = False,
+    ) -> None:
         """Calls reload method"""
+        self.parallel_load = parallel_load
+        self.__dirty: set[str] = set()
+        # model -> id -> object (None once deleted) not written yet, only
+        # kept in shared mode to apply them again after catching up
+        self.__changes: dict[str, dict] = {}
+        # model -> what identifies the version of the shard that was loaded
+        self.__shards: dict[str, tuple | None] = {}
+        self.flusher = WriteBehind(
+            self._save_to_file,
+            policy=flush_policy,
+            interval_ms=flush_interval_ms,
+            max_pending=flush_max_pending,
+        )
+        self.__indexes = SecondaryIndexes()
+        self.shared = (
+            SharedState(SHARED_LOCK_FILENAME, SHARED_GENERATION_FILENAME)
+            if shared else None
+        )
         self.reload()
 
+    def _shard(self, model: str) -> str:
+        """Helper method to get the filename of a model shard"""
+        return self.__shard_filename.format(model=model)
+
+    def _stat_shard(self, model: str) -> tuple | None:
+        """Helper method to get what identifies a shard version"""
+        try:
+            stat = os.stat(self._shard(model))
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns
+
+    @contextmanager
+    def _locked(self):
+        """Helper method to hold the locks that protect the shards, the
+        shared lock is only taken in shared mode"""
+        with self.flusher.lock:
+            if not self.shared:
+                yield
+                return
+
+            with self.shared.locked():
+                yield
+
+    def sync(self):
+        """Catches up with the writes of other processes in shared mode,
+        it only costs a stat when there were none"""
+        if not self.shared or not self.shared.changed():
+            return
+
+        with self._locked():
+            if not self.shared.changed():
+                return
+
+            for model in self.__data:
+                shard = self._stat_shard(model)
+
+                if shard == self.__shards.get(model):
+                    continue
+
+                objects = self._load_shard(model) or {}
+
+                for obj_id, obj in self.__changes.get(model, {}).items():
+                    if obj is None:
+                        objects.pop(obj_id, None)
+                    else:
+                        objects[obj_id] = obj
+
+                self.__data[model] = objects
+                self.__shards[model] = shard
+
+                self.__indexes.clear(model)
+                for obj_id, obj in objects.items():
+                    self.__indexes.add(model, obj_id, obj)
+
+            self.shared.mark_seen()
+
+    def _mark_dirty(self, model: str, obj_id: str, obj):
+        """Helper method to record that a model shard has to be written"""
+        with self.flusher.lock:
+            if self.shared:
+                self.__changes.setdefault(model, {})[obj_id] = obj
+
+            self.__dirty.add(model)
+            self.flusher.mark_dirty()
+
     def _save_to_file(self):
-        """Helper method to save the current object data to the file"""
-        with open(self.__filename, "wb") as file:
-            pickle.dump(self.__data, file)
+        """Helper method to write the shards of the changed models"""
+        with self._locked():
+            # Never write over what other processes wrote
+            self.sync()
+
+            written = bool(self.__dirty)
+
+            for model in list(self.__dirty):
+                # Every mutation holds the lock, the dict can't change
+                # while it's pickled
+                objects = self.__data[model]
+                filename = self._shard(model)
+
+                with open(f"{filename}.tmp", "wb") as file:
+                    pickle.dump(objects, file, protocol=PICKLE_PROTOCOL)
+                os.replace(f"{filename}.tmp", filename)
+
+                self.__dirty.discard(model)
+                self.__changes.pop(model, None)
+                self.__shards[model] = self._stat_shard(model)
+
+            if written and self.shared:
+                self.shared.bump()
+
+    def _load_shard(self, model: str) -> dict | None:
+        """Helper method to read a model shard, None if it doesn't exist"""
+        try:
+            with open(self._shard(model), "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def flush(self):
+        """Writes the mutations the flush policy is still holding"""
+        self.flusher.flush()
+
+    def batch(self):
+        """Writes the mutations made inside the block at once"""
+        return self.flusher.deferred()
 
     def get_all(self, model_name: str) -> list:
         """Get all objects of a given model"""
-        return self.__data[model_name]
+        with self.flusher.lock:
+            self.sync()
+
+            return list(self.__data[model_name].values())
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.__data[model_name]:
-            if obj.id == obj_id:
-                return obj
-        return None
+        with self.flusher.lock:
+            self.sync()
+
+            return self.__data[model_name].get(obj_id)
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values"""
+        with self.flusher.lock:
+            self.sync()
+
+            ids = self.__indexes.lookup(model_name, **field_equals)
+
+            if ids is None:
+                return super().find_by(model_name, **field_equals)
+
+            objects = self.__data[model_name]
+
+            return [
+                objects[obj_id] for obj_id in ids
+                if matches(objects[obj_id], field_equals)
+            ]
+
+    def search(self, model_name: str, query: str) -> list:
+        """Get the objects of a model matching a full-text query, best
+        first, from the inverted index"""
+        with self.flusher.lock:
+            self.sync()
+
+            ids = self.__indexes.text.search(model_name, parse_query(query))
+            objects = self.__data[model_name]
+
+            return [objects[obj_id] for obj_id, _ in ids]
 
     def reload(self):
-        """Reloads the data from the pickle file"""
-        try:
-            with open(self.__filename, "rb") as file:
-                self.__data = pickle.load(file)
-        except FileNotFoundError:
-            from src.models.country import Country
+        """Reloads the data from the shards"""
+        # Don't lose what the flush policy is still holding
+        self.flusher.flush()
+
+        with self._locked():
+            models = list(self.__data)
+            self.__shards = {
+                model: self._stat_shard(model) for model in models
+            }
+
+            if self.parallel_load:
+                with ThreadPoolExecutor() as executor:
+                    shards = list(executor.map(self._load_shard, models))
+            else:
+                shards = [self._load_shard(model) for model in models]
+
+            data = {
+                model: shard or {} for model, shard in zip(models, shards)
+            }
+
+            if all(shard is None for shard in shards):
+                try:
+                    with open(self.__filename, "rb") as file:
+                        data.update(pickle.load(file))
+                except FileNotFoundError:
+                    from src.models.country import Country
+
+                    country = Country("Uruguay", "UY")
+                    data["country"] = {country.id: country}
 
-            self.__data["country"] = [Country("Uruguay", "UY")]
-            self._save_to_file()
+                self.__dirty.update(data)
+
+            for model, objects in data.items():
+                # Files written before objects were indexed by id hold lists
+                if isinstance(objects, list):
+                    data[model] = {obj.id: obj for obj in objects}
+                    self.__dirty.add(model)
+
+            self.__data = data
+            self.__changes.clear()
+
+            if self.shared:
+                self.shared.mark_seen()
+
+            self.__indexes.clear()
+
+            for model, objects in self.__data.items():
+                for obj_id, obj in objects.items():
+                    self.__indexes.add(model, obj_id, obj)
+
+            # The migrated shards are written by the flush policy
+            if self.__dirty:
+                self.flusher.mark_dirty()
 
     def save(self, obj, save_to_file=True):
         """Save an object"""
-        self.__data[obj.__class__.__name__.lower()].append(obj)
-        if save_to_file:
-            self._save_to_file()
+        model = obj.__class__.__name__.lower()
+
+        with self.flusher.lock:
+            # Never write from a stale copy of what other processes wrote
+            self.sync()
+
+            self.__data[model][obj.id] = obj
+            self.__indexes.add(model, obj.id, obj)
+
+            if save_to_file:
+                self._mark_dirty(model, obj.id, obj)
 
     def update(self, obj):
         """Update an object"""
-        for i, o in enumerate(self.__data[obj.__class__.__name__.lower()]):
-            if o.id == obj.id:
-                self.__data[obj.__class__.__name__.lower()][i] = obj
-                self._save_to_file()
-                return
+        model = obj.__class__.__name__.lower()
+
+        with self.flusher.lock:
+            self.sync()
+
+            if obj.id not in self.__data[model]:
+                return None
+
+            self.__data[model][obj.id] = obj
+            self.__indexes.add(model, obj.id, obj)
+            self._mark_dirty(model, obj.id, obj)
+
+        return obj
 
     def delete(self, obj) -> bool:
         """Delete an object"""
-        for i, o in enumerate(self.__data[obj.__class__.__name__.lower()]):
-            if o.id == obj.id:
-                del self.__data[obj.__class__.__name__.lower()][i]
-                break
+        model = obj.__class__.__name__.lower()
+
+        with self.flusher.lock:
+            self.sync()
+
+            if obj.id not in self.__data[model]:
+                return False
+
+            del self.__data[model][obj.id]
+            self.__indexes.remove(model, obj.id)
+            self._mark_dirty(model, obj.id, None)
 
-        self._save_to_file()
         return True
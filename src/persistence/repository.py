@@ -1,6 +1,17 @@
 """ Repository pattern for data access layer """
 
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from src.persistence.indexes import TEXT_INDEXES, TextIndex
+from utils.text import parse_query
+
+
+def matches(obj, field_equals: dict) -> bool:
+    """Checks that the fields of an object equal the given values"""
+    return all(
+        getattr(obj, field, None) == value
+        for field, value in field_equals.items()
+    )
 
 
 class Repository(ABC):
@@ -29,3 +40,58 @@ class Repository(ABC):
     @abstractmethod
     def delete(self, obj) -> bool:
         """Delete an object"""
+
+    def find_by(self, model_name: str, **field_equals) -> list:
+        """Get all objects of a model whose fields equal the given values.
+        By default it scans the whole model, repositories override it to
+        use their secondary indexes"""
+        return [
+            obj for obj in self.get_all(model_name)
+            if matches(obj, field_equals)
+        ]
+
+    def search(self, model_name: str, query: str) -> list:
+        """Get the objects of a model whose text fields match a full-text
+        query, best first (see utils/text.py). By default it indexes the
+        whole model for every search, repositories override it to use
+        their inverted index. Raises ValueError for empty queries"""
+        terms = parse_query(query)
+        index = TextIndex(TEXT_INDEXES)
+        objects = {}
+
+        for obj in self.get_all(model_name):
+            objects[obj.id] = obj
+            index.add(model_name, obj.id, obj)
+
+        return [
+            objects[obj_id] for obj_id, _ in index.search(model_name, terms)
+        ]
+
+    def batch(self):
+        """Context manager that groups the writes of the mutations made
+        inside it. It does nothing by default"""
+        return nullcontext()
+
+    def save_many(self, objs: list) -> None:
+        """Save many objects at once"""
+        with self.batch():
+            for obj in objs:
+                self.save(obj)
+
+    def update_many(self, objs: list) -> list:
+        """Update many objects at once, returns the ones that existed"""
+        with self.batch():
+            return [obj for obj in objs if self.update(obj) is not None]
+
+    def delete_many(self, objs: list) -> int:
+        """Delete many objects at once, returns how many existed"""
+        with self.batch():
+            return sum(1 for obj in objs if self.delete(obj))
+
+    def flush(self) -> None:
+        """Persist every pending change, for repositories that defer
+        their writes. It does nothing by default"""
+
+    def sync(self) -> None:
+        """Catch up with the changes other processes made, for
+        repositories shared between processes. It does nothing by default"""
@@ -0,0 +1,102 @@
+"""
+This module exports SharedState, which coordinates the processes (for
+example gunicorn workers) that use the same repository files
+
+Writes happen while holding an advisory lock on a lock file, and every
+write bumps a generation counter kept in its own file. Each process
+remembers the generation it has seen, so it can tell with a single
+`os.stat` whether another process wrote since, and only then catch up.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import os
+import threading
+
+
+class SharedState:
+    """Advisory lock and generation counter shared between processes"""
+
+    def __init__(self, lock_filename: str, generation_filename: str):
+        """Remembers the current generation as seen"""
+        self.lock_filename = lock_filename
+        self.generation_filename = generation_filename
+        self.seen = self.generation()
+        self.__stat = self._stat()
+
+        # flock is held per open file, so nested blocks of the same thread
+        # must not open the lock file again or they would wait on themselves
+        self.__thread_lock = threading.RLock()
+        self.__depth = 0
+
+    def _stat(self) -> tuple | None:
+        """Helper method to get what identifies a generation file version"""
+        try:
+            stat = os.stat(self.generation_filename)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def generation(self) -> int:
+        """Reads the current generation, 0 when nothing was written yet"""
+        try:
+            with open(self.generation_filename) as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def changed(self) -> bool:
+        """Whether another process wrote since the last seen generation"""
+        stat = self._stat()
+
+        if stat == self.__stat:
+            return False
+
+        if self.generation() == self.seen:
+            self.__stat = stat
+            return False
+
+        return True
+
+    def bump(self) -> None:
+        """Records a write, must be called while holding the lock"""
+        generation = self.generation() + 1
+        tmp_filename = f"{self.generation_filename}.tmp"
+
+        # Replacing the file gives it a new inode, so changed() notices
+        # even when the mtime resolution of the filesystem is coarse
+        with open(tmp_filename, "w") as file:
+            file.write(str(generation))
+        os.replace(tmp_filename, self.generation_filename)
+
+        self.seen = generation
+        self.__stat = self._stat()
+
+    def mark_seen(self) -> None:
+        """Records that this process caught up with the other ones, must
+        be called while holding the lock"""
+        self.seen = self.generation()
+        self.__stat = self._stat()
+
+    @contextmanager
+    def locked(self):
+        """Holds the advisory lock shared by every process, it can be
+        nested inside the same thread"""
+        with self.__thread_lock:
+            if self.__depth:
+                self.__depth += 1
+                try:
+                    yield
+                finally:
+                    self.__depth -= 1
+                return
+
+            with open(self.lock_filename, "a") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                self.__depth = 1
+                try:
+                    yield
+                finally:
+                    self.__depth = 0
+                    fcntl.flock(file, fcntl.LOCK_UN)
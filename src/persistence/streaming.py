@@ -0,0 +1,206 @@
+"""
+This module exports iter_record_texts, which reads the JSON file written
+by the FileRepository without decoding its records, and iter_records, an
+incremental parser for any JSON document of the same shape
+
+The file is a single object that maps every model name to a list of
+records. The FileRepository writes every record on a line of its own
+(see write_records): JSON text never holds a raw newline, so the records
+are found by reading lines, and only their id is picked out. Instead of
+loading the whole document with `json.load`, other files are read in
+chunks and every record is decoded and yielded on its own, together with
+its source text, so memory stays proportional to a chunk and not to the
+file.
+"""
+
+import itertools
+import json
+import re
+from typing import Iterable, Iterator, TextIO
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = " \t\n\r"
+# The id of a record written by json.dumps. Quotes inside strings are
+# escaped, so only the key itself matches
+ID = re.compile(r'"id": "((?:[^"\\]|\\.)*)"')
+
+
+class _Reader:
+    """Buffered reader that decodes JSON values from a text file"""
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file: TextIO, chunk_size: int) -> None:
+        """Starts with an empty buffer"""
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Reads the next chunk, dropping what was already consumed"""
+        chunk = self.file.read(self.chunk_size)
+
+        if not chunk:
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or an empty
+        string at the end of the file"""
+        while True:
+            while (
+                self.pos < len(self.buffer)
+                and self.buffer[self.pos] in WHITESPACE
+            ):
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consumes the next character, which must be one of `chars`"""
+        char = self.peek()
+
+        if not char or char not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} but found {char!r} "
+                f"while reading {self.file.name}"
+            )
+
+        self.pos += 1
+
+        return char
+
+    def value(self):
+        """Decodes the next JSON string or object"""
+        return self.raw_value()[0]
+
+    def raw_value(self) -> tuple:
+        """Decodes the next JSON string or object, returning it along with
+        the text it was decoded from"""
+        self.peek()
+
+        while True:
+            try:
+                start = self.pos
+                value, self.pos = self.decoder.raw_decode(
+                    self.buffer, self.pos
+                )
+                return value, self.buffer[start:self.pos]
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk
+                if not self.fill():
+                    raise
+
+
+def iter_records(
+    file: TextIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[str, dict, str]]:
+    """Yields a (model name, record, record text) tuple for every record
+    in the file"""
+    reader = _Reader(file, chunk_size)
+
+    if not reader.peek():
+        return
+
+    reader.expect("{")
+
+    if reader.peek() == "}":
+        return
+
+    while True:
+        model = reader.value()
+        reader.expect(":")
+        reader.expect("[")
+
+        if reader.peek() == "]":
+            reader.pos += 1
+        else:
+            while True:
+                yield model, *reader.raw_value()
+
+                if reader.expect(",]") == "]":
+                    break
+
+        if reader.expect(",}") == "}":
+            return
+
+
+def write_records(file: TextIO, records: Iterable[tuple[str, list[str]]]):
+    """Writes the JSON text of the records of every model, one record per
+    line"""
+    file.write("{")
+
+    for i, (model, texts) in enumerate(records):
+        file.write(f"{',' if i else ''}\n{json.dumps(model)}: [")
+
+        for j, text in enumerate(texts):
+            file.write(f"{',' if j else ''}\n{text}")
+
+        file.write("\n]")
+
+    file.write("\n}\n")
+
+
+def record_id(text: str) -> str:
+    """The id of the JSON text of a record, decoding it only when it
+    wasn't written by json.dumps"""
+    match = ID.search(text)
+
+    if match is None:
+        return json.loads(text)["id"]
+
+    obj_id = match.group(1)
+
+    return json.loads(f'"{obj_id}"') if "\\" in obj_id else obj_id
+
+
+def iter_record_texts(
+    file: TextIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[str, str, str]]:
+    """Yields a (model name, id, record text) tuple for every record in
+    the file. Only files that weren't written by write_records are
+    decoded"""
+    start = file.readline()
+    # The name of the first model, unlike indented JSON
+    first = file.readline() if start == "{\n" else ""
+
+    if first != "}\n" and not (
+        first.startswith('"') and first.endswith(": [\n")
+    ):
+        file.seek(0)
+
+        for model, item, text in iter_records(file, chunk_size):
+            # Records on many lines would break the line per record layout
+            if "\n" in text:
+                text = json.dumps(item)
+
+            yield model, item["id"], text
+
+        return
+
+    model = None
+
+    for line in itertools.chain([first], file):
+        line = line.rstrip("\n")
+
+        if line.endswith(": ["):
+            model = json.loads(line[:-3])
+        elif line.startswith("{") and model is not None:
+            text = line[:-1] if line.endswith(",") else line
+
+            yield model, record_id(text), text
+        elif line in ("]", "],"):
+            model = None
+        elif line != "}":
+            raise ValueError(
+                f"Unexpected line {line[:50]!r} while reading {file.name}"
+            )
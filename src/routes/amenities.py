@@ -4,14 +4,22 @@ This module contains the routes for the amenities blueprint
 
 from flask import Blueprint
 from src.controllers.amenities import (
+    add_place_amenity,
     create_amenity,
     delete_amenity,
+    delete_place_amenity,
     get_amenity_by_id,
     get_amenities,
+    get_place_amenities,
+    get_place_amenity,
+    replace_place_amenities,
     update_amenity,
 )
 
 amenities_bp = Blueprint("amenities", __name__, url_prefix="/amenities")
+place_amenities_bp = Blueprint(
+    "place_amenities", __name__, url_prefix="/places/<place_id>/amenities"
+)
 
 amenities_bp.route("/", methods=["GET"])(get_amenities)
 amenities_bp.route("/", methods=["POST"])(create_amenity)
@@ -19,3 +27,12 @@ amenities_bp.route("/", methods=["POST"])(create_amenity)
 amenities_bp.route("/<amenity_id>", methods=["GET"])(get_amenity_by_id)
 amenities_bp.route("/<amenity_id>", methods=["PUT"])(update_amenity)
 amenities_bp.route("/<amenity_id>", methods=["DELETE"])(delete_amenity)
+
+place_amenities_bp.route("/", methods=["GET"])(get_place_amenities)
+place_amenities_bp.route("/", methods=["POST"])(add_place_amenity)
+place_amenities_bp.route("/", methods=["PUT"])(replace_place_amenities)
+
+place_amenities_bp.route("/<amenity_id>", methods=["GET"])(get_place_amenity)
+place_amenities_bp.route(
+    "/<amenity_id>", methods=["DELETE"]
+)(delete_place_amenity)
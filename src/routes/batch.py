@@ -0,0 +1,10 @@
+"""
+This module contains the routes for the batch blueprint
+"""
+
+from flask import Blueprint
+from src.controllers.batch import run_batch
+
+batch_bp = Blueprint("batch", __name__, url_prefix="/batch")
+
+batch_bp.route("/", methods=["POST"])(run_batch)
@@ -0,0 +1,10 @@
+"""
+This module contains the routes for the imports blueprint
+"""
+
+from flask import Blueprint
+from src.controllers.imports import import_collection
+
+imports_bp = Blueprint("imports", __name__, url_prefix="/import")
+
+imports_bp.route("/<model_name>", methods=["POST"])(import_collection)
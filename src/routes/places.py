@@ -8,6 +8,8 @@ from src.controllers.places import (
     delete_place,
     get_place_by_id,
     get_places,
+    get_places_nearby,
+    get_places_within,
     update_place,
 )
 
@@ -16,6 +18,9 @@ places_bp = Blueprint("places", __name__, url_prefix="/places")
 places_bp.route("/", methods=["GET"])(get_places)
 places_bp.route("/", methods=["POST"])(create_place)
 
+places_bp.route("/nearby", methods=["GET"])(get_places_nearby)
+places_bp.route("/within", methods=["GET"])(get_places_within)
+
 places_bp.route("/<place_id>", methods=["GET"])(get_place_by_id)
 places_bp.route("/<place_id>", methods=["PUT"])(update_place)
 places_bp.route("/<place_id>", methods=["DELETE"])(delete_place)
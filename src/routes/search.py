@@ -0,0 +1,10 @@
+"""
+This module contains the routes for the search blueprint
+"""
+
+from flask import Blueprint
+from src.controllers.search import search
+
+search_bp = Blueprint("search", __name__, url_prefix="/search")
+
+search_bp.route("/", methods=["GET"])(search)
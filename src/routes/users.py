@@ -4,10 +4,7 @@ This module contains the routes for the users endpoints.
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token
-from models import User
-import bcrypt
-
-from src import app
+from src.models.user import User
 
 from src.controllers.users import (
     create_user,
@@ -26,13 +23,19 @@ users_bp.route("/<user_id>", methods=["GET"])(get_user_by_id)
 users_bp.route("/<user_id>", methods=["PUT"])(update_user)
 users_bp.route("/<user_id>", methods=["DELETE"])(delete_user)
 
-@app.route('/login', methods=['POST'])
+auth_bp = Blueprint("auth", __name__)
+
+
+@auth_bp.route("/login", methods=["POST"])
 def login():
+    """Returns an access token for valid credentials"""
     username = request.json.get('username', None)
     password = request.json.get('password', None)
     user = User.query.filter_by(username=username).first()
-    if user and bcrypt.check_password_hash(user.password, password):
-        additional_claims = {"is_adming": user.is_admin}
-        access_token = create_access_token(identity=username, additional_claims=additional_claims)
+    if user and user.check_password(password):
+        additional_claims = {"is_admin": user.is_admin}
+        access_token = create_access_token(
+            identity=username, additional_claims=additional_claims
+        )
         return jsonify(access_token=access_token), 200
-    return 'Wrong username or password', 401
\ No newline at end of file
+    return 'Wrong username or password', 401
@@ -0,0 +1,1779 @@
+""" Tests for the HTTP endpoints """
+
+from datetime import datetime
+import json
+import os
+import random
+import tempfile
+import tracemalloc
+import unittest
+from urllib.parse import parse_qsl
+import zlib
+
+from flask import abort, request
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from src import compression, create_app, db
+from src.commands import (
+    import_command,
+    rebuild_search_command,
+    repair_ratings_command,
+)
+from src.models import cache
+from src.models import search as full_text
+from src.models.amenity import Amenity, PlaceAmenity
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.review import Review
+from src.models.serializers import cached_serializer
+from src.models.user import User
+
+
+class ApiTestCase(unittest.TestCase):
+    """Every test gets a client of an app with an empty database"""
+
+    def setUp(self):
+        """Create the app, the tables and the rows every test needs"""
+        self.app = create_app("src.config.TestingConfig")
+        self.client = self.app.test_client()
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.country = Country.create("Uruguay", "UY")
+        self.city = City.create({"name": "Montevideo", "country_code": "UY"})
+        self.user = User(
+            email="host@example.com", first_name="Host", last_name="User",
+            username="host", password_hash="x", is_admin=True,
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """Drop the database"""
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def place_data(self, i: int = 0) -> dict:
+        """Data to create a place"""
+        return {
+            "name": f"Place {i}", "city_id": self.city.id,
+            "host_id": self.user.id, "price_per_night": 100 + i,
+        }
+
+    def walk(
+        self, url: str, limit: int, params: dict | None = None
+    ) -> list[list[dict]]:
+        """Follows the cursors of a collection, returns every page"""
+        pages = []
+        cursor = None
+
+        while True:
+            query = {**(params or {}), "limit": limit}
+            if cursor:
+                query["cursor"] = cursor
+
+            response = self.client.get(url, query_string=query)
+            self.assertEqual(response.status_code, 200)
+
+            pages.append(response.json["items"])
+            cursor = response.json["next_cursor"]
+
+            if cursor is None:
+                return pages
+
+
+class TestPagination(ApiTestCase):
+    """Collections are paginated with ?limit=&cursor="""
+
+    def test_walk_every_page(self):
+        """Following the cursors returns every object once, in order"""
+        places = Place.create_many([self.place_data(i) for i in range(25)])
+
+        pages = self.walk("/places", 10)
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        expected = sorted(places, key=lambda p: (p.created_at, p.id))
+        self.assertEqual(
+            [item["id"] for page in pages for item in page],
+            [place.id for place in expected],
+        )
+
+    def test_ties_are_broken_by_id(self):
+        """Objects created at the same time are ordered by id"""
+        created_at = datetime(2024, 1, 1)
+        places = Place.create_many([self.place_data(i) for i in range(7)])
+        for place in places:
+            place.created_at = created_at
+        db.session.commit()
+
+        pages = self.walk("/places", 3)
+
+        self.assertEqual(
+            [item["id"] for page in pages for item in page],
+            sorted(place.id for place in places),
+        )
+
+    def test_default_and_max_limit(self):
+        """The limit defaults to the configuration and is capped by it"""
+        Place.create_many([self.place_data(i) for i in range(8)])
+        self.app.config["PAGINATION_DEFAULT_LIMIT"] = 3
+        self.app.config["PAGINATION_MAX_LIMIT"] = 5
+
+        self.assertEqual(len(self.client.get("/places").json["items"]), 3)
+        response = self.client.get("/places?limit=1000")
+        self.assertEqual(len(response.json["items"]), 5)
+
+    def test_invalid_parameters(self):
+        """A bad limit or cursor is a bad request"""
+        for query in (
+            "limit=0", "limit=ten", "cursor=nope", "cursor=WzFd",
+            "cursor=WyJub3QgYSBkYXRlIiwgImlkIl0",
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(f"/places?{query}")
+                self.assertEqual(response.status_code, 400)
+
+    def test_nested_collection(self):
+        """The reviews of a place are paginated too"""
+        place, other = Place.create_many(
+            [self.place_data(i) for i in range(2)]
+        )
+        Review.create_many([
+            {"place_id": p.id, "user_id": self.user.id,
+             "comment": str(i), "rating": 5}
+            for i in range(6) for p in (place, other)
+        ])
+
+        pages = self.walk(f"/places/{place.id}/reviews", 4)
+
+        items = [item for page in pages for item in page]
+        self.assertEqual(len(items), 6)
+        self.assertTrue(all(item["place_id"] == place.id for item in items))
+
+    def test_countries_and_users(self):
+        """Countries are paginated by id, users need an admin token"""
+        Country.create("Argentina", "AR")
+
+        pages = self.walk("/countries", 1)
+        self.assertEqual(
+            [page[0]["code"] for page in pages if page], ["UY", "AR"]
+        )
+
+        token = create_access_token(
+            identity="host", additional_claims={"is_admin": True}
+        )
+        response = self.client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["items"][0]["id"], self.user.id)
+        self.assertIsNone(response.json["next_cursor"])
+
+
+class TestPlaceSearch(ApiTestCase):
+    """GET /places filters and sorts in a single query"""
+
+    def setUp(self):
+        """Create places with different prices and sizes in two cities"""
+        super().setUp()
+        Country.create("Argentina", "AR")
+        self.other_city = City.create(
+            {"name": "Buenos Aires", "country_code": "AR"}
+        )
+
+        data = []
+        for i in range(12):
+            item = self.place_data(i)
+            item["price_per_night"] = 50 * (i % 4)
+            item["max_guests"] = i % 6
+            item["number_of_rooms"] = i % 3
+            if i % 2:
+                item["city_id"] = self.other_city.id
+            data.append(item)
+
+        self.places = Place.create_many(data)
+
+    def ids(self, query: str, limit: int = 100) -> list[str]:
+        """Ids of every place matching a query string"""
+        pages = self.walk("/places", limit, dict(parse_qsl(query)))
+
+        return [item["id"] for page in pages for item in page]
+
+    def test_filters(self):
+        """Filters combine, numbers are lower bounds but max_price"""
+        expected = [
+            place.id for place in sorted(
+                self.places, key=lambda p: (p.created_at, p.id)
+            )
+            if place.city_id == self.city.id
+            and 50 <= place.price_per_night <= 100
+            and place.max_guests >= 2
+        ]
+
+        self.assertEqual(
+            self.ids(
+                f"city_id={self.city.id}&min_price=50&max_price=100"
+                "&max_guests=2"
+            ),
+            expected,
+        )
+
+    def test_country(self):
+        """Places can be filtered by the country of their city"""
+        ids = set(self.ids("country_code=AR"))
+
+        self.assertEqual(ids, {
+            place.id for place in self.places
+            if place.city_id == self.other_city.id
+        })
+
+    def test_sort_by_price(self):
+        """Sorting by price works across pages in both directions"""
+        by_price = sorted(
+            self.places, key=lambda p: (p.price_per_night, p.id)
+        )
+
+        self.assertEqual(
+            self.ids("sort=price", limit=5), [p.id for p in by_price]
+        )
+        self.assertEqual(
+            self.ids("sort=-price", limit=5),
+            [p.id for p in reversed(by_price)],
+        )
+
+    def test_single_query(self):
+        """The filters, sort and page are one statement, the other one is
+        the aggregate of the ETag"""
+        url = f"/places?city_id={self.city.id}&min_price=50&sort=price"
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        self.client.get(url)
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(
+            len([sql for sql in statements if "LIMIT" in sql]), 1
+        )
+
+    def test_composite_index(self):
+        """Filtering by city and sorting by price uses the index"""
+        query = Place.search(city_id=self.city.id, min_price="50")
+        query = query.order_by(Place.price_per_night, Place.id)
+        sql = str(query.statement.compile(
+            db.engine, compile_kwargs={"literal_binds": True}
+        ))
+
+        plan = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"))
+
+        self.assertIn(
+            "ix_places_city_id_price_per_night_id",
+            " ".join(row[-1] for row in plan),
+        )
+
+    def test_invalid_parameters(self):
+        """Bad filter values and sort keys are bad requests"""
+        for query in ("min_price=cheap", "sort=name", "sort=-owner"):
+            with self.subTest(query=query):
+                response = self.client.get(f"/places?{query}")
+                self.assertEqual(response.status_code, 400)
+
+
+class TestGeoSearch(ApiTestCase):
+    """/places/nearby and /places/within use the geohash index"""
+
+    CITIES = {
+        "Montevideo": (-34.9011, -56.1645),
+        "Punta del Este": (-34.9627, -54.9451),
+        "Colonia": (-34.4626, -57.8398),
+        "Buenos Aires": (-34.6037, -58.3816),
+        "Madrid": (40.4168, -3.7038),
+    }
+
+    def setUp(self):
+        """Create a place in every city"""
+        super().setUp()
+
+        data = []
+        for i, (name, (lat, lon)) in enumerate(self.CITIES.items()):
+            item = self.place_data(i)
+            item |= {"name": name, "latitude": lat, "longitude": lon}
+            data.append(item)
+
+        Place.create_many(data)
+
+    def names(self, url: str) -> list[str]:
+        """Names of the places a search returns"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        return [item["name"] for item in response.json["items"]]
+
+    def test_nearby(self):
+        """Places within the radius, closest first"""
+        response = self.client.get(
+            "/places/nearby?lat=-34.9011&lon=-56.1645&radius_km=180"
+        )
+        items = response.json["items"]
+
+        self.assertEqual(
+            [item["name"] for item in items],
+            ["Montevideo", "Punta del Este", "Colonia"],
+        )
+        self.assertEqual(items[0]["distance_km"], 0)
+        self.assertAlmostEqual(items[1]["distance_km"], 111, delta=2)
+
+    def test_nearby_limit(self):
+        """The limit keeps the closest places"""
+        self.assertEqual(
+            self.names("/places/nearby?lat=0&lon=0&radius_km=20000&limit=2"),
+            ["Madrid", "Punta del Este"],
+        )
+
+    def test_within(self):
+        """Places inside the box, closest to its center first"""
+        self.assertEqual(
+            self.names("/places/within?bbox=-58.5,-35,-56,-34.4"),
+            ["Colonia", "Montevideo", "Buenos Aires"],
+        )
+
+    def test_geohash_follows_updates(self):
+        """Moving a place moves it in the index"""
+        place = Place.query.filter_by(name="Madrid").one()
+        Place.update(place.id, {"latitude": -34.9, "longitude": -56.16})
+
+        self.assertIn(
+            "Madrid",
+            self.names("/places/nearby?lat=-34.9&lon=-56.16&radius_km=1"),
+        )
+
+    def test_geohash_can_not_be_set(self):
+        """Clients can't set the geohash, the place stays in the index"""
+        place = Place.query.filter_by(name="Madrid").one()
+
+        response = self.client.put(
+            f"/places/{place.id}", json={"geohash": "zzzz"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(
+            "Madrid",
+            self.names("/places/nearby?lat=40.4&lon=-3.7&radius_km=10"),
+        )
+
+    def test_invalid_coordinates(self):
+        """Coordinates that aren't numbers in range are rejected, numeric
+        strings are converted"""
+        place = Place.query.filter_by(name="Madrid").one()
+        url = f"/places/{place.id}"
+
+        for data in ({"latitude": "abc"}, {"longitude": None, "latitude": []},
+                     {"latitude": 91}, {"longitude": -180.5},
+                     {"latitude": True}):
+            with self.subTest(data=data):
+                response = self.client.put(url, json=data)
+                self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(Place.get(place.id).latitude, 40.4168)
+
+        response = self.client.put(url, json={"latitude": "10.5"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["latitude"], 10.5)
+
+    def test_same_as_brute_force(self):
+        """The index never misses a place inside the radius"""
+        rng = random.Random(1)
+        Place.create_many([
+            self.place_data(i) | {
+                "latitude": rng.uniform(-36, -33),
+                "longitude": rng.uniform(-59, -53),
+            }
+            for i in range(300)
+        ])
+        places = Place.query.all()
+
+        for radius_km in (5, 30, 120):
+            with self.subTest(radius_km=radius_km):
+                expected = {
+                    place.id for place, distance in Place.by_distance(
+                        places, -34.5, -56
+                    )
+                    if distance <= radius_km
+                }
+                found = Place.nearby(-34.5, -56, radius_km, len(places))
+
+                self.assertEqual({place.id for place, _ in found}, expected)
+
+    def test_antimeridian(self):
+        """A circle crossing the antimeridian finds places on both sides"""
+        Place.create_many([
+            self.place_data(10) | {
+                "name": "East", "latitude": -16.5, "longitude": 179.9,
+            },
+            self.place_data(11) | {
+                "name": "West", "latitude": -16.5, "longitude": -179.9,
+            },
+        ])
+
+        for lon, names in ((179.9, ["East", "West"]),
+                           (-179.9, ["West", "East"])):
+            with self.subTest(lon=lon):
+                self.assertEqual(self.names(
+                    f"/places/nearby?lat=-16.5&lon={lon}&radius_km=50"
+                ), names)
+
+    def test_pole(self):
+        """A circle covering a pole spans every longitude"""
+        Place.create_many([
+            self.place_data(10) | {
+                "name": "Near", "latitude": 89.5, "longitude": 0,
+            },
+            self.place_data(11) | {
+                "name": "Across", "latitude": 89.5, "longitude": 180,
+            },
+        ])
+
+        self.assertEqual(
+            self.names("/places/nearby?lat=89.5&lon=0&radius_km=150"),
+            ["Near", "Across"],
+        )
+
+    def test_same_as_brute_force_everywhere(self):
+        """Near the poles and the antimeridian too"""
+        rng = random.Random(2)
+        Place.create_many([
+            self.place_data(i) | {
+                "latitude": rng.uniform(60, 90),
+                "longitude": rng.uniform(-180, 180),
+            }
+            for i in range(300)
+        ])
+        places = Place.query.all()
+
+        for lat, lon, radius_km in ((75, 179, 500), (85, -170, 900),
+                                    (70, -180, 300), (89, 0, 200)):
+            with self.subTest(lat=lat, lon=lon, radius_km=radius_km):
+                expected = {
+                    place.id for place, distance in Place.by_distance(
+                        places, lat, lon
+                    )
+                    if distance <= radius_km
+                }
+                found = Place.nearby(lat, lon, radius_km, len(places))
+
+                self.assertTrue(expected)
+                self.assertEqual({place.id for place, _ in found}, expected)
+
+    def test_uses_geohash_index(self):
+        """The candidates are read with the geohash index"""
+        query = Place.in_box(-35, -57, -34.8, -56)
+        sql = str(query.statement.compile(
+            db.engine, compile_kwargs={"literal_binds": True}
+        ))
+
+        plan = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"))
+
+        self.assertIn(
+            "ix_places_geohash", " ".join(row[-1] for row in plan)
+        )
+
+    def test_invalid_parameters(self):
+        """Missing or out of range parameters are bad requests"""
+        for url in (
+            "/places/nearby?lat=0&lon=0",
+            "/places/nearby?lat=91&lon=0&radius_km=1",
+            "/places/nearby?lat=x&lon=0&radius_km=1",
+            "/places/within",
+            "/places/within?bbox=1,2,3",
+            "/places/within?bbox=10,0,-10,1",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class TestConditionalGet(ApiTestCase):
+    """GETs send validators and answer 304 when nothing changed"""
+
+    def setUp(self):
+        """Create a place"""
+        super().setUp()
+        self.place = Place.create(self.place_data())
+        self.url = f"/places/{self.place.id}"
+
+    def test_entity_etag(self):
+        """A matching If-None-Match is a 304 without a body"""
+        response = self.client.get(self.url)
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_entity_etag_changes(self):
+        """Updating an object changes its ETag"""
+        etag = self.client.get(self.url).headers["ETag"]
+        Place.update(self.place.id, {"name": "Renamed"})
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["name"], "Renamed")
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_last_modified(self):
+        """If-Modified-Since is compared with updated_at"""
+        response = self.client.get(self.url)
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(
+            self.url, headers={"If-Modified-Since": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            self.url,
+            headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_collection_etag(self):
+        """The weak ETag of a collection follows creates, updates and
+        deletes"""
+        etags = [self.client.get("/places").headers["ETag"]]
+        self.assertTrue(etags[0].startswith("W/"))
+
+        other = Place.create(self.place_data(1))
+        etags.append(self.client.get("/places").headers["ETag"])
+        Place.update(other.id, {"name": "Renamed"})
+        etags.append(self.client.get("/places").headers["ETag"])
+        Place.delete(other.id)
+        etags.append(self.client.get("/places").headers["ETag"])
+
+        self.assertEqual(len(set(etags[:3])), 3)
+        response = self.client.get(
+            "/places", headers={"If-None-Match": etags[-1]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_query_string_changes_etag(self):
+        """Another page or filter has another ETag"""
+        first = self.client.get("/places").headers["ETag"]
+
+        response = self.client.get(
+            "/places?limit=1", headers={"If-None-Match": first}
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_skips_the_page(self):
+        """A 304 of a collection only runs the aggregate query"""
+        etag = self.client.get("/places").headers["ETag"]
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        response = self.client.get(
+            "/places", headers={"If-None-Match": etag}
+        )
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+
+
+class TestReadCache(ApiTestCase):
+    """Hot reads of cached models are served without the database"""
+
+    def setUp(self):
+        """Enable the cache of countries and places"""
+        super().setUp()
+        cache.configure({
+            "Country": {"max_size": 100, "ttl": 60},
+            "Place": {"max_size": 100, "ttl": 60},
+        })
+        self.addCleanup(cache.configure, {})
+
+    def test_hot_reads(self):
+        """Repeated GETs don't query once cached, writes are seen"""
+        place = Place.create(self.place_data())
+        urls = ["/countries", "/countries/UY", f"/places/{place.id}"]
+        first = [self.client.get(url).json for url in urls]
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        self.assertEqual([self.client.get(url).json for url in urls], first)
+        self.assertEqual(statements, [])
+
+        self.client.put(
+            f"/places/{place.id}", json={"name": "Renamed"}
+        )
+        self.assertEqual(
+            self.client.get(f"/places/{place.id}").json["name"], "Renamed"
+        )
+
+
+class TestStreaming(ApiTestCase):
+    """Whole collections are streamed as JSON or NDJSON"""
+
+    def setUp(self):
+        """Create some places"""
+        super().setUp()
+        Place.create_many([self.place_data(i) for i in range(250)])
+
+    def test_json(self):
+        """?stream=true returns every item as the last page"""
+        expected = [
+            item["id"] for page in self.walk("/places", 100)
+            for item in page
+        ]
+
+        response = self.client.get("/places?stream=true", buffered=False)
+
+        self.assertTrue(response.is_streamed)
+        body = json.loads(b"".join(response.response))
+        self.assertEqual([item["id"] for item in body["items"]], expected)
+        self.assertIsNone(body["next_cursor"])
+
+    def test_ndjson(self):
+        """Accept: application/x-ndjson returns one object per line, with
+        the filters, sort and cursor of the request"""
+        cursor = self.client.get(
+            "/places?sort=-price&limit=10"
+        ).json["next_cursor"]
+
+        response = self.client.get(
+            "/places",
+            query_string={"sort": "-price", "cursor": cursor},
+            headers={"Accept": "application/x-ndjson"},
+        )
+
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        items = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(len(items), 240)
+        prices = [item["price_per_night"] for item in items]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+        self.assertEqual(prices[0], 339)
+
+    def test_empty(self):
+        """An empty collection is still valid JSON"""
+        response = self.client.get("/reviews?stream=true")
+
+        self.assertEqual(response.json, {"items": [], "next_cursor": None})
+        self.assertEqual(
+            self.client.get(
+                "/reviews", headers={"Accept": "application/x-ndjson"}
+            ).data,
+            b"",
+        )
+
+    def test_flat_memory(self):
+        """Streaming never holds the whole collection in memory"""
+        Place.create_many([self.place_data(i) for i in range(3750)])
+        db.session.remove()
+
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        response = self.client.get("/places?stream=true", buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        peak = tracemalloc.get_traced_memory()[1]
+
+        self.assertGreater(size, 1_000_000)
+        self.assertLess(peak, size / 2)
+
+
+class TestJSONProvider(ApiTestCase):
+    """Responses are encoded like Flask's default provider does"""
+
+    def test_sorted_and_compact(self):
+        """Keys are sorted, without spaces, ending with a newline"""
+        response = self.client.get("/countries/UY")
+
+        self.assertEqual(
+            response.data,
+            b'{"code":"UY","id":%d,"name":"Uruguay"}\n' % self.country.id,
+        )
+
+    def test_same_as_default(self):
+        """The JSON decodes to what the default provider would encode"""
+        data = {
+            "b": [1, 2.5, None, True], "a": "\u00e9",
+            "when": datetime(2024, 1, 1),
+        }
+
+        with self.app.test_request_context():
+            body = self.app.json.response(data).get_data()
+
+        self.assertEqual(
+            json.loads(body),
+            json.loads(DefaultJSONProvider(self.app).dumps(data)),
+        )
+
+
+class TestSparseFields(ApiTestCase):
+    """?fields= restricts the fields returned and the columns loaded"""
+
+    def setUp(self):
+        """Create some places"""
+        super().setUp()
+        self.places = Place.create_many(
+            [self.place_data(i) for i in range(5)]
+        )
+
+    def test_collection(self):
+        """Only the fields asked for are returned, on every page"""
+        pages = self.walk(
+            "/places", 2, {"fields": "id,name,price_per_night"}
+        )
+
+        items = [item for page in pages for item in page]
+        self.assertEqual(len(items), 5)
+        for item in items:
+            self.assertEqual(set(item), {"id", "name", "price_per_night"})
+
+    def test_load_only(self):
+        """The query only selects those columns and the sort keys"""
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        self.client.get("/places?fields=name&sort=price")
+
+        page = next(sql for sql in statements if "LIMIT" in sql)
+        selected = page.split("FROM")[0]
+        self.assertIn("places.name", selected)
+        self.assertIn("places.price_per_night", selected)
+        self.assertNotIn("places.description", selected)
+        self.assertNotIn("places.address", selected)
+
+    def test_entity(self):
+        """A single object too"""
+        response = self.client.get(
+            f"/places/{self.places[0].id}?fields=name"
+        )
+
+        self.assertEqual(response.json, {"name": "Place 0"})
+
+    def test_nested_and_streamed(self):
+        """Nested collections and streams take fields too"""
+        response = self.client.get(
+            "/countries/UY/cities?fields=name&stream=true"
+        )
+
+        self.assertEqual(response.json["items"], [{"name": "Montevideo"}])
+
+    def test_field_order(self):
+        """?fields=a,b and ?fields=b,a share one compiled serializer"""
+        cached_serializer.cache_clear()
+
+        first = self.client.get("/places?fields=name,price_per_night")
+        second = self.client.get("/places?fields=price_per_night,name")
+
+        self.assertEqual(first.json, second.json)
+        self.assertEqual(cached_serializer.cache_info().currsize, 1)
+
+    def test_unknown_fields(self):
+        """Unknown, hidden or no fields are a bad request"""
+        for url in (
+            "/places?fields=name,owner",
+            "/places?fields=geohash",
+            "/places?fields=",
+            f"/places/{self.places[0].id}?fields=nope",
+            "/countries?fields=created_at",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class TestIncludes(ApiTestCase):
+    """?include= embeds relations loaded in a fixed number of queries"""
+
+    INCLUDE = "host,city,reviews,reviews.user,amenities"
+
+    def setUp(self):
+        """Create a place with an amenity"""
+        super().setUp()
+        self.place = Place.create(self.place_data())
+        amenity = Amenity.create({"name": "Wifi"})
+        PlaceAmenity.create(
+            {"place_id": self.place.id, "amenity_id": amenity.id}
+        )
+        self.data = [self.place_data(i) for i in range(1, 20)]
+        self.place_id = self.place.id
+        self.url = f"/places/{self.place_id}"
+
+    def add_reviews(self, count: int, start: int = 0) -> None:
+        """Add reviews to the place, each by another user"""
+        users = [
+            User(
+                email=f"user{i}@example.com", first_name="User",
+                last_name=str(i), username=f"user{i}", password_hash="x",
+            )
+            for i in range(start, start + count)
+        ]
+        db.session.add_all(users)
+        db.session.add_all(
+            Review(
+                place_id=self.place_id, user_id=user.id, comment="Nice",
+                rating=4,
+            )
+            for user in users
+        )
+        db.session.commit()
+        db.session.remove()
+
+    def count_queries(self, url: str) -> int:
+        """Amount of statements a GET sends"""
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(response.status_code, 200)
+
+        return len(statements)
+
+    def test_embedded(self):
+        """Related objects are embedded, nested ones too"""
+        self.add_reviews(2)
+
+        data = self.client.get(f"{self.url}?include={self.INCLUDE}").json
+
+        self.assertEqual(data["host"]["email"], "host@example.com")
+        self.assertNotIn("password_hash", data["host"])
+        self.assertEqual(data["city"]["name"], "Montevideo")
+        self.assertEqual([a["name"] for a in data["amenities"]], ["Wifi"])
+        self.assertEqual(len(data["reviews"]), 2)
+        self.assertTrue(all(
+            review["user"]["id"] == review["user_id"]
+            for review in data["reviews"]
+        ))
+
+    def test_constant_queries(self):
+        """The amount of queries doesn't grow with the reviews"""
+        url = f"{self.url}?include={self.INCLUDE}"
+        self.add_reviews(2)
+        few = self.count_queries(url)
+
+        self.add_reviews(30, start=2)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 4)
+
+    def test_collection(self):
+        """A page of places embeds the relations of all of them at once"""
+        url = f"/places?include={self.INCLUDE}"
+        self.add_reviews(3)
+        few = self.count_queries(url)
+
+        Place.create_many(self.data)
+        self.add_reviews(10, start=3)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many)
+        items = self.client.get(url).json["items"]
+        self.assertEqual(len(items), 20)
+        self.assertEqual(len(items[0]["reviews"]), 13)
+
+    def test_etag(self):
+        """The ETag follows the embedded objects"""
+        url = f"{self.url}?include=reviews"
+        etag = self.client.get(url).headers["ETag"]
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.add_reviews(1)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_include(self):
+        """Relations that can't be included are a bad request"""
+        for include in ("owner", "reviews.owner", "host.places", "city."):
+            with self.subTest(include=include):
+                response = self.client.get(f"{self.url}?include={include}")
+                self.assertEqual(response.status_code, 400)
+
+
+class TestBatch(ApiTestCase):
+    """POST /batch runs many operations in one transaction"""
+
+    def test_operations(self):
+        """Every operation gets its status and body, in order"""
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/amenities", "body": {"name": "A"}},
+            {"method": "POST", "path": "/places", "body": self.place_data()},
+            {"method": "GET", "path": "/amenities?fields=name"},
+            {"method": "PUT", "path": "/places/missing", "body": {}},
+            {"method": "GET", "path": "/nowhere"},
+        ])
+
+        self.assertTrue(response.json["committed"])
+        results = response.json["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            [201, 201, 200, 404, 404],
+        )
+        self.assertEqual(results[2]["body"]["items"], [{"name": "A"}])
+        self.assertEqual(Amenity.query.count(), 1)
+        self.assertEqual(Place.query.count(), 1)
+
+    def test_failures_roll_back_alone(self):
+        """A failed operation doesn't undo the others"""
+        data = self.place_data()
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/places", "body": data},
+            {"method": "POST", "path": "/places",
+             "body": data | {"host_id": "missing"}},
+            {"method": "POST", "path": "/places", "body": data},
+        ])
+
+        self.assertEqual(
+            [result["status"] for result in response.json["results"]],
+            [201, 404, 201],
+        )
+        self.assertEqual(Place.query.count(), 2)
+
+    def test_atomic(self):
+        """With ?atomic=true the first failure undoes everything"""
+        response = self.client.post("/batch?atomic=true", json=[
+            {"method": "POST", "path": "/amenities", "body": {"name": "A"}},
+            {"method": "DELETE", "path": "/amenities/missing"},
+            {"method": "POST", "path": "/amenities", "body": {"name": "B"}},
+        ])
+
+        self.assertFalse(response.json["committed"])
+        self.assertEqual(
+            [result["status"] for result in response.json["results"]],
+            [201, 404],
+        )
+        self.assertEqual(Amenity.query.count(), 0)
+
+    def test_committed_failures_roll_back(self):
+        """An operation that fails after its controller committed is
+        rolled back too"""
+        def commit_and_fail():
+            """Commits an amenity, then fails"""
+            Amenity.create({"name": "Committed"})
+            abort(409, "Too late")
+
+        self.app.add_url_rule(
+            "/fails", "fails", commit_and_fail, methods=["POST"]
+        )
+
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/amenities", "body": {"name": "A"}},
+            {"method": "POST", "path": "/fails"},
+        ])
+
+        self.assertTrue(response.json["committed"])
+        self.assertEqual(
+            [result["status"] for result in response.json["results"]],
+            [201, 409],
+        )
+        self.assertEqual(
+            [amenity.name for amenity in Amenity.query], ["A"]
+        )
+
+    def test_request_hooks(self):
+        """Operations run the hooks of the app like requests"""
+        paths = []
+
+        @self.app.before_request
+        def before():
+            """Record the path of the request"""
+            paths.append(request.path)
+
+        @self.app.after_request
+        def after(response):
+            """Tag the response"""
+            response.headers["X-Hooked"] = "yes"
+            paths.append(response.headers["X-Hooked"])
+            return response
+
+        self.client.post("/batch", json=[
+            {"method": "GET", "path": "/amenities"},
+            {"method": "GET", "path": "/nowhere"},
+        ])
+
+        self.assertEqual(
+            paths,
+            ["/batch", "/amenities", "yes", "/nowhere", "yes", "yes"],
+        )
+
+    def test_single_transaction(self):
+        """Operations are savepoints of one transaction"""
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        self.client.post("/batch", json=[
+            {"method": "POST", "path": "/amenities", "body": {"name": str(i)}}
+            for i in range(50)
+        ])
+
+        self.assertEqual(Amenity.query.count(), 50)
+        self.assertEqual(
+            len([sql for sql in statements if sql.startswith("SAVEPOINT")]),
+            50,
+        )
+
+    def test_authorization(self):
+        """The token of the batch is used by every operation"""
+        token = create_access_token(
+            identity="host", additional_claims={"is_admin": True}
+        )
+        operations = [{"method": "GET", "path": f"/users/{self.user.id}"}]
+
+        response = self.client.post("/batch", json=operations)
+        self.assertEqual(response.json["results"][0]["status"], 401)
+
+        response = self.client.post(
+            "/batch", json=operations,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.json["results"][0]["status"], 200)
+
+    def test_invalid(self):
+        """Bad bodies, nested and oversized batches are rejected"""
+        self.app.config["BATCH_MAX_OPERATIONS"] = 2
+
+        self.assertEqual(
+            self.client.post("/batch", json={"path": "/"}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.post("/batch", json=[{}] * 3).status_code, 400
+        )
+
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/batch", "body": []},
+            {"method": "GET", "path": "relative"},
+        ])
+        self.assertEqual(
+            [result["status"] for result in response.json["results"]],
+            [400, 400],
+        )
+
+
+class TestImport(ApiTestCase):
+    """Bulk imports of NDJSON and CSV, over HTTP and the CLI"""
+
+    def setUp(self):
+        """Also create an admin token"""
+        super().setUp()
+
+        token = create_access_token(
+            identity="host", additional_claims={"is_admin": True}
+        )
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def ndjson(self, records: list[dict]) -> str:
+        """Records as NDJSON"""
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def test_ndjson(self):
+        """Records are inserted in chunks, with their ids and dates"""
+        records = [self.place_data(i) for i in range(25)]
+        records[0] |= {"id": "first", "created_at": "2024-01-02T03:04:05"}
+
+        response = self.client.post(
+            "/import/places?chunk_size=10", data=self.ndjson(records),
+            headers=self.headers,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["imported"], 25)
+        self.assertEqual(response.json["chunks"], 3)
+        self.assertIn("records_per_second", response.json)
+        self.assertEqual(Place.query.count(), 25)
+        self.assertEqual(
+            Place.query.get("first").created_at, datetime(2024, 1, 2, 3, 4, 5)
+        )
+
+    def test_csv(self):
+        """CSV values get the types of their columns"""
+        response = self.client.post(
+            "/import/places", headers=self.headers, content_type="text/csv",
+            data="name,city_id,host_id,price_per_night,latitude\n"
+            f"Flat,{self.city.id},{self.user.id},120,-34.9\n",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        place = Place.query.one()
+        self.assertEqual(place.price_per_night, 120)
+        self.assertEqual(place.latitude, -34.9)
+
+    def test_failure_and_resume(self):
+        """A bad record keeps the chunks before it, ?skip resumes"""
+        records = [self.place_data(i) for i in range(30)]
+        records[25]["host_id"] = "missing"
+        url = "/import/places?chunk_size=10"
+
+        response = self.client.post(
+            url, data=self.ndjson(records), headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["committed"], 20)
+        self.assertIn("User with id missing not found",
+                      response.json["message"])
+        self.assertEqual(Place.query.count(), 20)
+
+        records[25]["host_id"] = self.user.id
+        response = self.client.post(
+            url + "&skip=20", data=self.ndjson(records), headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["imported"], 10)
+        self.assertEqual(response.json["committed"], 30)
+        self.assertEqual(Place.query.count(), 30)
+
+    def test_references_checked_once(self):
+        """The ids found are kept for the next chunks"""
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        data = self.ndjson([self.place_data(i) for i in range(50)])
+        statements.clear()
+
+        self.client.post(
+            "/import/places?chunk_size=5", data=data, headers=self.headers
+        )
+
+        self.assertEqual(Place.query.count(), 50)
+        self.assertEqual(
+            len([sql for sql in statements if "FROM users" in sql]), 1
+        )
+
+    def test_invalid(self):
+        """Unknown models and fields, and non admins are rejected"""
+        response = self.client.post(
+            "/import/countries", data="", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post(
+            "/import/amenities", data='{"name": "A", "color": "red"}\n',
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown fields: color", response.json["message"])
+
+        response = self.client.post("/import/amenities", data="")
+        self.assertEqual(response.status_code, 401)
+
+    def test_command(self):
+        """flask import reports progress and resumes from a checkpoint"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        path = os.path.join(directory.name, "users.ndjson")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.ndjson([
+                {"email": f"{i}@example.com", "first_name": "A",
+                 "last_name": "B", "username": f"user{i}",
+                 "password_hash": "x"}
+                for i in range(5)
+            ]))
+        with open(path + ".checkpoint", "w", encoding="utf-8") as f:
+            f.write("2")
+
+        result = self.app.test_cli_runner().invoke(
+            import_command, ["users", path, "--chunk-size", "2"]
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Resuming after 2 records", result.output)
+        self.assertIn("Imported 3 users", result.output)
+        self.assertEqual(User.query.count(), 4)
+        self.assertFalse(os.path.exists(path + ".checkpoint"))
+
+
+class TestRatings(ApiTestCase):
+    """Places are sorted and filtered by their ratings"""
+
+    def test_sort_and_filter(self):
+        """?sort=-rating puts the best rated first, ?min_rating filters"""
+        places = Place.create_many([self.place_data(i) for i in range(3)])
+        ids = [place.id for place in places]
+
+        for place_id, rating in [(ids[0], 2), (ids[1], 5), (ids[1], 4)]:
+            response = self.client.post(
+                f"/places/{place_id}/reviews",
+                json={"user_id": self.user.id, "comment": "Hi",
+                      "rating": rating},
+            )
+            self.assertEqual(response.status_code, 201)
+
+        response = self.client.get("/places?sort=-rating&fields=id")
+        self.assertEqual(
+            [item["id"] for item in response.json["items"]],
+            [ids[1], ids[0], ids[2]],
+        )
+
+        response = self.client.get("/places?min_rating=3&min_reviews=2")
+        self.assertEqual(len(response.json["items"]), 1)
+        self.assertEqual(response.json["items"][0]["avg_rating"], 4.5)
+        self.assertEqual(response.json["items"][0]["review_count"], 2)
+
+        self.assertEqual(
+            self.client.get("/places?min_rating=high").status_code, 400
+        )
+        response = self.client.put(
+            f"/places/{ids[0]}", json={"avg_rating": 5}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_ratings(self):
+        """Ratings that aren't numbers are rejected, numeric strings are
+        converted"""
+        place = Place.create_many([self.place_data()])[0]
+        url = f"/places/{place.id}/reviews"
+        data = {"user_id": self.user.id, "comment": "Hi"}
+
+        for rating in ("abc", [5], True):
+            with self.subTest(rating=rating):
+                response = self.client.post(url, json=data | {
+                    "rating": rating
+                })
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, json=data | {"rating": "5"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["rating"], 5.0)
+        review_id = response.json["id"]
+
+        response = self.client.put(
+            f"/reviews/{review_id}", json={"rating": "high"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.put(f"/reviews/{review_id}", json={
+            "rating": "3"
+        })
+        self.assertEqual(response.status_code, 200)
+        place = Place.get(place.id)
+        self.assertEqual((place.review_count, place.avg_rating), (1, 3.0))
+
+    def test_repair_command(self):
+        """flask repair-ratings reports how many places it repaired"""
+        result = self.app.test_cli_runner().invoke(repair_ratings_command)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Repaired 0 places", result.output)
+
+
+class TestPlaceAmenities(ApiTestCase):
+    """The amenities of a place, and places with all of some amenities"""
+
+    def setUp(self):
+        """Three places and three amenities"""
+        super().setUp()
+
+        self.places = [
+            place.id
+            for place in Place.create_many(
+                [self.place_data(i) for i in range(3)]
+            )
+        ]
+        self.amenities = {
+            name: Amenity.create({"name": name}).id
+            for name in ("wifi", "pool", "parking")
+        }
+
+    def add(self, place_id: str, name: str):
+        """Adds an amenity to a place"""
+        return self.client.post(
+            f"/places/{place_id}/amenities",
+            json={"amenity_id": self.amenities[name]},
+        )
+
+    def test_crud(self):
+        """Amenities are added, listed, read and removed"""
+        url = f"/places/{self.places[0]}/amenities"
+
+        response = self.add(self.places[0], "wifi")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["name"], "wifi")
+        self.assertEqual(self.add(self.places[0], "wifi").status_code, 400)
+        self.add(self.places[0], "pool")
+
+        response = self.client.get(url + "?fields=name")
+        self.assertEqual(
+            sorted(item["name"] for item in response.json["items"]),
+            ["pool", "wifi"],
+        )
+
+        wifi = self.amenities["wifi"]
+        self.assertEqual(self.client.get(f"{url}/{wifi}").status_code, 200)
+        self.assertEqual(self.client.delete(f"{url}/{wifi}").status_code, 204)
+        self.assertEqual(self.client.get(f"{url}/{wifi}").status_code, 404)
+        self.assertEqual(self.client.delete(f"{url}/{wifi}").status_code, 404)
+
+        response = self.client.put(url, json={"amenity_ids": [
+            self.amenities["parking"], self.amenities["wifi"]
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(item["name"] for item in response.json["items"]),
+            ["parking", "wifi"],
+        )
+        self.assertEqual(PlaceAmenity.query.count(), 2)
+
+    def test_not_found(self):
+        """Unknown places and amenities are not found"""
+        self.assertEqual(
+            self.client.get("/places/missing/amenities").status_code, 404
+        )
+        response = self.client.post(
+            f"/places/{self.places[0]}/amenities",
+            json={"amenity_id": "missing"},
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.put(
+            f"/places/{self.places[0]}/amenities",
+            json={"amenity_ids": ["missing"]},
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_has_all(self):
+        """?amenities= keeps the places with every amenity, by name or
+        id"""
+        for place_id, names in zip(self.places, [
+            ("wifi", "pool", "parking"), ("wifi", "pool"), ("wifi",)
+        ]):
+            for name in names:
+                self.add(place_id, name)
+
+        for value, expected in [
+            ("wifi", self.places),
+            ("wifi,pool", self.places[:2]),
+            (f"wifi,pool,{self.amenities['parking']}", self.places[:1]),
+            ("wifi,sauna", []),
+        ]:
+            with self.subTest(value=value):
+                response = self.client.get(
+                    "/places", query_string={"amenities": value}
+                )
+                self.assertEqual(
+                    sorted(item["id"] for item in response.json["items"]),
+                    sorted(expected),
+                )
+
+    def test_filter_follows_changes(self):
+        """The filter isn't answered from a stale cache or ETag"""
+        cache.configure({"Place": {"max_size": 10, "ttl": 60}})
+        self.addCleanup(cache.configure, {})
+        self.add(self.places[0], "wifi")
+
+        response = self.client.get("/places?amenities=wifi")
+        self.assertEqual(len(response.json["items"]), 1)
+        etag = response.headers["ETag"]
+
+        self.client.delete(
+            f"/places/{self.places[0]}/amenities/{self.amenities['wifi']}"
+        )
+        self.add(self.places[1], "wifi")
+
+        response = self.client.get(
+            "/places?amenities=wifi", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["items"][0]["id"], self.places[1])
+
+    def test_index(self):
+        """Each amenity is read from the (amenity_id, place_id) index"""
+        query = Place.search(amenities="wifi,pool")
+        sql = str(query.statement.compile(
+            db.engine, compile_kwargs={"literal_binds": True}
+        ))
+
+        plan = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"))
+
+        self.assertIn(
+            "COVERING INDEX ix_place_amenities_amenity_id_place_id",
+            " ".join(row[-1] for row in plan),
+        )
+
+
+class TestSearch(ApiTestCase):
+    """Full-text search over places and reviews"""
+
+    def setUp(self):
+        """A few places and a review"""
+        super().setUp()
+
+        self.places = {
+            name: Place.create(self.place_data() | {
+                "name": name, "description": description,
+                "address": address,
+            }).id
+            for name, description, address in [
+                ("Beach house", "Wifi and a pool by the sea", "Rambla 1"),
+                ("City flat", "Fast wifi, close to the café", "Centro 2"),
+                ("Farm", "Quiet, no internet", "Ruta 5"),
+            ]
+        }
+        self.review = Review.create({
+            "place_id": self.places["Farm"], "user_id": self.user.id,
+            "comment": "Loved the wildflowers", "rating": 5,
+        }).id
+
+    def search(self, **params) -> list[dict]:
+        """Returns the results of a search"""
+        response = self.client.get("/search", query_string=params)
+        self.assertEqual(response.status_code, 200, response.json)
+
+        return response.json["items"]
+
+    def test_ranking_and_snippets(self):
+        """Every term must match, better matches first, marked"""
+        items = self.search(q="wifi")
+
+        self.assertEqual(
+            {item["object"]["name"] for item in items},
+            {"Beach house", "City flat"},
+        )
+        self.assertTrue(items[0]["score"] >= items[1]["score"] > 0)
+        self.assertIn("<mark>wifi</mark>", items[0]["snippet"].lower())
+
+        items = self.search(q="wifi pool")
+        self.assertEqual([item["object"]["name"] for item in items],
+                         ["Beach house"])
+
+        # Without accents, in any case, and no operators
+        self.assertEqual(len(self.search(q="CAFE")), 1)
+        self.assertEqual(self.search(q="house OR farm"), [])
+
+    def test_prefix_and_types(self):
+        """Terms ending with * are prefixes, ?type= filters"""
+        items = self.search(q="wi*")
+        self.assertEqual(
+            {item["type"] for item in items}, {"place", "review"}
+        )
+        self.assertEqual(len(items), 3)
+
+        items = self.search(q="wi*", type="review")
+        self.assertEqual([item["object"]["id"] for item in items],
+                         [self.review])
+        self.assertIn("<mark>wildflowers</mark>", items[0]["snippet"])
+
+    def test_snippets_are_escaped(self):
+        """The text of snippets is escaped, only the marks are HTML"""
+        Review.create({
+            "place_id": self.places["Farm"], "user_id": self.user.id,
+            "comment": "<script>alert('sauna')</script> & sauna",
+            "rating": 4,
+        })
+
+        snippet = self.search(q="sauna")[0]["snippet"]
+
+        self.assertEqual(
+            snippet,
+            "&lt;script&gt;alert('<mark>sauna</mark>')&lt;/script&gt; "
+            "&amp; <mark>sauna</mark>",
+        )
+
+    def test_sync(self):
+        """Creates, updates and deletes are searchable right away"""
+        Place.update(self.places["Farm"], {"name": "Sauna retreat"})
+        self.assertEqual(len(self.search(q="sauna")), 1)
+        self.assertEqual(len(self.search(q="farm")), 0)
+
+        Review.delete(self.review)
+        self.assertEqual(self.search(q="wildflowers"), [])
+
+    def test_bulk_delete(self):
+        """Bulk deletes remove their rows, so pages aren't cut short"""
+        Place.delete_many([self.places["Beach house"]])
+
+        self.assertEqual(len(self.search(q="wifi")), 1)
+        rows = db.session.execute(db.text(
+            "SELECT count(*) FROM search_index WHERE object_id = :id"
+        ), {"id": self.places["Beach house"]}).scalar()
+        self.assertEqual(rows, 0)
+
+    def test_pagination(self):
+        """Results are paginated with cursors"""
+        Place.create_many([
+            self.place_data(i) | {"description": f"Wifi number {i}"}
+            for i in range(7)
+        ])
+
+        pages = self.walk("/search", 3, {"q": "wifi"})
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 3])
+        ids = [item["object"]["id"] for page in pages for item in page]
+        self.assertEqual(len(set(ids)), 9)
+        scores = [item["score"] for page in pages for item in page]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_invalid(self):
+        """Missing queries, unknown types and bad cursors are rejected"""
+        for params in ({}, {"q": " "}, {"q": "!!"}, {"q": "a", "type": "x"},
+                       {"q": "a", "cursor": "WzFd"}):
+            with self.subTest(params=params):
+                response = self.client.get("/search", query_string=params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_without_the_index(self):
+        """Without the index the text is scanned, with the same results,
+        until it is created again"""
+        expected = self.search(q="wi*")
+
+        db.session.execute(db.text("DROP TABLE search_index"))
+        db.session.commit()
+        full_text.indexed.clear()
+
+        def hits(items: list[dict]) -> set:
+            """The objects and snippets of results"""
+            return {
+                (item["type"], item["object"]["id"], item["snippet"])
+                for item in items
+            }
+
+        for _ in range(2):
+            scanned = self.search(q="wi*")
+            self.assertEqual(hits(scanned), hits(expected))
+        self.assertEqual(
+            [item for page in self.walk("/search", 1, {"q": "wi*"})
+             for item in page],
+            scanned,
+        )
+
+        self.app.test_cli_runner().invoke(rebuild_search_command)
+
+        self.assertIsNotNone(full_text.indexed.get(db.engine))
+        self.assertEqual(self.search(q="wi*"), expected)
+
+    def test_rebuild(self):
+        """rebuild-search indexes everything again"""
+        db.session.execute(db.text("DELETE FROM search_index"))
+        db.session.commit()
+        self.assertEqual(self.search(q="wifi"), [])
+
+        result = self.app.test_cli_runner().invoke(rebuild_search_command)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Indexed 3 places and 1 reviews", result.output)
+        self.assertEqual(len(self.search(q="wifi")), 2)
+
+
+class TestCompression(ApiTestCase):
+    """Text responses are compressed with the encoding clients accept"""
+
+    def setUp(self):
+        """Create enough places for a body worth compressing"""
+        super().setUp()
+        Place.create_many([self.place_data(i) for i in range(50)])
+        compression.configure(256)
+
+    def decode(self, encoding: str, data: bytes) -> bytes:
+        """Decompresses a body"""
+        if encoding == "zstd":
+            return compression.zstandard.ZstdDecompressor().decompressobj(
+            ).decompress(data)
+        if encoding == "br":
+            return compression.brotli.decompress(data)
+
+        wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+        return zlib.decompress(data, wbits)
+
+    def test_every_encoding(self):
+        """Every available encoding gives back the same body"""
+        expected = self.client.get("/places").data
+
+        for encoding in compression.ENCODERS:
+            with self.subTest(encoding=encoding):
+                response = self.client.get(
+                    "/places", headers={"Accept-Encoding": encoding}
+                )
+
+                self.assertEqual(
+                    response.headers["Content-Encoding"], encoding
+                )
+                self.assertIn("Accept-Encoding", response.vary)
+                self.assertLess(len(response.data), len(expected) / 4)
+                self.assertEqual(
+                    self.decode(encoding, response.data), expected
+                )
+
+    def test_negotiation(self):
+        """The quality of the encodings is honored, and bodies aren't
+        compressed without an acceptable one"""
+        cases = {
+            "gzip;q=0.5, deflate": "deflate",
+            "deflate;q=0.1, gzip": "gzip",
+            "gzip;q=0, identity": None,
+            "": None,
+        }
+
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                response = self.client.get(
+                    "/places", headers={"Accept-Encoding": header}
+                )
+
+                self.assertEqual(
+                    response.headers.get("Content-Encoding"), expected
+                )
+                self.assertIn("Accept-Encoding", response.vary)
+
+    def test_small_bodies(self):
+        """Bodies under COMPRESSION_MIN_SIZE are sent as they are"""
+        response = self.client.get(
+            "/countries/UY", headers={"Accept-Encoding": "gzip"}
+        )
+
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.json["code"], "UY")
+
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+        response = self.client.get(
+            "/countries/UY", headers={"Accept-Encoding": "gzip"}
+        )
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_revalidation(self):
+        """Compressed responses have a weak ETag that revalidates both
+        versions"""
+        place = Place.query.first()
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+
+        for url in ("/places", f"/places/{place.id}",
+                    f"/places/{place.id}?include=city"):
+            with self.subTest(url=url):
+                plain = self.client.get(url).headers["ETag"]
+                response = self.client.get(
+                    url, headers={"Accept-Encoding": "gzip"}
+                )
+                etag = response.headers["ETag"]
+
+                self.assertEqual(etag, "W/" + plain.removeprefix("W/"))
+
+                for match, encoding in ((etag, "gzip"), (etag, ""),
+                                        (plain, "gzip")):
+                    response = self.client.get(url, headers={
+                        "If-None-Match": match, "Accept-Encoding": encoding,
+                    })
+                    self.assertEqual(response.status_code, 304)
+                    self.assertIn("Accept-Encoding", response.vary)
+                    # The one of the version the client has
+                    self.assertEqual(response.headers["ETag"], match)
+
+    def test_uncompressed_etag(self):
+        """Bodies sent as they are keep their ETag"""
+        place = Place.query.first()
+        url = f"/places/{place.id}"
+        plain = self.client.get(url).headers["ETag"]
+
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.vary)
+        self.assertEqual(response.headers["ETag"], plain)
+        self.assertFalse(plain.startswith("W/"))
+
+    def test_cached_bodies(self):
+        """Repeated hits of the same version aren't compressed again"""
+        headers = {"Accept-Encoding": "gzip"}
+        first = self.client.get("/places", headers=headers).data
+        hits = compression.bodies.hits
+
+        self.assertEqual(self.client.get("/places", headers=headers).data,
+                         first)
+        self.assertEqual(compression.bodies.hits, hits + 1)
+
+        Place.update(Place.query.first().id, {"name": "Renamed"})
+        response = self.client.get("/places", headers=headers)
+
+        self.assertEqual(compression.bodies.hits, hits + 1)
+        self.assertIn(b"Renamed", self.decode("gzip", response.data))
+
+    def test_streaming(self):
+        """Streamed responses are compressed chunk by chunk, and every
+        chunk can be decoded as soon as it arrives"""
+        Place.create_many([self.place_data(i) for i in range(250)])
+        expected = self.client.get("/places?stream=true").data
+
+        response = self.client.get(
+            "/places?stream=true", buffered=False,
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = [decoder.decompress(chunk) for chunk in response.response]
+        response.close()
+
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith(b'{"items":['))
+        self.assertEqual(b"".join(chunks), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,488 @@
+""" Tests for the models on top of SQLAlchemy """
+
+from datetime import datetime
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from src import db
+from src.models import cache
+from src.models.amenity import Amenity
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.serializers import cached_serializer, serializer
+from src.models.review import Review
+from src.models.cache import LRUCache
+from src.models.user import User
+
+
+class ModelTestCase(unittest.TestCase):
+    """Every test runs inside an app context with an empty database"""
+
+    def setUp(self):
+        """Create the tables in an in-memory database"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.country = Country.create("Uruguay", "UY")
+        self.city = City.create({"name": "Montevideo", "country_code": "UY"})
+        self.user = User(
+            email="host@example.com", first_name="Host", last_name="User",
+            username="host", password_hash="x",
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """Drop the database"""
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def place_data(self, i: int = 0) -> dict:
+        """Data to create a place"""
+        return {
+            "name": f"Place {i}", "city_id": self.city.id,
+            "host_id": self.user.id, "price_per_night": 100 + i,
+        }
+
+    def count_statements(self) -> list:
+        """Starts recording the statements sent to the database"""
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, many):
+            """Record a statement"""
+            statements.append(statement)
+
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", record
+        )
+
+        return statements
+
+
+class TestBulk(ModelTestCase):
+    """create_many, update_many and delete_many"""
+
+    def test_create_many(self):
+        """A batch is inserted in a single transaction"""
+        statements = self.count_statements()
+
+        places = Place.create_many([self.place_data(i) for i in range(50)])
+
+        self.assertEqual(len(places), 50)
+        self.assertEqual(Place.query.count(), 50)
+        inserts = [s for s in statements if s.startswith("INSERT")]
+        self.assertLess(len(inserts), 5)
+
+    def test_create_many_validates_references(self):
+        """Nothing is written when one item references a missing row"""
+        data = [self.place_data(i) for i in range(3)]
+        data[1]["city_id"] = "missing"
+
+        with self.assertRaisesRegex(ValueError, "City with id missing"):
+            Place.create_many(data)
+
+        self.assertEqual(Place.query.count(), 0)
+
+    def test_create_many_validates_unique_fields(self):
+        """Repeated and taken unique values are rejected"""
+        data = [
+            {"email": "a@example.com", "first_name": "A", "last_name": "A",
+             "username": "a", "password": "secret"},
+            {"email": "a@example.com", "first_name": "B", "last_name": "B",
+             "username": "b", "password": "secret"},
+        ]
+
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            User.create_many(data)
+
+        data[1]["email"] = self.user.email
+        data[1]["username"] = "c"
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            User.create_many(data)
+
+    def test_update_many(self):
+        """Every object of the batch is updated, or none"""
+        places = Place.create_many([self.place_data(i) for i in range(3)])
+
+        with self.assertRaises(ValueError):
+            Place.update_many([
+                {"id": places[0].id, "name": "Changed"},
+                {"id": "missing", "name": "Changed"},
+            ])
+        db.session.rollback()
+        self.assertEqual(Place.get(places[0].id).name, "Place 0")
+
+        updated = Place.update_many(
+            [{"id": place.id, "name": "Changed"} for place in places]
+        )
+        self.assertEqual([p.name for p in updated], ["Changed"] * 3)
+
+    def test_update_many_validates_unique_fields(self):
+        """Repeated and taken unique values are rejected, an object may
+        keep its own"""
+        other = User.create_many([
+            {"email": "b@example.com", "first_name": "B", "last_name": "B",
+             "username": "b", "password": "secret"},
+        ])[0]
+
+        for data in (
+            [{"id": other.id, "email": self.user.email}],
+            [
+                {"id": self.user.id, "email": "c@example.com"},
+                {"id": other.id, "email": "c@example.com"},
+            ],
+        ):
+            with self.assertRaisesRegex(ValueError, "already exists"):
+                User.update_many(data)
+            db.session.rollback()
+
+        self.assertEqual(User.get(other.id).email, "b@example.com")
+
+        User.update_many([
+            {"id": self.user.id, "email": self.user.email},
+            {"id": other.id, "email": "c@example.com"},
+        ])
+        self.assertEqual(User.get(other.id).email, "c@example.com")
+
+    def test_update_many_validates_fields(self):
+        """Timestamps and computed fields can't be set"""
+        place = Place.create_many([self.place_data(0)])[0]
+
+        for key, value in (
+            ("created_at", datetime(2000, 1, 1)),
+            ("avg_rating", 5.0),
+            ("geohash", "s00000000000"),
+            ("unknown", 1),
+        ):
+            with self.assertRaisesRegex(ValueError, f"{key} can't be set"):
+                Place.update_many([{"id": place.id, key: value}])
+            db.session.rollback()
+
+        self.assertEqual(Place.get(place.id).avg_rating, 0.0)
+
+    def test_delete_many(self):
+        """Returns how many objects were deleted"""
+        places = Place.create_many([self.place_data(i) for i in range(3)])
+        review = Review.create_many([{
+            "place_id": places[0].id, "user_id": self.user.id,
+            "comment": "Nice", "rating": 5,
+        }])[0]
+
+        self.assertEqual(
+            Place.delete_many([places[1].id, places[2].id, "missing"]), 2
+        )
+        self.assertEqual(Place.query.count(), 1)
+        self.assertEqual(Review.delete_many([review.id]), 1)
+
+
+class TestLRUCache(unittest.TestCase):
+    """Size bound, LRU eviction, TTL and counters"""
+
+    def setUp(self):
+        """A small cache on a fake clock"""
+        self.now = 0.0
+        self.cache = LRUCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_evicts_least_recently_used(self):
+        """Reading a key keeps it, the other one is evicted"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_ttl(self):
+        """Entries expire ttl seconds after they are stored"""
+        self.cache.set("a", 1)
+        self.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_counters(self):
+        """Hits and misses are counted"""
+        self.cache.get("a")
+        self.cache.set("a", 1)
+        self.cache.get("a")
+        self.cache.get("a")
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    def test_stale_generation(self):
+        """A value read before an invalidation isn't stored after it"""
+        generation = self.cache.generation
+        self.cache.invalidate()
+        self.cache.set("a", 1, generation)
+
+        self.assertIsNone(self.cache.get("a"))
+
+
+class TestReadCache(ModelTestCase):
+    """Cached reads don't query, writes invalidate them"""
+
+    def setUp(self):
+        """Enable the cache of some models"""
+        super().setUp()
+        cache.configure({
+            name: {"max_size": 100, "ttl": 60}
+            for name in ("Amenity", "Country", "City", "Place")
+        })
+        self.addCleanup(cache.configure, {})
+
+    def test_get_hits_the_cache(self):
+        """The second lookup of an object doesn't query"""
+        place = Place.create(self.place_data())
+        Place.get(place.id)
+        db.session.remove()
+
+        statements = self.count_statements()
+        found = Place.get(place.id)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(found.name, "Place 0")
+        self.assertIs(found, db.session.get(Place, place.id))
+        self.assertEqual(cache.stats()["Place"]["hits"], 1)
+
+    def test_country_lookups(self):
+        """Countries by code and every country are cached"""
+        Country.get("UY")
+        Country.get_all()
+        statements = self.count_statements()
+
+        self.assertEqual(Country.get("UY").name, "Uruguay")
+        self.assertEqual([c.code for c in Country.get_all()], ["UY"])
+        self.assertIsNone(Country.get("AR"))
+        self.assertEqual(len(statements), 1)
+
+        Country.create("Argentina", "AR")
+        self.assertEqual(Country.get("AR").name, "Argentina")
+        self.assertEqual(len(Country.get_all()), 2)
+
+    def test_update_invalidates(self):
+        """Updating an object is seen by the next read"""
+        amenity_id = Amenity.create({"name": "Wifi"}).id
+        self.assertEqual(len(Amenity.get_all()), 1)
+        Amenity.get(amenity_id)
+
+        Amenity.update(amenity_id, {"name": "Pool"})
+        db.session.remove()
+
+        self.assertEqual(Amenity.get(amenity_id).name, "Pool")
+        self.assertEqual(Amenity.get_all()[0].name, "Pool")
+
+    def test_delete_invalidates(self):
+        """Deleted objects are gone, bulk deletes too"""
+        places = Place.create_many([self.place_data(i) for i in range(3)])
+        self.assertEqual(len(Place.get_all()), 3)
+
+        Place.delete(places[0].id)
+        self.assertIsNone(Place.get(places[0].id))
+        self.assertEqual(len(Place.get_all()), 2)
+
+        Place.delete_many([place.id for place in places[1:]])
+        self.assertEqual(Place.get_all(), [])
+
+    def test_pages(self):
+        """Pages of a query on the model are cached and invalidated"""
+        Place.create_many([self.place_data(i) for i in range(3)])
+        query = Place.query.filter_by(city_id=self.city.id)
+        Place.paginate(2, query=query)
+
+        statements = self.count_statements()
+        places, after = Place.paginate(2, query=query)
+        self.assertEqual(statements, [])
+        self.assertEqual(len(places), 2)
+
+        Place.create(self.place_data(3))
+        places, _ = Place.paginate(10, after, query=query)
+        self.assertEqual(len(places), 2)
+
+    def test_joins_are_not_cached(self):
+        """A query reading other tables isn't cached, their writes
+        wouldn't invalidate it"""
+        Place.create(self.place_data())
+        query = Place.search(country_code="UY")
+        Place.paginate(10, query=query)
+
+        statements = self.count_statements()
+        Place.paginate(10, query=query)
+
+        self.assertEqual(len(statements), 1)
+
+    def test_rollback(self):
+        """What an open transaction reads isn't cached"""
+        amenity = Amenity.create({"name": "Wifi"})
+        amenity.name = "Pool"
+        db.session.flush()
+        self.assertEqual(Amenity.get_all()[0].name, "Pool")
+
+        db.session.rollback()
+
+        self.assertEqual(Amenity.get_all()[0].name, "Wifi")
+
+
+class TestSerializers(ModelTestCase):
+    """The compiled serializers"""
+
+    def test_every_public_column(self):
+        """Every column but the hidden ones, timestamps as isoformat"""
+        place = Place.create(
+            self.place_data() | {"latitude": -34.9, "longitude": -56.1}
+        )
+
+        data = place.to_dict()
+
+        self.assertNotIn("geohash", data)
+        self.assertEqual(data["latitude"], -34.9)
+        self.assertEqual(data["created_at"], place.created_at.isoformat())
+        self.assertEqual(
+            set(self.user.to_dict()),
+            {"id", "email", "first_name", "last_name", "created_at",
+             "updated_at", "is_admin"},
+        )
+        self.assertEqual(
+            self.country.to_dict(),
+            {"id": self.country.id, "name": "Uruguay", "code": "UY"},
+        )
+
+    def test_expired_objects(self):
+        """Columns that aren't loaded are loaded"""
+        place = Place.create(self.place_data())
+        db.session.expire(place)
+
+        self.assertEqual(place.to_dict()["name"], "Place 0")
+
+    def test_fields(self):
+        """A serializer of some fields, compiled once"""
+        place = Place.create(self.place_data())
+
+        compiled = serializer(Place, ("id", "name"))
+
+        self.assertEqual(compiled(place), {"id": place.id, "name": "Place 0"})
+        self.assertIs(serializer(Place, ("id", "name")), compiled)
+
+    def test_field_order(self):
+        """Every order of the same fields shares one serializer"""
+        place = Place.create(self.place_data())
+        cached_serializer.cache_clear()
+
+        first = serializer(Place, ("name", "id"))
+
+        self.assertIs(serializer(Place, ("id", "name")), first)
+        self.assertEqual(cached_serializer.cache_info().currsize, 1)
+        self.assertEqual(first(place), {"id": place.id, "name": "Place 0"})
+
+
+class TestRatings(ModelTestCase):
+    """The rating aggregates of the places follow their reviews"""
+
+    def setUp(self):
+        """Two places to review"""
+        super().setUp()
+
+        self.place, self.other = Place.create_many(
+            [self.place_data(i) for i in range(2)]
+        )
+        self.ids = self.place.id, self.other.id
+
+    def review(self, rating: float, place_id: str | None = None) -> Review:
+        """Creates a review"""
+        return Review.create({
+            "place_id": place_id or self.ids[0], "user_id": self.user.id,
+            "comment": "Nice", "rating": rating,
+        })
+
+    def aggregates(self, place_id: str | None = None) -> tuple:
+        """The stored aggregates of a place"""
+        place = db.session.get(Place, place_id or self.ids[0])
+        db.session.refresh(place)
+
+        return place.review_count, place.rating_sum, place.avg_rating
+
+    def test_create_update_delete(self):
+        """Every write of a review updates its place"""
+        self.assertEqual(self.aggregates(), (0, 0.0, 0.0))
+
+        review = self.review(5)
+        self.review(4)
+        self.assertEqual(self.aggregates(), (2, 9.0, 4.5))
+        self.assertEqual(self.place.to_dict()["avg_rating"], 4.5)
+
+        Review.update(review.id, {"rating": 2})
+        self.assertEqual(self.aggregates(), (2, 6.0, 3.0))
+
+        Review.update(review.id, {"place_id": self.ids[1]})
+        self.assertEqual(self.aggregates(), (1, 4.0, 4.0))
+        self.assertEqual(self.aggregates(self.ids[1]), (1, 2.0, 2.0))
+
+        Review.delete(review.id)
+        self.assertEqual(self.aggregates(self.ids[1]), (0, 0.0, 0.0))
+
+    def test_bulk(self):
+        """So do the bulk methods"""
+        reviews = Review.create_many([
+            {"place_id": place_id, "user_id": self.user.id,
+             "comment": "Nice", "rating": rating}
+            for place_id, rating in [
+                (self.ids[0], 1), (self.ids[0], 2), (self.ids[1], 5)
+            ]
+        ])
+        self.assertEqual(self.aggregates(), (2, 3.0, 1.5))
+
+        Review.update_many([{"id": reviews[0].id, "rating": 4}])
+        self.assertEqual(self.aggregates(), (2, 6.0, 3.0))
+
+        Review.delete_many([review.id for review in reviews[1:]])
+        self.assertEqual(self.aggregates(), (1, 4.0, 4.0))
+        self.assertEqual(self.aggregates(self.ids[1]), (0, 0.0, 0.0))
+
+    def test_rollback(self):
+        """A review that isn't committed isn't counted"""
+        db.session.add(Review(self.ids[0], self.user.id, "Nice", 5))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(self.aggregates(), (0, 0.0, 0.0))
+
+    def test_not_set_by_clients(self):
+        """Updates of a place can't set them"""
+        with self.assertRaises(ValueError):
+            Place.update(self.ids[0], {"review_count": 10})
+
+    def test_repair(self):
+        """Places that drifted are recomputed, the others left alone"""
+        self.review(5)
+        self.review(3)
+        db.session.execute(
+            db.update(Place).where(Place.id == self.ids[0]).values(
+                review_count=7, rating_sum=1.0, avg_rating=0.5
+            )
+        )
+        db.session.commit()
+
+        self.assertEqual(Place.repair_ratings(), 1)
+        self.assertEqual(self.aggregates(), (2, 8.0, 4.0))
+        self.assertEqual(self.aggregates(self.ids[1]), (0, 0.0, 0.0))
+        self.assertEqual(Place.repair_ratings(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
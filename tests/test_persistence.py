@@ -0,0 +1,1210 @@
+""" Tests for the repositories in the persistence package """
+
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import unittest
+import uuid
+
+from src.models.review import Review
+from src.persistence.concurrent import ConcurrentRepository, RWLock
+from src.persistence.db import DBRepository
+from src.persistence.file import FileRepository
+from src.persistence.flusher import WriteBehind
+from src.persistence.indexes import TEXT_INDEXES, SecondaryIndexes
+from src.persistence.memory import MemoryRepository
+from src.persistence.pickled import PickleRepository
+from src.persistence.repository import Repository
+from src.persistence.streaming import (
+    iter_record_texts,
+    iter_records,
+    write_records,
+)
+from utils.text import TextIndex, parse_query, snippet
+
+
+def make_review(
+    comment: str = "Nice place", place_id: str = "place", user_id="user"
+) -> Review:
+    """Builds a review with a fresh id"""
+    return Review(
+        place_id=place_id, user_id=user_id, comment=comment, rating=4.0,
+        id=str(uuid.uuid4()),
+    )
+
+
+class TestMemoryRepository(unittest.TestCase):
+    """MemoryRepository keeps objects indexed by id"""
+
+    def setUp(self):
+        """Every test starts without reviews"""
+        self.repo = MemoryRepository()
+        for review in self.repo.get_all("review"):
+            self.repo.delete(review)
+
+    def test_get_all_keeps_insertion_order(self):
+        """get_all returns objects in the order they were saved"""
+        reviews = [make_review(str(i)) for i in range(5)]
+        for review in reviews:
+            self.repo.save(review)
+
+        self.assertEqual(self.repo.get_all("review"), reviews)
+
+    def test_get(self):
+        """get finds objects by id and returns None for unknown ids"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertIs(self.repo.get("review", review.id), review)
+        self.assertIsNone(self.repo.get("review", "missing"))
+        self.assertIsNone(self.repo.get("unknown", review.id))
+
+    def test_update(self):
+        """update replaces stored objects and ignores unknown ones"""
+        review = make_review()
+        self.repo.save(review)
+
+        updated = make_review("Updated")
+        updated.id = review.id
+
+        self.assertIs(self.repo.update(updated), updated)
+        self.assertIs(self.repo.get("review", review.id), updated)
+        self.assertIsNotNone(updated.updated_at)
+        self.assertIsNone(self.repo.update(make_review()))
+
+    def test_delete(self):
+        """delete removes objects once"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertTrue(self.repo.delete(review))
+        self.assertFalse(self.repo.delete(review))
+        self.assertIsNone(self.repo.get("review", review.id))
+
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    """Runs every test inside an empty temporary directory"""
+
+    def setUp(self):
+        """Move to a new temporary directory"""
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        """Go back to the original directory"""
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+
+class TestFileRepositoryJournal(TemporaryDirectoryTestCase):
+    """FileRepository in journaled mode"""
+
+    def read_journal(self) -> list[dict]:
+        """Returns the entries currently in the journal"""
+        with open("data.jsonl") as file:
+            return [json.loads(line) for line in file]
+
+    def test_mutations_append_to_journal(self):
+        """save, update and delete only append to the journal"""
+        repo = FileRepository(journaled=True)
+        with open("data.json") as file:
+            snapshot = file.read()
+
+        review = make_review()
+        repo.save(review)
+        repo.update(review)
+        repo.delete(review)
+
+        with open("data.json") as file:
+            self.assertEqual(file.read(), snapshot)
+        self.assertEqual(
+            [entry["op"] for entry in self.read_journal()],
+            ["save", "update", "delete"],
+        )
+
+    def test_reload_replays_journal(self):
+        """A new repository sees the snapshot plus the journal"""
+        repo = FileRepository(journaled=True)
+        kept, deleted = make_review("kept"), make_review("deleted")
+        repo.save(kept)
+        repo.save(deleted)
+        repo.delete(deleted)
+        kept.comment = "edited"
+        repo.update(kept)
+
+        repo = FileRepository(journaled=True)
+
+        self.assertEqual(repo.get("review", kept.id).comment, "edited")
+        self.assertIsNone(repo.get("review", deleted.id))
+        self.assertEqual(len(repo.get_all("country")), 1)
+
+    def test_partial_last_line_is_ignored(self):
+        """A torn append at the end of the journal is discarded"""
+        repo = FileRepository(journaled=True)
+        review = make_review()
+        repo.save(review)
+
+        with open("data.jsonl", "a") as file:
+            file.write('{"op": "delete", "mod')
+
+        repo = FileRepository(journaled=True)
+
+        self.assertIsNotNone(repo.get("review", review.id))
+
+    def test_compaction(self):
+        """The journal is folded into the snapshot past the threshold"""
+        repo = FileRepository(journaled=True, compact_threshold=3)
+        reviews = [make_review(str(i)) for i in range(4)]
+        for review in reviews:
+            repo.save(review)
+
+        self.assertEqual(len(self.read_journal()), 1)
+        with open("data.json") as file:
+            self.assertEqual(len(json.load(file)["review"]), 3)
+
+        repo = FileRepository(journaled=True, compact_threshold=3)
+        self.assertEqual(len(repo.get_all("review")), 4)
+
+    def test_unjournaled_reload_folds_journal(self):
+        """Switching journaling off compacts the leftover journal"""
+        repo = FileRepository(journaled=True)
+        review = make_review()
+        repo.save(review)
+
+        repo = FileRepository()
+
+        self.assertEqual(self.read_journal(), [])
+        self.assertIsNotNone(repo.get("review", review.id))
+
+
+class TestWriteBehind(unittest.TestCase):
+    """WriteBehind flush policies"""
+
+    def setUp(self):
+        """Count the writes"""
+        self.writes = 0
+        self.written = threading.Event()
+
+    def write(self):
+        """Fake write"""
+        self.writes += 1
+        self.written.set()
+
+    def test_sync(self):
+        """Every mutation is written right away"""
+        flusher = WriteBehind(self.write)
+        flusher.mark_dirty()
+        flusher.mark_dirty()
+
+        self.assertEqual(self.writes, 2)
+
+    def test_on_shutdown(self):
+        """Mutations are only written on flush"""
+        flusher = WriteBehind(self.write, policy="on-shutdown")
+        for _ in range(10):
+            flusher.mark_dirty()
+
+        self.assertEqual((self.writes, flusher.pending), (0, 10))
+        flusher.flush()
+        flusher.flush()
+        self.assertEqual((self.writes, flusher.pending), (1, 0))
+
+    def test_batched_max_pending(self):
+        """The background flusher writes once enough mutations wait"""
+        flusher = WriteBehind(
+            self.write, policy="batched", interval_ms=60_000, max_pending=3
+        )
+        flusher.mark_dirty()
+        flusher.mark_dirty()
+        self.assertEqual(self.writes, 0)
+
+        flusher.mark_dirty()
+        self.assertTrue(self.written.wait(5))
+        flusher.close()
+        self.assertEqual(self.writes, 1)
+
+    def test_batched_interval(self):
+        """The background flusher writes every interval"""
+        flusher = WriteBehind(self.write, policy="batched", interval_ms=10)
+        flusher.mark_dirty()
+
+        self.assertTrue(self.written.wait(5))
+        flusher.close()
+        self.assertEqual(self.writes, 1)
+
+    def test_unknown_policy(self):
+        """Unknown policies are rejected"""
+        with self.assertRaises(ValueError):
+            WriteBehind(self.write, policy="sometimes")
+
+
+class TestWriteBehindRepositories(TemporaryDirectoryTestCase):
+    """File and pickle repositories with deferred writes"""
+
+    def test_file_repository(self):
+        """Journal entries are written on flush"""
+        repo = FileRepository(journaled=True, flush_policy="on-shutdown")
+        review = make_review()
+        repo.save(review)
+        repo.update(review)
+
+        self.assertFalse(os.path.exists("data.jsonl"))
+        repo.flush()
+        self.assertIsNotNone(
+            FileRepository(journaled=True).get("review", review.id)
+        )
+
+    def test_pickle_repository(self):
+        """The pickle file is written on flush"""
+        repo = PickleRepository(flush_policy="on-shutdown")
+        review = make_review()
+        repo.save(review)
+        self.assertEqual(len(PickleRepository().get_all("review")), 0)
+
+        repo.flush()
+        reloaded = PickleRepository().get("review", review.id)
+        self.assertEqual(reloaded.comment, review.comment)
+
+
+class TestStreamingReload(TemporaryDirectoryTestCase):
+    """FileRepository streams data.json and materializes lazily"""
+
+    def test_iter_records(self):
+        """Records are yielded in order whatever the chunk size"""
+        data = {
+            "country": [],
+            "review": [
+                {"id": str(i), "comment": 'tricky ]},{" \\ ñ' * i}
+                for i in range(20)
+            ],
+            "user": [{"id": "u", "nested": {"list": [1, 2.5, None]}}],
+        }
+        expected = [
+            (model, item) for model, items in data.items() for item in items
+        ]
+
+        for text in (json.dumps(data), json.dumps(data, indent=4)):
+            for chunk_size in (1, 7, 1 << 20):
+                records = list(iter_records(io.StringIO(text), chunk_size))
+
+                self.assertEqual(
+                    [(model, item) for model, item, _ in records], expected
+                )
+                for _, item, raw in records:
+                    self.assertEqual(json.loads(raw), item)
+
+    def test_iter_records_empty(self):
+        """Empty files and documents have no records"""
+        self.assertEqual(list(iter_records(io.StringIO(""))), [])
+        self.assertEqual(list(iter_records(io.StringIO(" {} "))), [])
+
+    def test_iter_records_invalid(self):
+        """Truncated documents raise"""
+        with self.assertRaises(ValueError):
+            list(iter_records(io.StringIO('{"review": [{"id": '), 4))
+
+    def test_iter_record_texts(self):
+        """Records written a line each come back without being decoded,
+        other layouts are decoded"""
+        data = {
+            "country": [],
+            "review": [
+                {"comment": 'tricky "id": "x" \n ñ' * i, "id": f"r\\{i}"}
+                for i in range(5)
+            ],
+        }
+        expected = [
+            (model, item) for model, items in data.items() for item in items
+        ]
+        written = io.StringIO()
+        write_records(written, [
+            (model, [json.dumps(item) for item in items])
+            for model, items in data.items()
+        ])
+
+        for text in (written.getvalue(), json.dumps(data),
+                     json.dumps(data, indent=4)):
+            records = list(iter_record_texts(io.StringIO(text)))
+
+            self.assertEqual(
+                [(model, json.loads(raw)) for model, _, raw in records],
+                expected,
+            )
+            self.assertEqual(
+                [obj_id for _, obj_id, _ in records],
+                [item["id"] for _, item in expected],
+            )
+            self.assertTrue(all("\n" not in raw for _, _, raw in records))
+
+        # Only the id is read
+        text = '{\n"review": [\n{"id": "a", "rating": ?}\n]\n}\n'
+        self.assertEqual(
+            list(iter_record_texts(io.StringIO(text))),
+            [("review", "a", '{"id": "a", "rating": ?}')],
+        )
+
+    def test_indexes_are_built_on_demand(self):
+        """find_by and search index a model the first time they need it,
+        including the changes made since the reload"""
+        repo = FileRepository()
+        kept, deleted = make_review("kept"), make_review("deleted")
+        repo.save_many([kept, deleted])
+
+        repo = FileRepository()
+        added = make_review("added", place_id=kept.place_id)
+        repo.save(added)
+        repo.delete(deleted)
+
+        self.assertIn("review", repo._FileRepository__unindexed)
+        self.assertEqual(
+            [review.id for review in repo.find_by(
+                "review", place_id=kept.place_id
+            )],
+            [kept.id, added.id],
+        )
+        self.assertNotIn("review", repo._FileRepository__unindexed)
+        self.assertEqual(
+            [review.id for review in repo.search("review", "added")],
+            [added.id],
+        )
+
+    def test_records_materialize_on_access(self):
+        """Records stay JSON text until they are accessed"""
+        repo = FileRepository()
+        first, second = make_review("first"), make_review("second")
+        repo.save(first)
+        repo.save(second)
+
+        repo = FileRepository()
+        stored = repo._FileRepository__data["review"]
+        self.assertEqual(
+            [type(obj) for obj in stored.values()], [str, str]
+        )
+
+        review = repo.get("review", second.id)
+        self.assertIsInstance(review, Review)
+        self.assertEqual(review.created_at, second.created_at)
+        self.assertIs(repo.get("review", second.id), review)
+        self.assertIs(type(stored[first.id]), str)
+
+        self.assertEqual(
+            [obj.comment for obj in repo.get_all("review")],
+            ["first", "second"],
+        )
+        self.assertIsInstance(stored[first.id], Review)
+
+    def test_untouched_records_are_saved(self):
+        """Records that were never accessed survive a rewrite"""
+        repo = FileRepository()
+        review = make_review()
+        repo.save(review)
+
+        repo = FileRepository()
+        repo.save(make_review())
+
+        repo = FileRepository()
+        self.assertEqual(
+            repo.get("review", review.id).comment, review.comment
+        )
+
+
+class TestDBRepository(TemporaryDirectoryTestCase):
+    """DBRepository on top of sqlite3"""
+
+    def setUp(self):
+        """Every test gets a new database"""
+        super().setUp()
+        self.repo = DBRepository()
+
+    def tearDown(self):
+        """Close the pool before the directory is removed"""
+        self.repo.close()
+        super().tearDown()
+
+    def test_reload_creates_dummy_country(self):
+        """A new database has the dummy country, only once"""
+        DBRepository().close()
+
+        countries = self.repo.get_all("country")
+        self.assertEqual([c.code for c in countries], ["UY"])
+        self.assertIsNotNone(countries[0].id)
+
+    def test_wal(self):
+        """The database runs in WAL mode"""
+        mode = self.repo.connection.execute("PRAGMA journal_mode")
+
+        self.assertEqual(mode.fetchone()[0], "wal")
+
+    def test_save_and_get(self):
+        """Saved objects come back with the same values"""
+        review = make_review()
+        self.repo.save(review)
+
+        stored = self.repo.get("review", review.id)
+        self.assertIsInstance(stored, Review)
+        self.assertEqual(stored.to_dict(), review.to_dict())
+        self.assertIsNone(self.repo.get("review", "missing"))
+        self.assertIsNone(self.repo.get("unknown", review.id))
+
+    def test_get_all_keeps_insertion_order(self):
+        """get_all returns objects in the order they were saved"""
+        reviews = [make_review(str(i)) for i in range(5)]
+        for review in reviews:
+            self.repo.save(review)
+
+        self.assertEqual(
+            [review.id for review in self.repo.get_all("review")],
+            [review.id for review in reviews],
+        )
+
+    def test_update(self):
+        """update changes stored rows and ignores unknown ones"""
+        review = make_review()
+        self.repo.save(review)
+        review.comment = "Updated"
+
+        self.assertIs(self.repo.update(review), review)
+        self.assertEqual(self.repo.get("review", review.id).comment, "Updated")
+        self.assertIsNone(self.repo.update(make_review()))
+
+    def test_delete(self):
+        """delete removes rows once"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertTrue(self.repo.delete(review))
+        self.assertFalse(self.repo.delete(review))
+        self.assertIsNone(self.repo.get("review", review.id))
+
+    def test_persists_between_instances(self):
+        """Another repository on the same file sees the data"""
+        review = make_review()
+        self.repo.save(review)
+
+        other = DBRepository()
+        self.assertEqual(other.get("review", review.id).id, review.id)
+        other.close()
+
+    def test_threads(self):
+        """Every thread writes through its own connection"""
+        reviews = [make_review(str(i)) for i in range(200)]
+
+        def save(chunk):
+            """Save a chunk of reviews"""
+            for review in chunk:
+                self.repo.save(review)
+
+        threads = [
+            threading.Thread(target=save, args=(reviews[i::8],))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.repo.get_all("review")), 200)
+
+    def test_connections_are_closed_with_their_thread(self):
+        """A thread that ends doesn't leave its connection open"""
+        connections = []
+
+        def use():
+            """Open the connection of the thread"""
+            self.repo.get_all("country")
+            connections.append(self.repo.connection)
+
+        for _ in range(3):
+            thread = threading.Thread(target=use)
+            thread.start()
+            thread.join()
+
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+
+        # The connection of this thread is still open
+        self.repo.connection.execute("SELECT 1")
+
+
+class TestShardedPickleRepository(TemporaryDirectoryTestCase):
+    """PickleRepository keeps one pickle file per model"""
+
+    def test_only_dirty_shards_are_written(self):
+        """Saving a review only rewrites the review shard"""
+        repo = PickleRepository()
+        self.assertTrue(os.path.exists("data.country.pkl"))
+
+        for model in ("country", "user", "place"):
+            os.remove(f"data.{model}.pkl")
+
+        repo.save(make_review())
+
+        self.assertTrue(os.path.exists("data.review.pkl"))
+        for model in ("country", "user", "place"):
+            self.assertFalse(os.path.exists(f"data.{model}.pkl"))
+
+    def test_shards_use_protocol_5(self):
+        """Shards are written with pickle protocol 5"""
+        PickleRepository()
+
+        with open("data.country.pkl", "rb") as file:
+            self.assertEqual(file.read(2), b"\x80\x05")
+
+    def test_parallel_load(self):
+        """Loading the shards in parallel gives the same data"""
+        repo = PickleRepository()
+        reviews = [make_review(str(i)) for i in range(10)]
+        for review in reviews:
+            repo.save(review)
+
+        repo = PickleRepository(parallel_load=True)
+
+        self.assertEqual(
+            [review.id for review in repo.get_all("review")],
+            [review.id for review in reviews],
+        )
+        self.assertEqual(len(repo.get_all("country")), 1)
+
+    def test_legacy_file_is_migrated(self):
+        """A single data.pkl from before sharding is split into shards"""
+        review = make_review()
+        with open("data.pkl", "wb") as file:
+            pickle.dump({"country": [], "review": [review]}, file)
+
+        repo = PickleRepository()
+
+        self.assertEqual(repo.get("review", review.id).id, review.id)
+        self.assertTrue(os.path.exists("data.review.pkl"))
+
+    def test_migration_follows_the_flush_policy(self):
+        """The migrated shards are written when the policy says so"""
+        review = make_review()
+        with open("data.pkl", "wb") as file:
+            pickle.dump({"country": [], "review": [review]}, file)
+
+        repo = PickleRepository(flush_policy="on-shutdown")
+
+        self.assertEqual(repo.get("review", review.id).id, review.id)
+        self.assertFalse(os.path.exists("data.review.pkl"))
+
+        repo.flusher.close()
+        self.assertTrue(os.path.exists("data.review.pkl"))
+
+
+class TestBulkOperations(TemporaryDirectoryTestCase):
+    """save_many, update_many and delete_many"""
+
+    def check(self, repo):
+        """Runs the bulk scenario against a repository"""
+        reviews = [make_review(str(i)) for i in range(20)]
+
+        repo.save_many(reviews)
+        self.assertEqual(
+            [r.id for r in repo.find_by("review", place_id="place")],
+            [r.id for r in reviews],
+        )
+
+        for review in reviews:
+            review.comment = "updated"
+        updated = repo.update_many(reviews[:10] + [make_review()])
+        self.assertEqual(
+            [r.id for r in updated], [r.id for r in reviews[:10]]
+        )
+        self.assertEqual(repo.get("review", reviews[0].id).comment, "updated")
+
+        self.assertEqual(repo.delete_many(reviews[5:] + [make_review()]), 15)
+        self.assertEqual(len(repo.find_by("review", place_id="place")), 5)
+
+    def count_writes(self, repo) -> list:
+        """Counts the writes the flusher of a repository does"""
+        writes = []
+        write = repo.flusher.write
+
+        def counting_write():
+            """Count and write"""
+            writes.append(1)
+            write()
+
+        repo.flusher.write = counting_write
+
+        return writes
+
+    def test_memory(self):
+        """MemoryRepository"""
+        repo = MemoryRepository()
+        for review in repo.get_all("review"):
+            repo.delete(review)
+
+        self.check(repo)
+
+    def test_file(self):
+        """FileRepository writes every batch once"""
+        repo = FileRepository()
+        writes = self.count_writes(repo)
+
+        self.check(repo)
+
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(len(FileRepository().get_all("review")), 5)
+
+    def test_file_journaled(self):
+        """FileRepository appends every batch to the journal at once"""
+        repo = FileRepository(journaled=True)
+        writes = self.count_writes(repo)
+
+        self.check(repo)
+
+        self.assertEqual(len(writes), 3)
+        reloaded = FileRepository(journaled=True)
+        self.assertEqual(len(reloaded.get_all("review")), 5)
+
+    def test_pickle(self):
+        """PickleRepository writes every batch once"""
+        repo = PickleRepository()
+        writes = self.count_writes(repo)
+
+        self.check(repo)
+
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(len(PickleRepository().get_all("review")), 5)
+
+    def test_db(self):
+        """DBRepository"""
+        repo = DBRepository()
+        self.check(repo)
+        repo.close()
+
+
+class TestSecondaryIndexes(unittest.TestCase):
+    """SecondaryIndexes bookkeeping"""
+
+    def test_lookup(self):
+        """Ids come back in insertion order, intersected across fields"""
+        indexes = SecondaryIndexes()
+        indexes.add("review", "1", {"place_id": "a", "user_id": "x"})
+        indexes.add("review", "2", {"place_id": "b", "user_id": "x"})
+        indexes.add("review", "3", {"place_id": "a", "user_id": "y"})
+
+        self.assertEqual(indexes.lookup("review", place_id="a"), ["1", "3"])
+        self.assertEqual(
+            indexes.lookup("review", place_id="a", user_id="x"), ["1"]
+        )
+        self.assertEqual(indexes.lookup("review", place_id="c"), [])
+        self.assertIsNone(indexes.lookup("review", comment="a"))
+        self.assertIsNone(indexes.lookup("user", place_id="a"))
+
+    def test_add_replaces_previous_version(self):
+        """Indexing an object again moves it to its new values"""
+        indexes = SecondaryIndexes()
+        indexes.add("review", "1", {"place_id": "a"})
+        indexes.add("review", "1", {"place_id": "b"})
+
+        self.assertEqual(indexes.lookup("review", place_id="a"), [])
+        self.assertEqual(indexes.lookup("review", place_id="b"), ["1"])
+
+        indexes.remove("review", "1")
+        indexes.remove("review", "1")
+        self.assertEqual(indexes.lookup("review", place_id="b"), [])
+
+
+class TestFindBy(TemporaryDirectoryTestCase):
+    """find_by behaves the same in every repository"""
+
+    def check(self, repo):
+        """Runs the find_by scenario against a repository"""
+        first = make_review("first", place_id="a", user_id="x")
+        second = make_review("second", place_id="b", user_id="x")
+        third = make_review("third", place_id="a", user_id="y")
+        for review in (first, second, third):
+            repo.save(review)
+
+        def ids(**field_equals):
+            """Ids of the reviews matching the fields"""
+            return [r.id for r in repo.find_by("review", **field_equals)]
+
+        self.assertEqual(ids(place_id="a"), [first.id, third.id])
+        self.assertEqual(ids(place_id="a", user_id="y"), [third.id])
+        self.assertEqual(ids(place_id="a", comment="first"), [first.id])
+        self.assertEqual(ids(comment="second"), [second.id])
+        self.assertEqual(ids(place_id="missing"), [])
+
+        third.place_id = "b"
+        repo.update(third)
+        self.assertEqual(ids(place_id="a"), [first.id])
+        self.assertEqual(ids(place_id="b"), [second.id, third.id])
+
+        repo.delete(first)
+        self.assertEqual(ids(place_id="a"), [])
+
+    def test_memory(self):
+        """MemoryRepository"""
+        repo = MemoryRepository()
+        for review in repo.get_all("review"):
+            repo.delete(review)
+
+        self.check(repo)
+
+    def test_file(self):
+        """FileRepository, before and after a reload"""
+        repo = FileRepository(journaled=True)
+        self.check(repo)
+
+        repo = FileRepository(journaled=True)
+        self.assertEqual(len(repo.find_by("review", place_id="b")), 2)
+
+    def test_pickle(self):
+        """PickleRepository, before and after a reload"""
+        repo = PickleRepository()
+        self.check(repo)
+
+        repo = PickleRepository()
+        self.assertEqual(len(repo.find_by("review", place_id="b")), 2)
+
+    def test_db(self):
+        """DBRepository"""
+        repo = DBRepository()
+        self.check(repo)
+
+        plan = repo.connection.execute(
+            "EXPLAIN QUERY PLAN "
+            + repo.tables["review"].find_by(("place_id",)),
+            ("a",),
+        ).fetchall()
+        self.assertIn("ix_review_place_id", str(plan))
+        self.assertEqual(repo.find_by("review", unknown="a"), [])
+        repo.close()
+
+
+class TestTextIndex(unittest.TestCase):
+    """Inverted index of the full-text search"""
+
+    def setUp(self):
+        """Index a few reviews"""
+        self.index = TextIndex(TEXT_INDEXES)
+        for obj_id, comment in [
+            ("1", "Wifi, great wifi"),
+            ("2", "The wifi was slow"),
+            ("3", "Wonderful café"),
+        ]:
+            self.index.add("review", obj_id, {"comment": comment})
+
+    def ids(self, query: str) -> list[str]:
+        """Ids matching a query, best first"""
+        return [
+            obj_id
+            for obj_id, _ in self.index.search("review", parse_query(query))
+        ]
+
+    def test_search(self):
+        """Every term must match, ranked with BM25"""
+        self.assertEqual(self.ids("wifi"), ["1", "2"])
+        self.assertEqual(self.ids("great WIFI"), ["1"])
+        self.assertEqual(self.ids("wifi slow"), ["2"])
+        self.assertEqual(self.ids("cafe"), ["3"])
+        self.assertEqual(self.ids("wifi missing"), [])
+
+    def test_prefix(self):
+        """Terms ending with * match the terms they start"""
+        self.assertEqual(sorted(self.ids("w*")), ["1", "2", "3"])
+        self.assertEqual(self.ids("wo*"), ["3"])
+        self.assertEqual(self.ids("wo"), [])
+
+    def test_update_and_remove(self):
+        """Objects indexed again lose their old terms"""
+        self.index.add("review", "3", {"comment": "Slow service"})
+        self.assertEqual(self.ids("wonderful"), [])
+        self.assertEqual(sorted(self.ids("slow")), ["2", "3"])
+
+        self.index.remove("review", "2")
+        self.index.clear("place")
+        self.assertEqual(self.ids("slow"), ["3"])
+        self.assertEqual(self.ids("wo*"), [])
+
+    def test_snippet(self):
+        """Snippets mark the matches around the first one"""
+        terms = parse_query("wif*")
+        text = " ".join(["word"] * 20) + " Wi-Fi and wifi " + "end"
+
+        self.assertEqual(
+            snippet(text, terms),
+            "…word word word word word word word Wi-Fi and <mark>wifi</mark> "
+            "end",
+        )
+        self.assertEqual(snippet("No match", terms), "")
+        self.assertEqual(
+            snippet("<b>wifi</b> & co", terms),
+            "&lt;b&gt;<mark>wifi</mark>&lt;/b&gt; &amp; co",
+        )
+
+
+class TestSearch(TemporaryDirectoryTestCase):
+    """search behaves the same in every repository"""
+
+    def check(self, repo):
+        """Runs the search scenario against a repository"""
+        first = make_review("Wifi, great wifi")
+        second = make_review("The wifi was slow")
+        for review in (first, second):
+            repo.save(review)
+
+        def ids(query: str) -> list[str]:
+            """Ids of the reviews matching the query"""
+            return [r.id for r in repo.search("review", query)]
+
+        self.assertEqual(ids("wifi"), [first.id, second.id])
+        self.assertEqual(ids("sl*"), [second.id])
+
+        second.comment = "Fast"
+        repo.update(second)
+        self.assertEqual(ids("wifi"), [first.id])
+
+        repo.delete(first)
+        self.assertEqual(ids("wifi"), [])
+        self.assertRaises(ValueError, repo.search, "review", "  ")
+
+    def test_memory(self):
+        """MemoryRepository"""
+        repo = MemoryRepository()
+        for review in repo.get_all("review"):
+            repo.delete(review)
+
+        self.check(repo)
+
+    def test_file(self):
+        """FileRepository, before and after a reload"""
+        self.check(FileRepository(journaled=True))
+
+        repo = FileRepository(journaled=True)
+        self.assertEqual(len(repo.search("review", "fast")), 1)
+
+    def test_pickle(self):
+        """PickleRepository, before and after a reload"""
+        self.check(PickleRepository())
+
+        repo = PickleRepository()
+        self.assertEqual(len(repo.search("review", "fast")), 1)
+
+    def test_db(self):
+        """DBRepository, with the default scan"""
+        repo = DBRepository()
+        self.check(repo)
+        repo.close()
+
+
+def save_reviews(repository: type, ids: list[str], **options):
+    """Saves reviews with the given ids from a new repository, used as the
+    target of other processes"""
+    repo = repository(shared=True, **options)
+
+    for obj_id in ids:
+        review = make_review()
+        review.id = obj_id
+        repo.save(review)
+
+
+class TestSharedRepositories(TemporaryDirectoryTestCase):
+    """Repositories in shared mode see what other processes write"""
+
+    def run_in_process(self, repository: type, ids: list[str], **options):
+        """Starts a process saving reviews, returns it"""
+        context = multiprocessing.get_context("fork")
+        process = context.Process(
+            target=save_reviews, args=(repository, ids), kwargs=options
+        )
+        process.start()
+
+        return process
+
+    def check_sees_other_process(self, repository: type, **options):
+        """A write of another process is visible without reloading"""
+        repo = repository(shared=True, **options)
+        obj_id = str(uuid.uuid4())
+
+        process = self.run_in_process(repository, [obj_id], **options)
+        process.join()
+
+        self.assertEqual(process.exitcode, 0)
+        self.assertIsNotNone(repo.get("review", obj_id))
+        self.assertEqual(
+            [r.id for r in repo.find_by("review", place_id="place")],
+            [obj_id],
+        )
+
+    def check_no_lost_writes(self, repository: type, **options):
+        """Two processes writing at once keep every write"""
+        repo = repository(shared=True, **options)
+        theirs = [str(uuid.uuid4()) for _ in range(50)]
+
+        process = self.run_in_process(repository, theirs, **options)
+
+        mine = []
+        for _ in range(50):
+            review = make_review()
+            repo.save(review)
+            mine.append(review.id)
+
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        ids = {review.id for review in repo.get_all("review")}
+        self.assertEqual(ids, set(mine + theirs))
+
+        # And so does what ends up on disk
+        ids = {
+            review.id
+            for review in repository(**options).get_all("review")
+        }
+        self.assertEqual(ids, set(mine + theirs))
+
+    def test_generation_is_bumped(self):
+        """Every write of a shared repository bumps the generation"""
+        repo = FileRepository(shared=True)
+        generation = repo.shared.generation()
+
+        repo.save(make_review())
+
+        self.assertEqual(repo.shared.generation(), generation + 1)
+        self.assertFalse(repo.shared.changed())
+
+    def test_file(self):
+        """FileRepository"""
+        self.check_sees_other_process(FileRepository)
+
+    def test_file_no_lost_writes(self):
+        """FileRepository"""
+        self.check_no_lost_writes(FileRepository)
+
+    def test_file_journaled(self):
+        """Journaled FileRepository"""
+        self.check_sees_other_process(FileRepository, journaled=True)
+
+    def test_file_journaled_no_lost_writes(self):
+        """Journaled FileRepository, compacting along the way"""
+        self.check_no_lost_writes(
+            FileRepository, journaled=True, compact_threshold=20
+        )
+
+    def test_pickle(self):
+        """PickleRepository"""
+        self.check_sees_other_process(PickleRepository)
+
+    def test_pickle_no_lost_writes(self):
+        """PickleRepository"""
+        self.check_no_lost_writes(PickleRepository)
+
+
+class TestRWLock(unittest.TestCase):
+    """RWLock lets readers in together and writers alone"""
+
+    def test_readers_share(self):
+        """A reader doesn't wait for another reader"""
+        lock = RWLock()
+        inside = threading.Event()
+
+        def read():
+            with lock.read():
+                inside.set()
+
+        with lock.read():
+            thread = threading.Thread(target=read)
+            thread.start()
+            self.assertTrue(inside.wait(1))
+
+        thread.join()
+
+    def test_writer_excludes_readers(self):
+        """A reader waits for the writer to finish"""
+        lock = RWLock()
+        inside = threading.Event()
+
+        def read():
+            with lock.read():
+                inside.set()
+
+        with lock.write():
+            thread = threading.Thread(target=read)
+            thread.start()
+            self.assertFalse(inside.wait(0.1))
+
+        self.assertTrue(inside.wait(1))
+        thread.join()
+
+    def test_writer_is_reentrant(self):
+        """The writer can lock again, for reading or writing"""
+        lock = RWLock()
+
+        with lock.write():
+            with lock.write():
+                with lock.read():
+                    pass
+
+
+class TestConcurrentRepository(TemporaryDirectoryTestCase):
+    """ConcurrentRepository keeps repositories consistent under threads"""
+
+    def test_snapshot_is_reused_until_a_write(self):
+        """get_all reuses the snapshot until the model changes"""
+        repo = ConcurrentRepository(FileRepository())
+        calls = []
+        get_all = repo.repo.get_all
+
+        def counting_get_all(model_name):
+            calls.append(model_name)
+            return get_all(model_name)
+
+        repo.repo.get_all = counting_get_all
+
+        repo.get_all("review")
+        repo.get_all("review")
+        self.assertEqual(calls, ["review"])
+
+        review = make_review()
+        repo.save(review)
+        self.assertEqual(repo.get("review", review.id), review)
+        self.assertEqual(repo.get_all("review"), [review])
+        self.assertEqual(calls, ["review", "review"])
+
+        # Other models keep their snapshot
+        repo.get_all("country")
+        repo.save(make_review())
+        repo.get_all("country")
+        self.assertEqual(calls, ["review", "review", "country"])
+
+        # So does a model when nothing changed
+        repo.get_all("review")
+        missing = make_review()
+        self.assertIsNone(repo.update(missing))
+        self.assertFalse(repo.delete(missing))
+        self.assertEqual(repo.update_many([missing]), [])
+        self.assertEqual(repo.delete_many([missing]), 0)
+        repo.get_all("review")
+        self.assertEqual(calls, ["review", "review", "country", "review"])
+
+    def test_lazy_records_are_built_once(self):
+        """Readers racing on a record that wasn't accessed yet all get
+        the same instance"""
+        repo = FileRepository()
+        reviews = [make_review() for _ in range(50)]
+        repo.save_many(reviews)
+        repo.reload()
+        repo = ConcurrentRepository(repo)
+        barrier = threading.Barrier(8)
+        found = [[] for _ in range(8)]
+
+        def read(mine: list):
+            barrier.wait()
+            for review in reviews:
+                mine.append(repo.get("review", review.id))
+
+        threads = [
+            threading.Thread(target=read, args=(mine,)) for mine in found
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(len(reviews)):
+            self.assertEqual(len({id(mine[i]) for mine in found}), 1)
+        self.assertIs(found[0][0], repo.get("review", reviews[0].id))
+
+    def stress(self, repo: Repository):
+        """Hammers a repository with mixed reads and writes from many
+        threads, and checks nothing is torn or lost"""
+        place_id = str(uuid.uuid4())
+        errors = []
+        kept = [set() for _ in range(8)]
+        writing = threading.Event()
+        writing.set()
+
+        def write(mine: set):
+            try:
+                for i in range(100):
+                    review = make_review(place_id=place_id)
+                    repo.save(review)
+                    review.comment = str(i)
+                    repo.update(review)
+
+                    if i % 2:
+                        repo.delete(review)
+                    else:
+                        mine.add(review.id)
+
+                    if i % 25 == 0:
+                        with repo.batch():
+                            extra = [
+                                make_review(place_id=place_id)
+                                for _ in range(5)
+                            ]
+                            repo.save_many(extra)
+                            repo.delete_many(extra)
+            except Exception as error:
+                errors.append(error)
+
+        def read():
+            try:
+                while writing.is_set():
+                    reviews = repo.get_all("review")
+                    ids = [review.id for review in reviews]
+                    self.assertEqual(len(ids), len(set(ids)))
+
+                    for review in reviews[-10:]:
+                        repo.get("review", review.id)
+
+                    for review in repo.find_by("review", place_id=place_id):
+                        self.assertEqual(review.place_id, place_id)
+            except Exception as error:
+                errors.append(error)
+
+        writers = [
+            threading.Thread(target=write, args=(mine,)) for mine in kept
+        ]
+        readers = [threading.Thread(target=read) for _ in range(8)]
+
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+        expected = set().union(*kept)
+        found = repo.find_by("review", place_id=place_id)
+        self.assertEqual({review.id for review in found}, expected)
+        self.assertEqual(
+            {
+                review.id for review in repo.get_all("review")
+                if review.place_id == place_id
+            },
+            expected,
+        )
+
+    def test_stress_memory(self):
+        """MemoryRepository"""
+        self.stress(ConcurrentRepository(MemoryRepository()))
+
+    def test_stress_file(self):
+        """FileRepository, journaled and batched"""
+        repo = FileRepository(journaled=True, flush_policy="batched")
+        self.stress(ConcurrentRepository(repo))
+        repo.flusher.close()
+
+    def test_stress_pickle(self):
+        """PickleRepository, batched"""
+        repo = PickleRepository(flush_policy="batched")
+        self.stress(ConcurrentRepository(repo))
+        repo.flusher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,4 +3,11 @@
 REPOSITORY_ENV_VAR = "REPOSITORY"
 
 FILE_STORAGE_FILENAME = "data.json"
+FILE_STORAGE_JOURNAL_FILENAME = "data.jsonl"
+FILE_STORAGE_MODE_ENV_VAR = "FILE_STORAGE_MODE"
+FILE_STORAGE_COMPACT_THRESHOLD = 1000
 PICKLE_STORAGE_FILENAME = "data.pkl"
+PICKLE_SHARD_FILENAME = "data.{model}.pkl"
+DB_STORAGE_FILENAME = "data.db"
+SHARED_LOCK_FILENAME = "data.lock"
+SHARED_GENERATION_FILENAME = "data.generation"
@@ -0,0 +1,174 @@
+""" Geohash encoding and haversine distances for the place search
+
+A geohash interleaves the bits of the longitude and the latitude of a
+point and writes them in base 32, so points that are close share a prefix
+and a B-tree index on the geohash answers "every point in this cell" with
+a range scan. The cells covering an area are used to get the candidates,
+and the exact distances are computed on them only.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:  # optional, the distances are computed in Python
+    numpy = None
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Sorts right after every geohash character, ends the range of a prefix
+PREFIX_END = "{"
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode_geohash(
+    latitude: float, longitude: float, precision: int = GEOHASH_PRECISION
+) -> str:
+    """Returns the geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        interval, coordinate = (
+            (lon_range, longitude) if even else (lat_range, latitude)
+        )
+        middle = (interval[0] + interval[1]) / 2
+
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+
+        even = not even
+        bits += 1
+
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """Returns the height and width in degrees of the cells of a
+    precision"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def covering_cells(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    max_cells: int = 32,
+) -> list[str]:
+    """Returns the geohash prefixes of the cells covering a box, with the
+    longest precision that needs at most `max_cells` cells. An empty list
+    means the box is too big to be worth it and everything is a
+    candidate"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(max_lat / height) - math.floor(min_lat / height)
+        columns = math.floor(max_lon / width) - math.floor(min_lon / width)
+
+        if (rows + 1) * (columns + 1) > max_cells:
+            continue
+
+        # Stepping one cell at a time from the corner visits every cell
+        return sorted({
+            encode_geohash(
+                min(min_lat + row * height, max_lat),
+                min(min_lon + column * width, max_lon),
+                precision,
+            )
+            for row in range(rows + 1)
+            for column in range(columns + 1)
+        })
+
+    return []
+
+
+def bounding_boxes(
+    latitude: float, longitude: float, radius_km: float
+) -> list[tuple[float, float, float, float]]:
+    """Returns the boxes (min_lat, min_lon, max_lat, max_lon) containing
+    the circle around a point: two when it crosses the antimeridian, split
+    there, and one spanning every longitude when it covers a pole"""
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat = latitude - delta_lat
+    max_lat = latitude + delta_lat
+
+    if min_lat <= -90 or max_lat >= 90:
+        return [(max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0)]
+
+    # The circle is widest closer to the pole than its center, the
+    # meridians tangent to it are this far apart. Without a pole inside,
+    # the ratio is below 1
+    angle = radius_km / EARTH_RADIUS_KM
+    delta_lon = math.degrees(math.asin(
+        math.sin(angle) / math.cos(math.radians(latitude))
+    ))
+    min_lon = longitude - delta_lon
+    max_lon = longitude + delta_lon
+
+    if min_lon < -180:
+        return [
+            (min_lat, min_lon + 360, max_lat, 180.0),
+            (min_lat, -180.0, max_lat, max_lon),
+        ]
+    if max_lon > 180:
+        return [
+            (min_lat, min_lon, max_lat, 180.0),
+            (min_lat, -180.0, max_lat, max_lon - 360),
+        ]
+
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def haversine_km(
+    latitude: float, longitude: float, latitudes: list, longitudes: list
+) -> list[float]:
+    """Returns the distances in km from a point to many points at once,
+    with numpy when it is installed"""
+    if numpy is not None:
+        lat1 = numpy.radians(latitude)
+        lat2 = numpy.radians(numpy.asarray(latitudes, dtype=float))
+        dlat = lat2 - lat1
+        dlon = numpy.radians(
+            numpy.asarray(longitudes, dtype=float) - longitude
+        )
+        a = (
+            numpy.sin(dlat / 2) ** 2
+            + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin(dlon / 2) ** 2
+        )
+
+        c = numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+
+        return (2 * EARTH_RADIUS_KM * c).tolist()
+
+    lat1 = math.radians(latitude)
+    cos_lat1 = math.cos(lat1)
+    distances = []
+
+    for lat, lon in zip(latitudes, longitudes):
+        lat2 = math.radians(lat)
+        a = (
+            math.sin((lat2 - lat1) / 2) ** 2
+            + cos_lat1 * math.cos(lat2)
+            * math.sin(math.radians(lon - longitude) / 2) ** 2
+        )
+        c = math.asin(math.sqrt(min(a, 1)))
+        distances.append(2 * EARTH_RADIUS_KM * c)
+
+    return distances
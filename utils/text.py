@@ -0,0 +1,291 @@
+""" Tokenization, queries, BM25, snippets and the in-memory inverted index
+of the full-text search
+
+Text is split like the `unicode61 remove_diacritics 2` tokenizer of
+SQLite FTS5 does: runs of letters and digits, lowercased and without
+accents, so the in-memory index and the FTS5 table agree on what a term
+is. A query is a list of terms that must all match, where a term ending
+with `*` matches every term it is a prefix of.
+
+Snippets are HTML: their text is escaped and the matches wrapped in MARK.
+The matches are first delimited with control characters, which escaping
+leaves as they are and text doesn't normally contain.
+"""
+
+from bisect import bisect_left, insort
+import html
+import math
+import re
+import unicodedata
+from typing import Any, Callable
+
+TOKEN = re.compile(r"[^\W_]+")
+# BM25 parameters, the same as the bm25() function of FTS5
+K1 = 1.2
+B = 0.75
+SNIPPET_TOKENS = 12
+MARK = ("<mark>", "</mark>")
+# Delimit the matches until the text is escaped
+SENTINELS = ("\x02", "\x03")
+ELLIPSIS = "…"
+
+
+def normalize(token: str) -> str:
+    """Lowercases a token and removes its accents"""
+    decomposed = unicodedata.normalize("NFKD", token.lower())
+
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Returns the terms of a text, in order"""
+    if not text:
+        return []
+
+    return [normalize(match) for match in TOKEN.findall(text)]
+
+
+def parse_query(query: str) -> list[tuple[str, bool]]:
+    """Returns the terms of a query and whether each one is a prefix.
+    Raises ValueError when it has none"""
+    terms = []
+
+    for word in query.split():
+        tokens = tokenize(word)
+
+        for i, token in enumerate(tokens):
+            terms.append((token, word.endswith("*") and i == len(tokens) - 1))
+
+    if not terms:
+        raise ValueError("The query has no terms")
+
+    return list(dict.fromkeys(terms))
+
+
+def fts_query(terms: list[tuple[str, bool]]) -> str:
+    """Writes parsed terms in the query syntax of FTS5. Terms are only
+    letters and digits, quoting them keeps FTS5 operators out"""
+    return " ".join(
+        f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms
+    )
+
+
+def matcher(terms: list[tuple[str, bool]]) -> Callable[[str], bool]:
+    """Returns whether a term of a text matches one of the query"""
+    exact = {term for term, prefix in terms if not prefix}
+    prefixes = tuple(term for term, prefix in terms if prefix)
+
+    return lambda token: token in exact or token.startswith(prefixes)
+
+
+def bm25(
+    frequency: float, length: int, average: float, documents: int,
+    matching: int,
+) -> float:
+    """BM25 score of a term in a document, from its frequency in the
+    document, the length of the document, the average length, and how
+    many documents there are and have the term"""
+    idf = math.log(1 + (documents - matching + 0.5) / (matching + 0.5))
+    norm = K1 * (1 - B + B * length / (average or 1))
+
+    return idf * frequency * (K1 + 1) / (frequency + norm)
+
+
+def snippet(text: str | None, terms: list[tuple[str, bool]]) -> str:
+    """Returns the part of a text around its first match, with the
+    matching terms marked, like the snippet() function of FTS5"""
+    tokens = list(TOKEN.finditer(text or ""))
+    matches = matcher(terms)
+    hits = {i for i, token in enumerate(tokens) if matches(
+        normalize(token.group())
+    )}
+
+    if not hits:
+        return ""
+
+    start = max(0, min(min(hits), len(tokens) - SNIPPET_TOKENS))
+    end = min(len(tokens), start + SNIPPET_TOKENS)
+    parts = []
+    position = tokens[start].start() if start > 0 else 0
+
+    for i in range(start, end):
+        token = tokens[i]
+        parts.append(text[position:token.start()])
+
+        if i in hits:
+            parts.append(SENTINELS[0] + token.group() + SENTINELS[1])
+        else:
+            parts.append(token.group())
+
+        position = token.end()
+
+    if end == len(tokens):
+        parts.append(text[position:])
+
+    return markup(
+        (ELLIPSIS if start > 0 else "")
+        + "".join(parts)
+        + (ELLIPSIS if end < len(tokens) else "")
+    )
+
+
+def markup(text: str) -> str:
+    """Escapes the HTML of a snippet whose matches are delimited by
+    SENTINELS, and wraps them in MARK"""
+    return html.escape(text, quote=False).replace(
+        SENTINELS[0], MARK[0]
+    ).replace(SENTINELS[1], MARK[1])
+
+
+def field_of(record: Any, field: str) -> Any:
+    """Gets a field of an object, or of the dict of a record"""
+    if isinstance(record, dict):
+        return record.get(field)
+
+    return getattr(record, field, None)
+
+
+class TextIndex:
+    """In-memory inverted index from terms to the objects whose text
+    fields contain them, ranked with BM25"""
+
+    def __init__(self, declared: dict[str, dict[str, float]]) -> None:
+        """Starts with empty indexes for the declared models, by name,
+        with the weight of each of their text fields"""
+        self.declared = declared
+
+        # model -> term -> id -> weighted frequency
+        self.__postings: dict[str, dict[str, dict[str, float]]] = {
+            model: {} for model in declared
+        }
+        # model -> id -> (terms, length)
+        self.__documents: dict[str, dict[str, tuple[set, int]]] = {
+            model: {} for model in declared
+        }
+        # model -> every term, sorted, to find those with a prefix
+        self.__terms: dict[str, list[str]] = {model: [] for model in declared}
+        self.__lengths: dict[str, int] = {model: 0 for model in declared}
+
+    def add(self, model: str, obj_id: str, record: Any) -> None:
+        """Indexes the text of an object, or of the dict of a record,
+        replacing a previous version"""
+        fields = self.declared.get(model)
+
+        if not fields:
+            return
+
+        self.remove(model, obj_id)
+
+        frequencies = {}
+        length = 0
+
+        for field, weight in fields.items():
+            terms = tokenize(field_of(record, field))
+            length += len(terms)
+
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+
+        postings = self.__postings[model]
+
+        for term, frequency in frequencies.items():
+            if term not in postings:
+                postings[term] = {}
+                insort(self.__terms[model], term)
+            postings[term][obj_id] = frequency
+
+        self.__documents[model][obj_id] = (set(frequencies), length)
+        self.__lengths[model] += length
+
+    def remove(self, model: str, obj_id: str) -> None:
+        """Removes an object from the index"""
+        if model not in self.declared:
+            return
+
+        document = self.__documents[model].pop(obj_id, None)
+
+        if document is None:
+            return
+
+        terms, length = document
+        postings = self.__postings[model]
+        self.__lengths[model] -= length
+
+        for term in terms:
+            del postings[term][obj_id]
+
+            if not postings[term]:
+                del postings[term]
+                sorted_terms = self.__terms[model]
+                del sorted_terms[bisect_left(sorted_terms, term)]
+
+    def clear(self, model: str | None = None) -> None:
+        """Empties the index of a model, or every index"""
+        for name in self.declared:
+            if model is not None and name != model:
+                continue
+
+            self.__postings[name].clear()
+            self.__documents[name].clear()
+            self.__terms[name].clear()
+            self.__lengths[name] = 0
+
+    def expand(self, model: str, term: str, prefix: bool) -> list[str]:
+        """Returns the indexed terms a term of a query matches"""
+        if not prefix:
+            return [term] if term in self.__postings[model] else []
+
+        sorted_terms = self.__terms[model]
+        start = bisect_left(sorted_terms, term)
+        end = start
+
+        while end < len(sorted_terms) and sorted_terms[end].startswith(term):
+            end += 1
+
+        return sorted_terms[start:end]
+
+    def search(
+        self, model: str, terms: list[tuple[str, bool]]
+    ) -> list[tuple[str, float]]:
+        """Returns the ids of the objects matching every term of a parsed
+        query (see parse_query) and their scores, best first"""
+        if model not in self.declared:
+            return []
+
+        postings = self.__postings[model]
+        documents = self.__documents[model]
+        average = self.__lengths[model] / (len(documents) or 1)
+
+        # The rarest terms first, so the candidates shrink the soonest
+        expanded = sorted(
+            (self.expand(model, term, prefix) for term, prefix in terms),
+            key=lambda matches: sum(len(postings[m]) for m in matches),
+        )
+        scores = None
+
+        for matches in expanded:
+            term_scores = {}
+
+            for match in matches:
+                ids = postings[match]
+
+                for obj_id, frequency in ids.items():
+                    if scores is not None and obj_id not in scores:
+                        continue
+
+                    term_scores[obj_id] = term_scores.get(obj_id, 0.0) + bm25(
+                        frequency, documents[obj_id][1], average,
+                        len(documents), len(ids),
+                    )
+
+            scores = {
+                obj_id: score + (scores or {}).get(obj_id, 0.0)
+                for obj_id, score in term_scores.items()
+            }
+
+            if not scores:
+                return []
+
+        return sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))